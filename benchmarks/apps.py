@@ -0,0 +1,126 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Imports one of the example FastAPI apps the same way run.sh lays out PYTHONPATH in Lambda. Both apps have a
+# top-level `main` module, so a benchmark process loads only one of them.
+
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+EXAMPLES = Path(__file__).resolve().parent.parent / "examples"
+
+APP_PATHS = {
+    "rag": [EXAMPLES / "serverless_assistant_rag" / "app"],
+    "web": [
+        EXAMPLES / "sample_web_application" / "app",
+        EXAMPLES / "sample_web_application" / "app" / "api_models",
+        EXAMPLES / "sample_web_application" / "dependencies" / "python",
+    ],
+}
+
+
+# Placeholder settings the apps read at import time
+APP_ENV = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "benchmark",
+    "AWS_SECRET_ACCESS_KEY": "benchmark",
+    "TABLE_NAME": "benchmark-config",
+    "STATEMACHINE_STATE_MACHINE_ARN": "arn:aws:states:us-east-1:123456789012:stateMachine:benchmark",
+}
+
+
+def app_environ(name, **overrides):
+    """Environment for running the `rag` or `web` app in a subprocess."""
+    env = {**os.environ, **APP_ENV, **overrides}
+    env["PYTHONPATH"] = os.pathsep.join(str(path) for path in APP_PATHS[name])
+    return env
+
+
+def load_app(name):
+    """Return the `main` module of the `rag` or `web` example app."""
+    for key, value in APP_ENV.items():
+        os.environ.setdefault(key, value)
+    for path in reversed(APP_PATHS[name]):
+        sys.path.insert(0, str(path))
+    import main
+    return main
+
+
+def conversation_turns(question, turns):
+    """(role, text) of a conversation of `turns` user messages ending with `question`, answered in between."""
+    messages = []
+    for turn in range(turns - 1):
+        messages += [("user", f"Earlier question {turn} about the service?"),
+                     ("assistant", f"Earlier answer {turn}. " + "The service is managed and serverless. " * 20)]
+    return messages + [("user", question)]
+
+
+def request_body(name, stream_format="text", question="What is AWS?", max_tokens=1000, turns=1, account_id="benchmark",
+                 **assistant_parameters):
+    """Path, headers and JSON body of one streaming request to the `rag` or `web` app, with `turns` user messages.
+    The web app requests are sent by `account_id`."""
+    messages = conversation_turns(question, turns)
+    if name == "web":
+        body = {
+            "bedrock_converse_parameters": {
+                "model_id": "anthropic.claude-3-haiku-20240307-v1:0",
+                "messages": [{"role": role, "content": [{"text": text}]} for role, text in messages],
+                "system_prompts": [{"text": "You are a benchmark."}],
+                "inference_config": {"maxTokens": max_tokens},
+            },
+            "assistant_parameters": {"workflow_params": {"workflow_id": "workflow#details#1"},
+                                     "stream_format": stream_format, **assistant_parameters},
+        }
+        headers = {"x-access-token": json.dumps({"custom:account_id": account_id})}
+        return "/bedrock_converse_api", headers, body
+    body = {
+        "bedrock_parameters": {"messages": [{"role": role, "content": text} for role, text in messages],
+                               "max_tokens": max_tokens},
+        "assistant_parameters": {"messages_to_sample": 5, "stream_format": stream_format, **assistant_parameters},
+    }
+    return "/bedrock_claude_messages_api", {}, body
+
+
+async def call_asgi(app, path, headers, body, disconnect_after=None):
+    """POST to the ASGI app like a client that goes away `disconnect_after` seconds after sending the request.
+
+    Returns the status, the body chunks with their arrival time and the disconnect time (perf_counter).
+    """
+    disconnected = asyncio.Event()
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    response = {"status": None, "chunks": [], "disconnected_at": None}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body" and message.get("body"):
+            response["chunks"].append((time.perf_counter(), message["body"]))
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.3"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "client": ("127.0.0.1", 50000), "server": ("benchmark", 80),
+        "headers": [(b"content-type", b"application/json")]
+                   + [(key.lower().encode(), value.encode()) for key, value in headers.items()],
+    }
+    call = asyncio.ensure_future(app(scope, receive, send))
+    if disconnect_after is not None:
+        done, _ = await asyncio.wait([call], timeout=disconnect_after)
+        if not done:
+            response["disconnected_at"] = time.perf_counter()
+            disconnected.set()
+    await call
+    return response
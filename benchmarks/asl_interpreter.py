@@ -0,0 +1,507 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Local interpreter for the subset of the Amazon States Language used by the example state machines
+# (statemachine/rag_parallel_tasks/*.asl.json): Pass, Task, Choice and Parallel states, InputPath /
+# Parameters / ResultSelector / ResultPath / OutputPath with JSONPath and the intrinsic functions the definitions
+# call, and Catch. Task resources are served by handlers, e.g. FakeBedrockModels and FakeKnowledgeBase of fakes.py,
+# so a workflow can be run, timed and regression tested without an AWS account.
+#
+# Every execution records a trace of its states (start and end time, output size, branches), from which
+# critical_path() returns the states that made up its duration.
+
+import asyncio
+import json
+import re
+import time
+from pathlib import Path
+
+from apps import EXAMPLES
+
+STATE_MACHINE_DIRS = {
+    "rag": EXAMPLES / "serverless_assistant_rag" / "statemachine" / "rag_parallel_tasks",
+    "web": EXAMPLES / "sample_web_application" / "statemachine" / "rag_parallel_tasks",
+}
+# Definitions by variant: the Retrieve after the Parallel state, or a speculative one in it
+STATE_MACHINE_VARIANTS = {"standard": "RagGenAI.asl.json", "speculative": "RagGenAISpeculative.asl.json"}
+
+# Resources of the service integrations the example state machines use
+INVOKE_MODEL = "arn:aws:states:::bedrock:invokeModel"
+RETRIEVE = "arn:aws:states:::aws-sdk:bedrockagentruntime:retrieve"
+
+# Error name prefix of the service integrations, e.g. BedrockAgentRuntime.ResourceNotFoundException
+SERVICE_ERROR_PREFIXES = {"bedrock": "Bedrock", "bedrockagentruntime": "BedrockAgentRuntime"}
+
+SUPPORTED_STATE_TYPES = ("Pass", "Task", "Choice", "Parallel")
+# States.ALL does not match these errors
+UNCATCHABLE_ERRORS = ("States.Runtime", "States.DataLimitExceeded")
+
+
+class StatesError(Exception):
+    """An error of a state, by its States Language name (States.Runtime, Bedrock.ThrottlingException...)."""
+
+    def __init__(self, error, cause=""):
+        super().__init__(f"{error}: {cause}")
+        self.error = error
+        self.cause = cause
+
+
+class NotSupported(ValueError):
+    """The definition uses a feature this interpreter does not implement."""
+
+
+def load_definition(path, substitutions=None):
+    """Definition of an .asl.json file with its ${Name} DefinitionSubstitutions replaced."""
+    text = Path(path).read_text()
+    for name, value in (substitutions or {}).items():
+        text = text.replace("${" + name + "}", value)
+    return json.loads(text)
+
+
+# JSONPath
+
+_PATH_SEGMENT = re.compile(r"\.([^.\[]+)|\[([^\]]*)\]")
+
+
+def parse_path(path):
+    """Segments of a JSONPath: ("key", name), ("index", i), ("slice", start, end), ("union", [i...]) or
+    ("wildcard",)."""
+    if not path.startswith("$"):
+        raise NotSupported(f"Unsupported JSONPath: {path}")
+    # "$.a.[2]" is read as "$.a[2]"
+    rest = path[1:].replace(".[", "[")
+    segments = []
+    position = 0
+    while position < len(rest):
+        match = _PATH_SEGMENT.match(rest, position)
+        if not match:
+            raise NotSupported(f"Unsupported JSONPath: {path}")
+        if match.group(1) is not None:
+            segments.append(("key", match.group(1)))
+        else:
+            segments.append(_parse_selector(match.group(2).strip(), path))
+        position = match.end()
+    return segments
+
+
+def _parse_selector(selector, path):
+    if selector == "*":
+        return ("wildcard",)
+    if selector[:1] in ("'", '"'):
+        return ("key", selector[1:-1])
+    try:
+        if ":" in selector:
+            start, end = (int(part) if part.strip() else None for part in selector.split(":", 1))
+            return ("slice", start, end)
+        if "," in selector:
+            return ("union", [int(part) for part in selector.split(",")])
+        return ("index", int(selector))
+    except ValueError:
+        raise NotSupported(f"Unsupported JSONPath: {path}")
+
+
+def query(data, path):
+    """Value at a definite path, or the list of matches of a path with a wildcard, slice or union."""
+    nodes = [data]
+    definite = True
+    for segment in parse_path(path):
+        kind = segment[0]
+        matches = []
+        for node in nodes:
+            if kind == "key":
+                if isinstance(node, dict) and segment[1] in node:
+                    matches.append(node[segment[1]])
+            elif kind == "index":
+                if isinstance(node, list) and -len(node) <= segment[1] < len(node):
+                    matches.append(node[segment[1]])
+            elif kind == "wildcard":
+                if isinstance(node, list):
+                    matches.extend(node)
+                elif isinstance(node, dict):
+                    matches.extend(node.values())
+            elif kind == "slice":
+                if isinstance(node, list):
+                    matches.extend(node[segment[1]:segment[2]])
+            elif kind == "union":
+                if isinstance(node, list):
+                    matches.extend(node[index] for index in segment[1] if -len(node) <= index < len(node))
+        if kind in ("wildcard", "slice", "union"):
+            definite = False
+        nodes = matches
+    if not definite:
+        return nodes
+    if not nodes:
+        raise StatesError("States.Runtime", f"The JSONPath '{path}' could not be found in the input")
+    return nodes[0]
+
+
+def set_path(data, path, value):
+    """Copy of data with value at the ResultPath: "$" replaces it, "$.a.b" sets the field, None discards value."""
+    if path is None:
+        return data
+    if path == "$":
+        return value
+    segments = parse_path(path)
+    if any(segment[0] != "key" for segment in segments):
+        raise NotSupported(f"Unsupported ResultPath: {path}")
+    output = dict(data) if isinstance(data, dict) else {}
+    node = output
+    for _, key in segments[:-1]:
+        node[key] = dict(node[key]) if isinstance(node.get(key), dict) else {}
+        node = node[key]
+    node[segments[-1][1]] = value
+    return output
+
+
+# Intrinsic functions
+
+_INTRINSIC = re.compile(r"^(States\.\w+)\((.*)\)$", re.DOTALL)
+
+
+def _split_arguments(text):
+    arguments, current, depth, quoted = [], [], 0, False
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if quoted:
+            current.append(char)
+            if char == "\\" and index + 1 < len(text):
+                current.append(text[index + 1])
+                index += 1
+            elif char == "'":
+                quoted = False
+        elif char == "'":
+            quoted = True
+            current.append(char)
+        elif char in "([":
+            depth += 1
+            current.append(char)
+        elif char in ")]":
+            depth -= 1
+            current.append(char)
+        elif char == "," and depth == 0:
+            arguments.append("".join(current).strip())
+            current = []
+        else:
+            current.append(char)
+        index += 1
+    if current or arguments:
+        arguments.append("".join(current).strip())
+    return arguments
+
+
+def _argument(text, data):
+    if text.startswith("'"):
+        return re.sub(r"\\(['\\])", r"\1", text[1:-1])
+    if text.startswith("$"):
+        return query(data, text)
+    if text.startswith("States."):
+        return evaluate(text, data)
+    return json.loads(text)
+
+
+def format_argument(value):
+    """A States.Format argument in the output string: strings as is, other values as JSON."""
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _format(template, *values):
+    parts = re.split(r"(?<!\\)\{\}", template)
+    if len(parts) - 1 != len(values):
+        raise StatesError("States.Runtime", f"States.Format expects {len(parts) - 1} arguments, got {len(values)}")
+    output = parts[0]
+    for value, part in zip(values, parts[1:]):
+        output += format_argument(value) + part
+    return output.replace("\\{", "{").replace("\\}", "}")
+
+
+def _string_to_json(text):
+    try:
+        return json.loads(text)
+    except (TypeError, ValueError):
+        raise StatesError("States.Runtime", f"States.StringToJson argument is not valid JSON: {text!r}")
+
+
+def _array_get_item(array, index):
+    if not isinstance(array, list) or not -len(array) <= index < len(array):
+        raise StatesError("States.Runtime", f"States.ArrayGetItem index {index} out of bounds")
+    return array[index]
+
+
+INTRINSICS = {
+    "States.Format": _format,
+    "States.MathAdd": lambda first, second: first + second,
+    "States.JsonToString": lambda value: json.dumps(value, ensure_ascii=False, separators=(",", ":")),
+    "States.StringToJson": _string_to_json,
+    "States.ArrayGetItem": _array_get_item,
+    "States.Array": lambda *values: list(values),
+    "States.ArrayLength": len,
+}
+
+
+def evaluate(expression, data):
+    """Value of a ".$" field: a JSONPath or an intrinsic function call."""
+    match = _INTRINSIC.match(expression.strip())
+    if not match:
+        return query(data, expression)
+    name, arguments = match.groups()
+    function = INTRINSICS.get(name)
+    if function is None:
+        raise NotSupported(f"Unsupported intrinsic function: {name}")
+    return function(*(_argument(argument, data) for argument in _split_arguments(arguments)))
+
+
+def resolve(template, data):
+    """Payload template (Parameters, ResultSelector) resolved against data."""
+    if isinstance(template, dict):
+        resolved = {}
+        for key, value in template.items():
+            if key.endswith(".$"):
+                resolved[key[:-2]] = evaluate(value, data)
+            else:
+                resolved[key] = resolve(value, data)
+        return resolved
+    if isinstance(template, list):
+        return [resolve(item, data) for item in template]
+    return template
+
+
+# Choice rules
+
+_COMPARISONS = {
+    "BooleanEquals": lambda value, expected: isinstance(value, bool) and value == expected,
+    "StringEquals": lambda value, expected: isinstance(value, str) and value == expected,
+    "NumericEquals": lambda value, expected: _is_number(value) and value == expected,
+    "NumericLessThan": lambda value, expected: _is_number(value) and value < expected,
+    "NumericLessThanEquals": lambda value, expected: _is_number(value) and value <= expected,
+    "NumericGreaterThan": lambda value, expected: _is_number(value) and value > expected,
+    "NumericGreaterThanEquals": lambda value, expected: _is_number(value) and value >= expected,
+    "IsNull": lambda value, expected: (value is None) == expected,
+    "IsBoolean": lambda value, expected: isinstance(value, bool) == expected,
+    "IsString": lambda value, expected: isinstance(value, str) == expected,
+    "IsNumeric": lambda value, expected: _is_number(value) == expected,
+}
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def matches(rule, data):
+    if "And" in rule:
+        return all(matches(inner, data) for inner in rule["And"])
+    if "Or" in rule:
+        return any(matches(inner, data) for inner in rule["Or"])
+    if "Not" in rule:
+        return not matches(rule["Not"], data)
+    if "IsPresent" in rule:
+        try:
+            query(data, rule["Variable"])
+            present = True
+        except StatesError:
+            present = False
+        return present == rule["IsPresent"]
+    value = query(data, rule["Variable"])
+    for operator, compare in _COMPARISONS.items():
+        if operator in rule:
+            return compare(value, rule[operator])
+        if operator + "Path" in rule:
+            return compare(value, query(data, rule[operator + "Path"]))
+    raise NotSupported(f"Unsupported Choice rule: {json.dumps(rule)}")
+
+
+# Execution
+
+def task_error(resource, error):
+    """States Language error name of an exception raised by a Task handler."""
+    if isinstance(error, StatesError):
+        return error.error, error.cause
+    response = getattr(error, "response", None)
+    if isinstance(response, dict) and "Error" in response:
+        service = resource.split(":::", 1)[-1].split(":")
+        service = service[1] if service[0] == "aws-sdk" else service[0]
+        prefix = SERVICE_ERROR_PREFIXES.get(service, service.capitalize())
+        return f"{prefix}.{response['Error'].get('Code')}", str(error)
+    return type(error).__name__, str(error)
+
+
+class StateRecord:
+    """Trace entry of one state: times in ms from the start of the execution and output size in bytes."""
+
+    def __init__(self, name, state_type, started):
+        self.name = name
+        self.type = state_type
+        self.started = started
+        self.ended = None
+        self.output_bytes = None
+        self.error = None
+        self.branches = []
+
+    @property
+    def duration(self):
+        return self.ended - self.started
+
+    def to_dict(self):
+        record = {"name": self.name, "type": self.type, "started_ms": round(self.started, 3),
+                  "ended_ms": round(self.ended, 3), "output_bytes": self.output_bytes}
+        if self.error:
+            record["error"] = self.error
+        if self.branches:
+            record["branches"] = [[state.to_dict() for state in branch] for branch in self.branches]
+        return record
+
+
+def critical_path(trace):
+    """(state path, duration ms) of the states the execution waited on: every state in order, and for a Parallel
+    state the states of its slowest branch."""
+    path = []
+    for record in trace:
+        if record.branches:
+            slowest = max(record.branches, key=lambda branch: branch[-1].ended - branch[0].started if branch else 0)
+            path.extend((f"{record.name}/{name}", duration) for name, duration in critical_path(slowest))
+        else:
+            path.append((record.name, record.duration))
+    return path
+
+
+class Execution:
+    """Result of one execution: status, output or error and cause, duration in ms and the state trace."""
+
+    def __init__(self, status, output=None, error=None, cause=None, duration=0.0, trace=None):
+        self.status = status
+        self.output = output
+        self.error = error
+        self.cause = cause
+        self.duration = duration
+        self.trace = trace or []
+
+    @property
+    def output_bytes(self):
+        return len(json.dumps(self.output, separators=(",", ":"))) if self.output is not None else 0
+
+
+class LocalStateMachine:
+    """Runs a state machine definition in process. Task resources are resolved with handlers:
+    {resource ARN: async handler(parameters) -> result}.
+
+    start_sync_execution has the signature and response of the Step Functions client, so an instance can replace
+    the apps' sf_boto_client (WorkflowExecutor awaits it on the event loop).
+    """
+
+    def __init__(self, definition, handlers):
+        self.definition = definition
+        self.handlers = handlers
+        self.executions = []
+        self._check(definition)
+
+    def _check(self, machine):
+        for name, state in machine["States"].items():
+            if state["Type"] not in SUPPORTED_STATE_TYPES:
+                raise NotSupported(f"State {name}: unsupported type {state['Type']}")
+            if state["Type"] == "Task" and state["Resource"] not in self.handlers:
+                raise NotSupported(f"State {name}: no handler for {state['Resource']}")
+            if "Retry" in state:
+                raise NotSupported(f"State {name}: Retry is not supported")
+            for branch in state.get("Branches", []):
+                self._check(branch)
+
+    async def execute(self, input_data):
+        started = time.perf_counter()
+        trace = []
+        try:
+            output = await self._run_states(self.definition, input_data, trace, started)
+            execution = Execution("SUCCEEDED", output=output)
+        except StatesError as e:
+            execution = Execution("FAILED", error=e.error, cause=e.cause)
+        execution.duration = 1000 * (time.perf_counter() - started)
+        execution.trace = trace
+        self.executions.append(execution)
+        return execution
+
+    async def start_sync_execution(self, stateMachineArn, input, **kwargs):
+        execution = await self.execute(json.loads(input))
+        response = {"executionArn": f"{stateMachineArn}:local-{len(self.executions)}", "status": execution.status}
+        if execution.status == "SUCCEEDED":
+            response["output"] = json.dumps(execution.output)
+        else:
+            response.update(error=execution.error, cause=execution.cause)
+        return response
+
+    async def _run_states(self, machine, data, trace, started):
+        name = machine["StartAt"]
+        while True:
+            state = machine["States"][name]
+            record = StateRecord(name, state["Type"], 1000 * (time.perf_counter() - started))
+            trace.append(record)
+            try:
+                data, next_name = await self._run_state(state, data, record, started)
+            except StatesError as e:
+                record.error = e.error
+                raise
+            finally:
+                record.ended = 1000 * (time.perf_counter() - started)
+            record.output_bytes = len(json.dumps(data, separators=(",", ":")))
+            if next_name is None:
+                return data
+            name = next_name
+
+    async def _run_state(self, state, data, record, started):
+        state_input = query(data, state.get("InputPath", "$"))
+        if state["Type"] == "Choice":
+            next_name = next((rule["Next"] for rule in state["Choices"] if matches(rule, state_input)),
+                             state.get("Default"))
+            if next_name is None:
+                raise StatesError("States.NoChoiceMatched", "No Choice rule matched and there is no Default")
+            return query(state_input, state.get("OutputPath", "$")), next_name
+
+        effective_input = resolve(state["Parameters"], state_input) if "Parameters" in state else state_input
+        try:
+            if state["Type"] == "Pass":
+                result = state.get("Result", effective_input)
+            elif state["Type"] == "Task":
+                result = await self._run_task(state["Resource"], effective_input)
+            else:
+                result = await self._run_branches(state["Branches"], effective_input, record, started)
+            if "ResultSelector" in state:
+                result = resolve(state["ResultSelector"], result)
+        except StatesError as e:
+            catcher = self._catcher(state, e.error)
+            if catcher is None:
+                raise
+            record.error = e.error
+            return set_path(state_input, catcher.get("ResultPath", "$"), {"Error": e.error, "Cause": e.cause}), \
+                catcher["Next"]
+
+        output = set_path(state_input, state.get("ResultPath", "$"), result)
+        return query(output, state.get("OutputPath", "$")), None if state.get("End") else state["Next"]
+
+    async def _run_task(self, resource, parameters):
+        try:
+            return await self.handlers[resource](parameters)
+        except StatesError:
+            raise
+        except Exception as e:
+            raise StatesError(*task_error(resource, e))
+
+    async def _run_branches(self, branches, branch_input, record, started):
+        record.branches = [[] for _ in branches]
+        tasks = [asyncio.ensure_future(self._run_states(branch, branch_input, branch_trace, started))
+                 for branch, branch_trace in zip(branches, record.branches)]
+        try:
+            # A failed branch fails the Parallel state and stops the other branches
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+            return [task.result() for task in tasks]
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    def _catcher(state, error):
+        for catcher in state.get("Catch", []):
+            if error in catcher["ErrorEquals"] or \
+                    ("States.ALL" in catcher["ErrorEquals"] and error not in UNCATCHABLE_ERRORS):
+                return catcher
+        return None
@@ -0,0 +1,80 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Throughput of the assistant_config.py bulk importer against an in-memory DynamoDB stand-in that adds a fixed
+# latency per call and leaves a share of each batch unprocessed.
+#
+#   python benchmarks/bench_bulk_import.py --accounts 200 --workers 1 4 16
+
+import argparse
+import json
+import sys
+import tempfile
+
+from apps import EXAMPLES
+from fakes import FakeDynamoDBClient
+
+sys.path.insert(0, str(EXAMPLES / "sample_web_application"))
+import assistant_config  # noqa: E402
+
+
+def write_tenants(path, accounts, workflows, prompts):
+    # Same item layout as assistant_config.table_items, repeated per synthetic account
+    with open(path, "w") as jsonl_file:
+        for account in range(accounts):
+            account_key = {"S": f"account#load-test-{account}"}
+            items = [
+                {"id": account_key, "item_type": {"S": "account#details"}, "name": {"S": f"Account {account}"}},
+                {"id": account_key, "item_type": {"S": "account#inference_endpoint"}, "type": {"S": "cloudfront"}},
+            ]
+            for workflow in range(workflows):
+                items.append({"id": account_key, "item_type": {"S": f"workflow#details#{workflow}"},
+                              "type": {"S": "stepfunctions"}, "arn": {"S": "arn:aws:states:::stateMachine:load"}})
+                items += [{"id": account_key, "item_type": {"S": f"workflow#prompt#{workflow}#{prompt}"},
+                           "role": {"S": "user"}, "content": {"S": "prompt"}} for prompt in range(prompts)]
+            for item in items:
+                jsonl_file.write(json.dumps(item) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import throughput benchmark")
+    parser.add_argument("--accounts", type=int, default=200)
+    parser.add_argument("--workflows", type=int, default=3)
+    parser.add_argument("--prompts", type=int, default=5)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--latency-ms", type=float, default=10, help="latency of each DynamoDB call")
+    parser.add_argument("--unprocessed-ratio", type=float, default=0.05)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.NamedTemporaryFile(suffix=".jsonl") as jsonl_file:
+        write_tenants(jsonl_file.name, args.accounts, args.workflows, args.prompts)
+
+        # Baseline: the original populate_table loop, one put_item per item
+        dynamodb = FakeDynamoDBClient(latency=args.latency_ms / 1000)
+        items = list(assistant_config.read_jsonl_items(jsonl_file.name))
+        started = assistant_config.time.perf_counter()
+        for item in items:
+            dynamodb.put_item(TableName=assistant_config.table_name, Item=item)
+        elapsed = assistant_config.time.perf_counter() - started
+        results["put_item"] = {"items": len(items), "seconds": round(elapsed, 3),
+                               "items_per_second": round(len(items) / elapsed, 1), "calls": dynamodb.calls}
+        print(f"put_item loop: {results['put_item']}")
+
+        for workers in args.workers:
+            dynamodb = FakeDynamoDBClient(latency=args.latency_ms / 1000, unprocessed_ratio=args.unprocessed_ratio)
+            stats = assistant_config.bulk_import(dynamodb, assistant_config.read_jsonl_items(jsonl_file.name),
+                                                 workers=workers, report_every=0)
+            stats["calls"] = dynamodb.calls
+            assert len(dynamodb.items) == len(items), "items missing after import"
+            results[f"batch_write_{workers}_workers"] = stats
+            print(f"batch_write_item, {workers} workers: {stats}")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"benchmark": "bulk_import", "args": vars(args), "results": results}, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Bursts of identical questions, as a retrying UI or several users of one account asking at once. Every burst sends
+# --burst concurrent requests for each of --questions distinct questions through the ASGI app, with workflow
+# coalescing off and on, and reports the Step Functions executions started, the workflow stage of the answered
+# requests and their end-to-end latency. --abandon makes that many clients of each burst disconnect during the
+# workflow, which must not fail the others.
+#
+#   python benchmarks/bench_coalescing.py --app web --burst 20 --questions 5 --abandon 5
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from apps import call_asgi, load_app, request_body
+from fakes import FakeAccountDataAccess, FakeBedrockRuntime, FakeStepFunctions, retrieval_output
+
+
+async def run_burst(app_name, main, burst, questions, abandon, workflow_s):
+    requests = []
+    for question in range(questions):
+        path, headers, body = request_body(app_name, question=f"Question {question}?")
+        for client in range(burst):
+            # The abandoning clients leave halfway through the workflow
+            disconnect_after = workflow_s / 2 if client < abandon else None
+            requests.append(call_asgi(main.app, path, headers, body, disconnect_after=disconnect_after))
+
+    started = time.perf_counter()
+
+    async def timed(request):
+        response = await request
+        return response, time.perf_counter() - started
+
+    return await asyncio.gather(*(timed(request) for request in requests))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Workflow coalescing benchmark")
+    parser.add_argument("--app", choices=["web", "rag"], default="web")
+    parser.add_argument("--burst", type=int, default=20, help="concurrent requests per question")
+    parser.add_argument("--questions", type=int, default=5, help="distinct questions per burst")
+    parser.add_argument("--abandon", type=int, default=0, help="clients per question disconnecting mid-workflow")
+    parser.add_argument("--workflow-ms", type=float, default=500)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    app_main = load_app(args.app)
+    app_main.bedrock_boto_client = FakeBedrockRuntime(output_tokens=20, first_token_latency=0.05,
+                                                      inter_token_latency=0.01)
+    if args.app == "web":
+        app_main.AccountDataAccess = FakeAccountDataAccess
+    from telemetry import InMemorySink, Telemetry
+    sink = InMemorySink()
+    app_main.telemetry = Telemetry([sink])
+
+    results = {}
+    for coalescing in (False, True):
+        app_main.WORKFLOW_COALESCING = coalescing
+        app_main.sf_boto_client = FakeStepFunctions(retrieval_output(), latency=args.workflow_ms / 1000)
+        responses = asyncio.run(run_burst(args.app, app_main, args.burst, args.questions, args.abandon,
+                                          args.workflow_ms / 1000))
+        completed = [elapsed for response, elapsed in responses if response["disconnected_at"] is None] or [0]
+        answered = sum(1 for response, _ in responses
+                       if response["disconnected_at"] is None and response["status"] == 200 and response["chunks"])
+        workflow_ms = [record["stages"]["workflow"] for record in sink.records
+                       if record["properties"]["outcome"] == "ok"] or [0]
+        sink.records.clear()
+        summary = {
+            "requests": len(responses),
+            "answered": answered,
+            "abandoned": sum(1 for response, _ in responses if response["disconnected_at"] is not None),
+            "workflow_executions": app_main.sf_boto_client.calls,
+            "workflow_p50_ms": round(statistics.median(workflow_ms), 1),
+            "latency_p50_ms": round(1000 * statistics.median(completed), 1),
+            "latency_max_ms": round(1000 * max(completed), 1),
+        }
+        mode = "coalescing" if coalescing else "no_coalescing"
+        results[mode] = summary
+        print(f"{mode}: " + ", ".join(f"{key}={value}" for key, value in summary.items()))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"benchmark": "coalescing", "app": args.app, "args": vars(args), "results": results},
+                      output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Prompt size and assembly time of the RAG app sf_build_chain_content with the original repr serialization of
+# context_data vs. context_packer.pack_context.
+#
+# Payloads are lists of Knowledge Base Retrieve results ("RetrievalResults"). Pass recorded ones with --payloads, a
+# JSON file holding a list of RetrievalResults lists, e.g. the KnowledgeBaseData of Step Functions execution
+# histories. Without it, payloads are generated with the metadata and chunk overlap of a Retrieve response, in the
+# PascalCase shape of the Step Functions aws-sdk integration. retrieve_results_recognized is the share of results
+# packed as passages; the others are kept as raw JSON.
+#
+#   python benchmarks/bench_context_packing.py --payloads recorded_retrieve.json
+
+import argparse
+import json
+import random
+import statistics
+import time
+
+from apps import load_app
+from fakes import step_functions_keys
+
+WORDS = ("lambda step functions bedrock knowledge base retrieval model latency tokens prompt stream cache "
+         "account workflow serverless function request response invocation concurrency memory timeout region "
+         "the a of to and in for with is on that by this from as").split()
+
+
+def synthetic_document(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def synthetic_payloads(count, results, seed):
+    # Chunks of 300 words with 20% overlap, as the default Knowledge Base chunking strategy. Some chunks are
+    # returned twice, as happens when the same document is synced from two data sources.
+    rng = random.Random(seed)
+    payloads = []
+    for _ in range(count):
+        document = synthetic_document(rng, 3000).split()
+        chunks = [" ".join(document[start:start + 300]) for start in range(0, len(document) - 300, 240)]
+        payload = []
+        for rank in range(results):
+            chunk_index = rng.randrange(len(chunks))
+            if rank and rng.random() < 0.25:
+                chunk_index = rng.choice([result["chunk_index"] for result in payload])
+            uri = f"s3://knowledge-base-docs/guides/document-{rng.randrange(5)}.pdf"
+            payload.append({
+                "chunk_index": chunk_index,
+                "content": {"text": chunks[chunk_index], "type": "TEXT"},
+                "location": {"s3Location": {"uri": uri}, "type": "S3"},
+                "metadata": {
+                    "x-amz-bedrock-kb-source-uri": uri,
+                    "x-amz-bedrock-kb-chunk-id": f"1%3A0%3A{rng.getrandbits(64):x}",
+                    "x-amz-bedrock-kb-data-source-id": "ABCDEFGHIJ",
+                    "x-amz-bedrock-kb-document-page-number": float(chunk_index + 1),
+                },
+                "score": round(rng.uniform(0.3, 0.8), 6),
+            })
+        for result in payload:
+            del result["chunk_index"]
+        payloads.append(step_functions_keys(payload))
+    return payloads
+
+
+def measure(main, payloads, packing, repeat):
+    main.CONTEXT_PACKING = packing
+    system = "You are a helpful assistant. Answer with the documents below.<chain-information></chain-information>"
+    estimator = main.HistoryManager().estimator
+    sizes, tokens, times = [], [], []
+    recognized = sum(1 for payload in payloads for item in payload if main.retrieved_passage(item))
+    for payload in payloads:
+        sf_data = main.StepFunctionResponse(
+            bedrock_details=main.WorkflowBedrockDetails(task_details=[], total_input_tokens=0, total_output_tokens=0),
+            context_data=payload
+        )
+        started = time.perf_counter()
+        for _ in range(repeat):
+            prompt = main.sf_build_chain_content(system, sf_data, "DOCUMENT")
+        times.append((time.perf_counter() - started) / repeat)
+        sizes.append(len(prompt))
+        tokens.append(estimator.text_tokens(prompt))
+    return {
+        "prompt_chars_mean": round(statistics.mean(sizes)),
+        "prompt_tokens_mean": round(statistics.mean(tokens)),
+        "assembly_p50_ms": round(1000 * statistics.median(times), 3),
+        "assembly_max_ms": round(1000 * max(times), 3),
+        "retrieve_results_recognized": round(recognized / max(1, sum(len(payload) for payload in payloads)), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Context packing benchmark")
+    parser.add_argument("--payloads", help="JSON file with a list of recorded RetrievalResults lists")
+    parser.add_argument("--count", type=int, default=50, help="synthetic payloads")
+    parser.add_argument("--results", type=int, default=10, help="Retrieve results per synthetic payload")
+    parser.add_argument("--repeat", type=int, default=20, help="assemblies per payload")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    if args.payloads:
+        with open(args.payloads) as payloads_file:
+            payloads = json.load(payloads_file)
+    else:
+        payloads = synthetic_payloads(args.count, args.results, args.seed)
+
+    app_main = load_app("rag")
+    results = {}
+    for mode, packing in (("repr", False), ("packed", True)):
+        results[mode] = measure(app_main, payloads, packing, args.repeat)
+        print(f"{mode:>6}: " + ", ".join(f"{key}={value}" for key, value in results[mode].items()))
+    saved = 1 - results["packed"]["prompt_tokens_mean"] / results["repr"]["prompt_tokens_mean"]
+    print(f"prompt tokens saved: {100 * saved:.1f}%")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"benchmark": "context_packing", "args": vars(args), "results": results}, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
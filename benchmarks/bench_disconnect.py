@@ -0,0 +1,99 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Aborted clients: concurrent requests that disconnect after --abort-ms, while the workflow runs or in the middle of
+# the answer. For every request it checks that the app stops the Bedrock stream (FakeEventStream.close) instead of
+# reading it to the end, and reports the tokens Bedrock generated vs. a full answer, the time from the disconnect to
+# the stream close, and the disconnect counters of the telemetry records.
+#
+#   python benchmarks/bench_disconnect.py --app rag --clients 20 --abort-ms 100 700 --tokens 200
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from apps import call_asgi, load_app, request_body
+from fakes import FakeAccountDataAccess, FakeBedrockRuntime, FakeStepFunctions, retrieval_output
+
+
+async def run_clients(app_name, main, clients, abort_ms, stream_format, max_tokens):
+    path, headers, body = request_body(app_name, stream_format, max_tokens=max_tokens)
+    first_stream = len(main.bedrock_boto_client.streams)
+    responses = await asyncio.gather(*(
+        call_asgi(main.app, path, headers, body, disconnect_after=abort_ms / 1000) for _ in range(clients)
+    ))
+    # Worker threads notice the close on their next read
+    await asyncio.sleep(0.1)
+    return responses, main.bedrock_boto_client.streams[first_stream:]
+
+
+def summarize(responses, streams, tokens, sink):
+    disconnects = [response["disconnected_at"] for response in responses if response["disconnected_at"]]
+    # All clients disconnect at the same time, give or take the event loop scheduling
+    close_latencies = [1000 * (stream.closed_at - min(disconnects)) for stream in streams if stream.closed_at]
+    # One event per token plus the message start and end events
+    generated = sum(min(stream.events_sent, tokens) for stream in streams)
+    records = sink.records[:]
+    sink.records.clear()
+    return {
+        "clients": len(responses),
+        "disconnected": len(disconnects),
+        "status_499": sum(1 for response in responses if response["status"] == 499),
+        "bedrock_streams": len(streams),
+        "streams_closed": sum(1 for stream in streams if stream.closed),
+        "tokens_generated": generated,
+        "tokens_full_answers": tokens * len(streams),
+        "tokens_saved_pct": round(100 * (1 - generated / (tokens * len(streams))), 1) if streams else None,
+        "close_after_disconnect_p50_ms": round(statistics.median(close_latencies), 1) if close_latencies else None,
+        "telemetry_outcomes": {outcome: sum(1 for record in records if record["properties"]["outcome"] == outcome)
+                               for outcome in {record["properties"]["outcome"] for record in records}},
+        "telemetry_tokens_saved": sum(record["counters"].get("disconnect.output_tokens_saved", 0)
+                                      for record in records),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aborted client harness")
+    parser.add_argument("--app", choices=["web", "rag"], default="rag")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent clients per abort time")
+    parser.add_argument("--abort-ms", type=float, nargs="+", default=[100, 700],
+                        help="disconnect delays after the request; below --workflow-ms aborts during the workflow")
+    parser.add_argument("--workflow-ms", type=float, default=500)
+    parser.add_argument("--tokens", type=int, default=200, help="output tokens of a full answer")
+    parser.add_argument("--inter-token-ms", type=float, default=10)
+    parser.add_argument("--stream-format", choices=["text", "sse", "ndjson"], default="text")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    app_main = load_app(args.app)
+    app_main.bedrock_boto_client = FakeBedrockRuntime(
+        output_tokens=args.tokens, first_token_latency=0.05, inter_token_latency=args.inter_token_ms / 1000
+    )
+    app_main.sf_boto_client = FakeStepFunctions(retrieval_output(), latency=args.workflow_ms / 1000)
+    if args.app == "web":
+        app_main.AccountDataAccess = FakeAccountDataAccess
+    from telemetry import InMemorySink, Telemetry
+    sink = InMemorySink()
+    app_main.telemetry = Telemetry([sink])
+
+    results = {}
+    for abort_ms in args.abort_ms:
+        started = time.perf_counter()
+        responses, streams = asyncio.run(run_clients(
+            args.app, app_main, args.clients, abort_ms, args.stream_format, args.tokens
+        ))
+        summary = summarize(responses, streams, args.tokens, sink)
+        summary["elapsed_s"] = round(time.perf_counter() - started, 3)
+        results[f"abort_{abort_ms:g}ms"] = summary
+        print(f"abort {abort_ms:g} ms: " + ", ".join(f"{key}={value}" for key, value in summary.items()))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"benchmark": "disconnect", "app": args.app, "args": vars(args), "results": results},
+                      output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
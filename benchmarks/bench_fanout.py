@@ -0,0 +1,94 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Identical model requests with response fan-out off and on. Every round sends --burst concurrent requests for each of
+# --questions distinct questions, then --late more of them once the first answers are complete (replayed from the
+# buffer within FANOUT_TTL_SECONDS). Reports the Bedrock streams opened, the output tokens generated, the time to the
+# first body chunk and the end-to-end latency, and checks every request got the same answer as the others.
+#
+#   python benchmarks/bench_fanout.py --app web --burst 20 --questions 5 --late 5 --tokens 200
+
+import argparse
+import asyncio
+import json
+import time
+
+from apps import call_asgi, load_app, request_body
+from fakes import FakeAccountDataAccess, FakeBedrockRuntime, FakeStepFunctions, retrieval_output
+
+
+async def run_round(app_name, main, burst, questions, late):
+    async def timed(path, headers, body):
+        started = time.perf_counter()
+        response = await call_asgi(main.app, path, headers, body)
+        first_chunk = response["chunks"][0][0] - started if response["chunks"] else None
+        return response, first_chunk, time.perf_counter() - started
+
+    requests = [request_body(app_name, question=f"Question {question}?") for question in range(questions)]
+    first = await asyncio.gather(*(timed(*request) for request in requests for _ in range(burst)))
+    later = await asyncio.gather(*(timed(*request) for request in requests for _ in range(late)))
+    return first + later
+
+
+def percentile(values, fraction):
+    values = sorted(values) or [0]
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Response fan-out benchmark")
+    parser.add_argument("--app", choices=["web", "rag"], default="web")
+    parser.add_argument("--burst", type=int, default=20, help="concurrent identical requests per question")
+    parser.add_argument("--questions", type=int, default=5, help="distinct questions per round")
+    parser.add_argument("--late", type=int, default=5, help="identical requests per question after the burst")
+    parser.add_argument("--tokens", type=int, default=200, help="output tokens of an answer")
+    parser.add_argument("--inter-token-ms", type=float, default=10)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    app_main = load_app(args.app)
+    app_main.sf_boto_client = FakeStepFunctions(retrieval_output(), latency=0.2)
+    if args.app == "web":
+        app_main.AccountDataAccess = FakeAccountDataAccess
+    from response_fanout import ResponseFanout
+    from telemetry import InMemorySink, Telemetry
+    sink = InMemorySink()
+    app_main.telemetry = Telemetry([sink])
+
+    results = {}
+    for fanout in (False, True):
+        app_main.response_fanout = ResponseFanout() if fanout else None
+        app_main.bedrock_boto_client = FakeBedrockRuntime(
+            output_tokens=args.tokens, first_token_latency=0.2, inter_token_latency=args.inter_token_ms / 1000
+        )
+        responses = asyncio.run(run_round(args.app, app_main, args.burst, args.questions, args.late))
+        answers = {b"".join(chunk for _, chunk in response["chunks"]) for response, _, _ in responses}
+        first_chunks = [first_chunk for _, first_chunk, _ in responses if first_chunk is not None]
+        latencies = [elapsed for _, _, elapsed in responses]
+        streams = app_main.bedrock_boto_client.streams
+        summary = {
+            "requests": len(responses),
+            "ok": sum(1 for response, _, _ in responses if response["status"] == 200),
+            "distinct_answers": len(answers),
+            "bedrock_streams": len(streams),
+            "tokens_generated": sum(min(stream.events_sent, args.tokens) for stream in streams),
+            "replayed": sum(record["counters"].get("fanout.replayed", 0) for record in sink.records),
+            "first_chunk_p50_ms": round(1000 * percentile(first_chunks, 0.5), 1),
+            "latency_p50_ms": round(1000 * percentile(latencies, 0.5), 1),
+            "latency_p99_ms": round(1000 * percentile(latencies, 0.99), 1),
+        }
+        if fanout:
+            summary["buffers"] = app_main.response_fanout.stats()
+        sink.records.clear()
+        mode = "fanout" if fanout else "no_fanout"
+        results[mode] = summary
+        print(f"{mode}: " + ", ".join(f"{key}={value}" for key, value in summary.items()))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"benchmark": "fanout", "app": args.app, "args": vars(args), "results": results},
+                      output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
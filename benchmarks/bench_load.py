@@ -0,0 +1,354 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# End-to-end load test of the streaming endpoints. Starts the app in its own process with uvicorn and the fakes of
+# fakes.py (load_server.py), then sends requests over HTTP with an open-loop generator: requests start on the
+# --arrival schedule of --rps for --duration seconds whether or not the earlier ones completed, so a slow server
+# builds a queue instead of slowing the load down. Every --rps and --turns (user messages per conversation)
+# combination is one step.
+#
+# Per step it reports the time to the first response byte (status line) and to the first answer token, the
+# end-to-end latency, all measured from the scheduled start, tokens/s per request and in total, the error rate
+# (failed connections, non-200 statuses, error events and incomplete answers), and the CPU time and memory of the
+# server process per request.
+#
+# --accounts spreads the web app requests over that many accounts, --noisy-share of them from the first one, and adds
+# the results of each account to the step. With --admission the app runs with ADMISSION_CONTROL_ENABLED, and the
+# other ADMISSION_* variables of the environment; rejected requests count as status_429 or status_503 errors.
+#
+# With --baseline, compares every step with the same step of a previous --output file and exits with status 1 when
+# a latency percentile or the CPU time per request grew by more than --tolerance, or the error rate went up.
+#
+#   python benchmarks/bench_load.py --app web --rps 5 10 20 --turns 1 10 --duration 20 --output load_web.json
+#   ADMISSION_REQUESTS_PER_MINUTE=120 python benchmarks/bench_load.py --rps 10 --accounts 4 --noisy-share 0.7 --admission
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from apps import app_environ, request_body
+from load_server import USAGE_PATH, account_ids
+
+HOST = "127.0.0.1"
+# Metrics checked against a --baseline, lower is better
+BASELINE_METRICS = ("ttfb_p50_ms", "ttfb_p99_ms", "first_token_p50_ms", "first_token_p99_ms", "latency_p50_ms",
+                    "latency_p99_ms", "server_cpu_ms_per_request")
+# Words of the FakeBedrockRuntime answers, one per output token
+TOKEN = re.compile(rb"token\d+ ")
+ERROR_EVENTS = {"sse": b"event: error", "ndjson": b'{"type":"error"'}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, port):
+    command = [sys.executable, str(Path(__file__).with_name("load_server.py")), "--app", args.app, "--host", HOST,
+               "--port", str(port), "--tokens", str(args.tokens), "--first-token-ms", str(args.first_token_ms),
+               "--inter-token-ms", str(args.inter_token_ms), "--workflow-ms", str(args.workflow_ms),
+               "--accounts", str(args.accounts)]
+    env = app_environ(args.app, ADMISSION_CONTROL_ENABLED="true") if args.admission else app_environ(args.app)
+    # The apps log and print a telemetry record per request
+    log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+    server = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"load_server.py exited with status {server.returncode}")
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("load_server.py did not start listening in 60 seconds")
+
+
+async def read_body(reader, headers):
+    """Yield the body chunks of a response as they arrive, decoding chunked transfer encoding."""
+    if headers.get("transfer-encoding") != "chunked":
+        while chunk := await reader.read(65536):
+            yield chunk
+        return
+    while True:
+        size = int((await reader.readline()).split(b";")[0], 16)
+        if size == 0:
+            return
+        chunk = await reader.readexactly(size)
+        await reader.readline()
+        yield chunk
+
+
+async def http_request(method, port, path, headers=None, body=None, on_first_byte=None, on_chunk=None):
+    """HTTP/1.1 request on a new connection. Returns the status and the body."""
+    reader, writer = await asyncio.open_connection(HOST, port)
+    try:
+        payload = json.dumps(body).encode() if body is not None else b""
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {HOST}:{port}", "Connection: close",
+                 "Content-Type: application/json", f"Content-Length: {len(payload)}"]
+        lines += [f"{key}: {value}" for key, value in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + payload)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if on_first_byte:
+            on_first_byte()
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b""):
+            key, _, value = line.decode().partition(":")
+            response_headers[key.strip().lower()] = value.strip().lower()
+        chunks = []
+        async for chunk in read_body(reader, response_headers):
+            if on_chunk:
+                on_chunk(chunk)
+            chunks.append(chunk)
+        return status, b"".join(chunks)
+    finally:
+        writer.close()
+
+
+async def get_usage(port):
+    _, body = await http_request("GET", port, USAGE_PATH)
+    return json.loads(body)
+
+
+async def timed_request(args, port, turns, index, scheduled, account_id=None):
+    """One request of the load, with its times in seconds from the scheduled start."""
+    account_id = account_id or account_ids(1)[0]
+    path, headers, body = request_body(args.app, args.stream_format, question=f"Question {index}: what is AWS?",
+                                       max_tokens=args.tokens, turns=turns, account_id=account_id)
+    result = {"account": account_id, "scheduled": scheduled, "start_lag": time.perf_counter() - scheduled, "ttfb": None,
+              "first_token": None, "last_token": None, "latency": None, "status": None, "tokens": 0, "error": None}
+
+    def on_first_byte():
+        result["ttfb"] = time.perf_counter() - scheduled
+
+    def on_chunk(chunk):
+        # The typed formats send the context event before the answer
+        if TOKEN.search(chunk):
+            now = time.perf_counter() - scheduled
+            if result["first_token"] is None:
+                result["first_token"] = now
+            result["last_token"] = now
+
+    try:
+        result["status"], response_body = await asyncio.wait_for(
+            http_request("POST", port, path, headers, body, on_first_byte, on_chunk), args.timeout
+        )
+    except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+        result["error"] = type(e).__name__
+        return result
+    finally:
+        result["ended"] = time.perf_counter()
+    result["latency"] = result["ended"] - scheduled
+    result["tokens"] = len(TOKEN.findall(response_body))
+    if result["status"] != 200:
+        result["error"] = f"status_{result['status']}"
+    elif ERROR_EVENTS.get(args.stream_format, b"\0") in response_body:
+        result["error"] = "error_event"
+    elif result["tokens"] < args.tokens:
+        result["error"] = "incomplete"
+    return result
+
+
+async def sample_memory(port, interval, samples):
+    while True:
+        usage = await get_usage(port)
+        samples.append(usage["rss_kb"] or usage["max_rss_kb"])
+        await asyncio.sleep(interval)
+
+
+def choose_account(args, accounts, rng):
+    """The first account with probability --noisy-share, the others evenly; all evenly without it."""
+    if args.noisy_share is None or len(accounts) == 1:
+        return rng.choice(accounts)
+    return accounts[0] if rng.random() < args.noisy_share else rng.choice(accounts[1:])
+
+
+async def run_step(args, port, rps, turns, rng):
+    """Open-loop step: starts a request at every arrival time, without waiting for the previous ones."""
+    before = await get_usage(port)
+    memory = []
+    sampler = asyncio.ensure_future(sample_memory(port, args.sample_interval, memory))
+    requests = []
+    accounts = account_ids(args.accounts)
+    started = time.perf_counter()
+    offset, index = 0.0, 0
+    while offset < args.duration:
+        await asyncio.sleep(max(0.0, started + offset - time.perf_counter()))
+        requests.append(asyncio.ensure_future(
+            timed_request(args, port, turns, index, started + offset, choose_account(args, accounts, rng))
+        ))
+        index += 1
+        offset += rng.expovariate(rps) if args.arrival == "poisson" else 1 / rps
+    sending = time.perf_counter() - started
+    results = await asyncio.gather(*requests)
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+    after = await get_usage(port)
+    return results, sending, elapsed, before, after, memory
+
+
+def percentile(values, fraction):
+    values = sorted(values) or [0]
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def ms_percentiles(name, values):
+    return {f"{name}_p{int(100 * fraction)}_ms": round(1000 * percentile(values, fraction), 1)
+            for fraction in (0.5, 0.95, 0.99)}
+
+
+def max_in_flight(results):
+    events = sorted([(result["scheduled"] + result["start_lag"], 1) for result in results]
+                    + [(result["ended"], -1) for result in results])
+    in_flight = peak = 0
+    for _, change in events:
+        in_flight += change
+        peak = max(peak, in_flight)
+    return peak
+
+
+def account_summaries(results):
+    """Requests, errors and latency of each account, to see whether one account's load reaches the others."""
+    summaries = {}
+    for account_id in sorted({result["account"] for result in results}):
+        account_results = [result for result in results if result["account"] == account_id]
+        completed = [result for result in account_results if result["error"] is None]
+        errors = [result["error"] for result in account_results if result["error"]]
+        summaries[account_id] = {
+            "requests": len(account_results),
+            "error_rate": round(len(errors) / len(account_results), 4),
+            "errors": {error: errors.count(error) for error in sorted(set(errors))},
+            **ms_percentiles("first_token", [result["first_token"] for result in completed]),
+        }
+    return summaries
+
+
+def summarize(rps, results, sending, elapsed, before, after, memory):
+    completed = [result for result in results if result["error"] is None]
+    errors = [result["error"] for result in results if result["error"]]
+    token_rates = [result["tokens"] / (result["last_token"] - result["first_token"]) for result in completed
+                   if result["last_token"] > result["first_token"]]
+    cpu_seconds = after["cpu_seconds"] - before["cpu_seconds"]
+    baseline_kb = before["rss_kb"] or before["max_rss_kb"]
+    peak_kb = max(memory + [after["rss_kb"] or after["max_rss_kb"]])
+    in_flight = max_in_flight(results)
+    summary = {
+        "target_rps": rps,
+        "requests": len(results),
+        "achieved_rps": round(len(results) / sending, 2),
+        # Until the last response of the step ended
+        "completed_rps": round(len(completed) / elapsed, 2),
+        "error_rate": round(len(errors) / max(1, len(results)), 4),
+        "errors": {error: errors.count(error) for error in sorted(set(errors))},
+    }
+    summary.update(ms_percentiles("ttfb", [result["ttfb"] for result in results if result["ttfb"] is not None]))
+    summary.update(ms_percentiles("first_token", [result["first_token"] for result in completed]))
+    summary.update(ms_percentiles("latency", [result["latency"] for result in completed]))
+    summary.update({
+        "tokens_per_s_p50": round(percentile(token_rates, 0.5), 1),
+        "tokens_per_s_total": round(sum(result["tokens"] for result in results) / elapsed, 1),
+        # A late generator would hide server latency: start lag must stay small next to the measured times
+        "start_lag_p99_ms": round(1000 * percentile([result["start_lag"] for result in results], 0.99), 1),
+        "max_in_flight": in_flight,
+        "server_cpu_ms_per_request": round(1000 * cpu_seconds / max(1, len(results)), 2),
+        "server_cpu_utilization": round(cpu_seconds / elapsed, 3),
+        "server_rss_mb": round(baseline_kb / 1024, 1),
+        "server_rss_peak_mb": round(peak_kb / 1024, 1),
+        # Memory held per concurrent request, from the peak over the resident memory at the start of the step
+        "server_rss_kb_per_in_flight_request": round(max(0, peak_kb - baseline_kb) / max(1, in_flight), 1),
+    })
+    if len({result["account"] for result in results}) > 1:
+        summary["accounts"] = account_summaries(results)
+    return summary
+
+
+async def run(args, port):
+    rng = random.Random(args.seed)
+    results = {}
+    for turns in args.turns:
+        # Warm up the connection pools, caches and lazy imports before measuring
+        await asyncio.gather(*(timed_request(args, port, turns, -1 - index, time.perf_counter()) for index in range(3)))
+        for rps in args.rps:
+            summary = summarize(rps, *await run_step(args, port, rps, turns, rng))
+            summary["turns"] = turns
+            name = f"turns={turns},rps={rps}"
+            results[name] = summary
+            print(f"{name}: " + ", ".join(f"{key}={value}" for key, value in summary.items()))
+    return results
+
+
+def check_baseline(results, baseline_path, tolerance):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)["results"]
+    regressions = []
+    for step, summary in results.items():
+        previous = baseline.get(step)
+        if previous is None:
+            continue
+        for metric in BASELINE_METRICS:
+            if previous.get(metric) and summary[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{step} {metric}: {previous[metric]} -> {summary[metric]}")
+        if summary["error_rate"] > previous.get("error_rate", 0):
+            regressions.append(f"{step} error_rate: {previous.get('error_rate', 0)} -> {summary['error_rate']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of the streaming endpoints")
+    parser.add_argument("--app", choices=["web", "rag"], default="web")
+    parser.add_argument("--rps", type=float, nargs="+", default=[5, 10, 20], help="request rates, one step each")
+    parser.add_argument("--turns", type=int, nargs="+", default=[1], help="user messages per conversation")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load per step")
+    parser.add_argument("--arrival", choices=["poisson", "constant"], default="poisson")
+    parser.add_argument("--stream-format", choices=["text", "sse", "ndjson"], default="ndjson")
+    parser.add_argument("--tokens", type=int, default=200, help="output tokens of an answer")
+    parser.add_argument("--first-token-ms", type=float, default=200)
+    parser.add_argument("--inter-token-ms", type=float, default=10)
+    parser.add_argument("--workflow-ms", type=float, default=500)
+    parser.add_argument("--accounts", type=int, default=1, help="web app accounts sending the requests")
+    parser.add_argument("--noisy-share", type=float, help="share of the requests sent by the first account")
+    parser.add_argument("--admission", action="store_true", help="run the app with ADMISSION_CONTROL_ENABLED")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds before a request counts as failed")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="seconds between server memory samples")
+    parser.add_argument("--port", type=int, default=0, help="server port, a free one if 0")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--server-log", help="write the output of the app to this path")
+    parser.add_argument("--baseline", help="previous --output file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed growth over the baseline")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    port = args.port or free_port()
+    server = start_server(args, port)
+    try:
+        results = asyncio.run(run(args, port))
+    finally:
+        server.terminate()
+        server.wait()
+
+    regressions = check_baseline(results, args.baseline, args.tolerance) if args.baseline else []
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"benchmark": "load", "app": args.app, "args": vars(args), "results": results},
+                      output_file, indent=2)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
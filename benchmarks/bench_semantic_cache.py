@@ -0,0 +1,86 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Lookup latency of the RAG app semantic retrieval cache (semantic_cache.VectorIndex) for a growing number of cached
+# questions. Vectors are random unit vectors; every other query is a slightly perturbed cached vector, so both the
+# hit and the miss paths are measured. Embedding calls are not included.
+#
+#   python benchmarks/bench_semantic_cache.py --entries 10000 100000 --dimensions 512
+
+import argparse
+import json
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from apps import APP_PATHS
+
+sys.path.insert(0, str(APP_PATHS["rag"][0]))
+from semantic_cache import SEMANTIC_CACHE_THRESHOLD, VectorIndex  # noqa: E402
+
+
+def build_index(entries, dimensions, namespaces, rng):
+    index = VectorIndex(dimensions=dimensions, max_entries=entries, ttl=3600)
+    vectors = rng.standard_normal((entries, dimensions)).astype(np.float32)
+    for position, vector in enumerate(vectors):
+        index.add(f"workflow-{position % namespaces}", vector, [{"content": {"text": f"document {position}"}}])
+    return index, vectors
+
+
+def run(entries, dimensions, queries, namespaces, k, rng):
+    started = time.perf_counter()
+    index, vectors = build_index(entries, dimensions, namespaces, rng)
+    build_s = time.perf_counter() - started
+
+    latencies = []
+    hits = 0
+    for query in range(queries):
+        position = int(rng.integers(entries))
+        if query % 2:
+            vector = rng.standard_normal(dimensions).astype(np.float32)
+        else:
+            vector = vectors[position] + 0.05 * rng.standard_normal(dimensions).astype(np.float32)
+        before = time.perf_counter()
+        matches = index.search(f"workflow-{position % namespaces}", vector, k=k, threshold=SEMANTIC_CACHE_THRESHOLD)
+        latencies.append(time.perf_counter() - before)
+        hits += bool(matches)
+
+    latencies.sort()
+    return {
+        "entries": entries,
+        "dimensions": dimensions,
+        "index_mb": round((index.vectors.nbytes + index.created_at.nbytes + index.namespaces.nbytes) / 2 ** 20, 1),
+        "build_s": round(build_s, 2),
+        "hit_ratio": round(hits / queries, 3),
+        "lookup_p50_ms": round(1000 * statistics.median(latencies), 3),
+        "lookup_p99_ms": round(1000 * latencies[int(0.99 * (len(latencies) - 1))], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Semantic retrieval cache lookup benchmark")
+    parser.add_argument("--entries", type=int, nargs="+", default=[10000, 100000], help="cached questions")
+    parser.add_argument("--dimensions", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--namespaces", type=int, default=4, help="distinct workflows sharing the index")
+    parser.add_argument("--k", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for entries in args.entries:
+        result = run(entries, args.dimensions, args.queries, args.namespaces, args.k, rng)
+        results.append(result)
+        print(", ".join(f"{key}={value}" for key, value in result.items()))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"benchmark": "semantic_cache", "args": vars(args), "results": results}, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
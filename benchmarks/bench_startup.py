@@ -0,0 +1,98 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Cold-start budget of the example apps. Every run imports `main` in a fresh interpreter with `python -X importtime`,
+# the work Lambda Web Adapter waits for before the first request, and reports:
+#   - the import time of `main` and the top-level packages that account for it (self time of all their modules)
+#   - the time to create the boto3 clients on first use, which "lazy" moves out of the init phase
+#
+#   python benchmarks/bench_startup.py --app web --modes lazy eager --runs 5
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from apps import app_environ
+
+FIRST_USE = (
+    "import time; started = time.perf_counter(); import main; imported = time.perf_counter(); "
+    "main.bedrock_boto_client.load(); main.sf_boto_client.load(); "
+    "print(round((imported - started) * 1000, 1), round((time.perf_counter() - imported) * 1000, 1))"
+)
+
+
+def parse_importtime(stderr):
+    """Return the cumulative import time of `main` and the self time per top-level package, in milliseconds."""
+    main_us = 0
+    packages = defaultdict(int)
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        packages[name.split(".")[0]] += int(self_us)
+        if name == "main":
+            # Imports logged after main are made by the first use of the clients
+            main_us = int(cumulative_us)
+            break
+    return main_us / 1000, {package: self_us / 1000 for package, self_us in packages.items()}
+
+
+def run_once(app_name, mode):
+    env = app_environ(app_name, STARTUP_MODE=mode)
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", FIRST_USE],
+                            env=env, capture_output=True, text=True, check=True)
+    process_ms = (time.perf_counter() - started) * 1000
+    main_ms, packages = parse_importtime(result.stderr)
+    init_ms, first_use_ms = (float(value) for value in result.stdout.split())
+    return {"process_ms": process_ms, "import_main_ms": main_ms, "init_ms": init_ms, "first_use_ms": first_use_ms,
+            "packages": packages}
+
+
+def summarize(runs, top):
+    packages = defaultdict(list)
+    for run in runs:
+        for package, self_ms in run["packages"].items():
+            packages[package].append(self_ms)
+    package_ms = {package: statistics.median(values) for package, values in packages.items()}
+    return {
+        **{key: round(statistics.median(run[key] for run in runs), 1)
+           for key in ("process_ms", "import_main_ms", "init_ms", "first_use_ms")},
+        "top_packages_ms": {package: round(self_ms, 1) for package, self_ms in
+                            sorted(package_ms.items(), key=lambda item: -item[1])[:top]},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time and client creation benchmark")
+    parser.add_argument("--app", choices=["web", "rag"], default="web")
+    parser.add_argument("--modes", nargs="+", choices=["lazy", "eager"], default=["lazy", "eager"])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per mode, after one warm-up run")
+    parser.add_argument("--top", type=int, default=10, help="packages listed per mode")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.modes:
+        # The first run fills the OS file cache, as the Lambda image is after the first cold starts
+        run_once(args.app, mode)
+        results[mode] = summarize([run_once(args.app, mode) for _ in range(args.runs)], args.top)
+        summary = results[mode]
+        print(f"{mode}: init {summary['init_ms']} ms (import main {summary['import_main_ms']} ms), "
+              f"clients on first use {summary['first_use_ms']} ms, process {summary['process_ms']} ms")
+        for package, self_ms in summary["top_packages_ms"].items():
+            print(f"  {package:<24}{self_ms:>8.1f} ms")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"benchmark": "startup", "app": args.app, "args": vars(args), "results": results},
+                      output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
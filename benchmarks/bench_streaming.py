@@ -0,0 +1,130 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Concurrent-stream benchmark for the Bedrock stream generators of the example apps.
+#
+# "blocking" reproduces the original generators, which iterate the boto3 EventStream on the event loop thread.
+# "bridged" runs the app's current generator, which reads the stream through stream_bridge.iterate_in_thread.
+#
+#   python benchmarks/bench_streaming.py --app web --streams 50 --tokens 100
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from apps import load_app
+from fakes import FakeBedrockRuntime
+
+
+def blocking_generator(app_name, main):
+    if app_name == "web":
+        async def stream(params):
+            response = main.bedrock_boto_client.converse_stream(
+                modelId=params.model_id,
+                messages=params.messages,
+                system=params.system_prompts,
+                inferenceConfig=params.inference_config,
+                additionalModelRequestFields=params.additional_model_fields
+            )
+            for event in response["stream"]:
+                if "contentBlockDelta" in event:
+                    yield event["contentBlockDelta"]["delta"]["text"]
+    else:
+        async def stream(params):
+            response = main.bedrock_boto_client.invoke_model_with_response_stream(body=b"{}", modelId=params.modelId)
+            for event in response["body"]:
+                chunk = json.loads(event["chunk"]["bytes"])
+                if chunk["type"] == "content_block_delta":
+                    yield chunk["delta"]["text"]
+    return stream
+
+
+def bridged_generator(app_name, main):
+    return main.stream_bedrock_converse_api if app_name == "web" else main.bedrock_stream
+
+
+def build_params(app_name, main):
+    if app_name == "web":
+        return main.BedrockConverseAPIRequest(
+            model_id="anthropic.claude-3-haiku-20240307-v1:0",
+            messages=[{"role": "user", "content": [{"text": "Hello"}]}],
+            system_prompts=[{"text": "You are a benchmark."}],
+        )
+    return main.BedrockClaudeMessagesAPIRequest()
+
+
+async def consume(generator, params, started):
+    ttfb = None
+    chunks = 0
+    async for _ in generator(params):
+        if ttfb is None:
+            ttfb = time.perf_counter() - started
+        chunks += 1
+    return ttfb, chunks
+
+
+async def loop_lag_probe(stop, interval=0.01):
+    # Measures how late the event loop wakes up a sleeping task: a stand-in for every other request in the worker
+    worst = 0.0
+    while not stop.is_set():
+        before = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - before - interval)
+    return worst
+
+
+async def run_mode(generator, params, streams):
+    stop = asyncio.Event()
+    probe = asyncio.create_task(loop_lag_probe(stop))
+    started = time.perf_counter()
+    results = await asyncio.gather(*(consume(generator, params, started) for _ in range(streams)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    worst_lag = await probe
+
+    ttfbs = sorted(ttfb for ttfb, _ in results)
+    chunks = sum(count for _, count in results)
+    return {
+        "streams": streams,
+        "elapsed_s": round(elapsed, 3),
+        "chunks_per_s": round(chunks / elapsed, 1),
+        "ttfb_p50_ms": round(1000 * statistics.median(ttfbs), 1),
+        "ttfb_max_ms": round(1000 * ttfbs[-1], 1),
+        "loop_lag_max_ms": round(1000 * worst_lag, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent Bedrock stream benchmark")
+    parser.add_argument("--app", choices=["web", "rag"], default="web")
+    parser.add_argument("--streams", type=int, default=50, help="concurrent streams")
+    parser.add_argument("--tokens", type=int, default=50, help="output tokens per stream")
+    parser.add_argument("--first-token-ms", type=float, default=200)
+    parser.add_argument("--inter-token-ms", type=float, default=10)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    app_main = load_app(args.app)
+    app_main.bedrock_boto_client = FakeBedrockRuntime(
+        output_tokens=args.tokens,
+        first_token_latency=args.first_token_ms / 1000,
+        inter_token_latency=args.inter_token_ms / 1000,
+    )
+    params = build_params(args.app, app_main)
+
+    results = {}
+    for mode, generator in (("blocking", blocking_generator(args.app, app_main)),
+                            ("bridged", bridged_generator(args.app, app_main))):
+        results[mode] = asyncio.run(run_mode(generator, params, args.streams))
+        print(f"{mode:>9}: " + ", ".join(f"{key}={value}" for key, value in results[mode].items()))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"benchmark": "streaming", "app": args.app, "args": vars(args), "results": results},
+                      output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# The RagGenAI workflow offline. Runs the state machine of --app with the local ASL interpreter (asl_interpreter.py)
+# and the app's in-process engine (inline_workflow.py), both against the same fake Bedrock models and Knowledge Base
+# with the given latency distributions, and reports execution latency, the states on the critical path, Parallel
+# branch timings, output sizes and whether both engines returned the same outputs.
+#
+# --variants standard speculative runs RagGenAI.asl.json and RagGenAISpeculative.asl.json, where the Retrieve starts
+# with the Parallel state, and reports the latency the speculative Retrieve removes and the Retrieve calls it adds.
+# The best Retrieve score of a query is between --min-top-score and 1; speculative results are kept from 0.5.
+#
+# With --baseline, compares the p50 latency and output size with a previous --output file and exits with status 1
+# when one grew by more than --tolerance.
+#
+#   python benchmarks/bench_workflow.py --app rag --executions 200 --concurrency 20 --retrieve-rate 0.8
+#   python benchmarks/bench_workflow.py --app web --variants standard speculative --min-top-score 0.3
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import Counter, defaultdict
+
+from apps import APP_ENV, APP_PATHS
+from asl_interpreter import (INVOKE_MODEL, RETRIEVE, STATE_MACHINE_DIRS, STATE_MACHINE_VARIANTS, LocalStateMachine,
+                             critical_path, load_definition)
+from fakes import FakeBedrockModels, FakeKnowledgeBase
+
+KNOWLEDGE_BASE_ID = "BENCHMARKKB"
+# End states of the executions that used Knowledge Base results
+RETRIEVAL_END_STATES = ("GenerateResponseKb", "GenerateResponseKBError")
+
+
+def conversation(app_name, index):
+    """Workflow input of the index-th conversation: two turns of history and a new question."""
+    turns = [("user", f"What is service {index}?"), ("assistant", f"Service {index} is a managed service."),
+             ("user", f"How do I deploy service {index} with AWS SAM?")]
+    if app_name == "web":
+        messages = [{"role": role, "content": [{"text": text}]} for role, text in turns]
+    else:
+        messages = [{"role": role, "content": text} for role, text in turns]
+    return {"PromptInput": messages, "state_machine_custom_params": {}}
+
+
+def percentile(values, fraction):
+    values = sorted(values) or [0]
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def ms(value):
+    return round(value, 1)
+
+
+def create_fakes(args):
+    models = FakeBedrockModels(
+        latency={"anthropic": args.keywords_latency, "meta": args.policy_latency},
+        retrieve_rate=args.retrieve_rate, seed=args.seed
+    )
+    knowledge_base = FakeKnowledgeBase(documents=args.documents, document_chars=args.document_chars,
+                                       latency=args.retrieve_latency, error_rate=args.retrieve_error_rate,
+                                       min_top_score=args.min_top_score, seed=args.seed)
+    return models, knowledge_base
+
+
+async def run_executions(run_one, inputs, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(input_data):
+        async with semaphore:
+            started = time.perf_counter()
+            result = await run_one(input_data)
+            return result, 1000 * (time.perf_counter() - started)
+
+    return await asyncio.gather(*(limited(input_data) for input_data in inputs))
+
+
+def asl_summary(executions):
+    durations = [execution.duration for execution in executions]
+    retrieving = [execution.duration for execution in executions
+                  if execution.trace and execution.trace[-1].name in RETRIEVAL_END_STATES]
+    state_durations = defaultdict(list)
+    critical_ms = Counter()
+    branch_durations = defaultdict(list)
+    for execution in executions:
+        for name, duration in critical_path(execution.trace):
+            critical_ms[name] += duration
+        for record in execution.trace:
+            state_durations[record.name].append(record.duration)
+            for branch in record.branches:
+                for state in branch:
+                    state_durations[f"{record.name}/{state.name}"].append(state.duration)
+                if branch:
+                    branch_durations[f"{record.name}/{branch[0].name}"].append(branch[-1].ended - branch[0].started)
+    total_ms = sum(durations) or 1
+    return {
+        "end_states": dict(Counter(execution.trace[-1].name for execution in executions if execution.trace)),
+        "state_executions": dict(Counter(record.name for execution in executions for record in execution.trace)),
+        "retrieving_latency_p50_ms": ms(percentile(retrieving, 0.5)),
+        "state_p50_ms": {name: ms(percentile(values, 0.5)) for name, values in state_durations.items()},
+        "branch_p50_ms": {name: ms(percentile(values, 0.5)) for name, values in branch_durations.items()},
+        # Share of the total execution time spent waiting on each state; the rest is interpreter overhead
+        "critical_path_pct": {name: round(100 * value / total_ms, 1) for name, value in critical_ms.most_common()},
+        "overhead_pct": round(100 * (1 - sum(critical_ms.values()) / total_ms), 1),
+    }
+
+
+def summarize(results, knowledge_base):
+    durations = [duration for _, duration in results]
+    outputs = [output for output, _ in results]
+    sizes = [len(json.dumps(output, separators=(",", ":"))) for output in outputs if output is not None]
+    return {
+        "executions": len(results),
+        "failed": sum(1 for output in outputs if output is None),
+        "latency_mean_ms": ms(sum(durations) / max(1, len(durations))),
+        "latency_p50_ms": ms(percentile(durations, 0.5)),
+        "latency_p95_ms": ms(percentile(durations, 0.95)),
+        "latency_p99_ms": ms(percentile(durations, 0.99)),
+        "output_bytes_p50": percentile(sizes, 0.5),
+        "output_bytes_max": max(sizes, default=0),
+        "retrieve_calls_per_execution": round(knowledge_base.calls / max(1, len(results)), 2),
+    }
+
+
+def run_asl(args, inputs, variant):
+    models, knowledge_base = create_fakes(args)
+    definition = load_definition(STATE_MACHINE_DIRS[args.app] / STATE_MACHINE_VARIANTS[variant],
+                                 {"AWSRegion": APP_ENV["AWS_DEFAULT_REGION"], "KnowledgeBaseId": KNOWLEDGE_BASE_ID})
+    machine = LocalStateMachine(definition, {INVOKE_MODEL: models, RETRIEVE: knowledge_base})
+
+    async def run_one(input_data):
+        execution = await machine.execute(input_data)
+        return execution.output if execution.status == "SUCCEEDED" else None
+
+    results = asyncio.run(run_executions(run_one, inputs, args.concurrency))
+    summary = summarize(results, knowledge_base)
+    summary.update(asl_summary(machine.executions))
+    return summary, [output for output, _ in results]
+
+
+def run_inline(args, inputs, variant):
+    for path in reversed(APP_PATHS[args.app]):
+        sys.path.insert(0, str(path))
+    from inline_workflow import InlineWorkflow
+
+    models, knowledge_base = create_fakes(args)
+    engine = InlineWorkflow(models, knowledge_base, KNOWLEDGE_BASE_ID, speculative_retrieval=variant == "speculative")
+
+    async def run_one(input_data):
+        response = await engine.start_sync_execution(engine.name, json.dumps(input_data))
+        return json.loads(response["output"]) if response["status"] == "SUCCEEDED" else None
+
+    results = asyncio.run(run_executions(run_one, inputs, args.concurrency))
+    return summarize(results, knowledge_base), [output for output, _ in results]
+
+
+def speculative_savings(standard, speculative):
+    """What the speculative Retrieve removes from the execution latency, and the Retrieve calls it adds."""
+    savings = {metric: ms(standard[metric] - speculative[metric])
+               for metric in ("latency_mean_ms", "latency_p50_ms", "latency_p95_ms", "retrieving_latency_p50_ms")
+               if metric in standard}
+    savings["retrieve_calls_added_per_execution"] = round(
+        speculative["retrieve_calls_per_execution"] - standard["retrieve_calls_per_execution"], 2
+    )
+    return savings
+
+
+def check_baseline(results, baseline_path, tolerance):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)["results"]
+    regressions = []
+    for engine, summary in results.items():
+        if not isinstance(summary, dict) or "latency_p50_ms" not in summary:
+            continue
+        for metric in ("latency_p50_ms", "output_bytes_p50"):
+            previous = baseline.get(engine, {}).get(metric)
+            if previous and summary[metric] > previous * (1 + tolerance):
+                regressions.append(f"{engine} {metric}: {previous} -> {summary[metric]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RagGenAI workflow benchmark")
+    parser.add_argument("--app", choices=["web", "rag"], default="rag")
+    parser.add_argument("--engines", nargs="+", choices=["asl", "inline"], default=["asl", "inline"])
+    parser.add_argument("--variants", nargs="+", choices=list(STATE_MACHINE_VARIANTS), default=["standard"])
+    parser.add_argument("--executions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--keywords-latency", default="lognormal:0.35:1.0", help="Claude keywords task latency spec")
+    parser.add_argument("--policy-latency", default="lognormal:0.25:0.7", help="Llama KB bypass policy latency spec")
+    parser.add_argument("--retrieve-latency", default="lognormal:0.15:0.5", help="Knowledge Base Retrieve latency")
+    parser.add_argument("--retrieve-rate", type=float, default=0.8, help="share of conversations that retrieve")
+    parser.add_argument("--retrieve-error-rate", type=float, default=0.0)
+    parser.add_argument("--min-top-score", type=float, default=0.3, help="lowest best score of a Retrieve")
+    parser.add_argument("--documents", type=int, default=5)
+    parser.add_argument("--document-chars", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="previous --output file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed growth over the baseline")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    inputs = [conversation(args.app, index) for index in range(args.executions)]
+    results, outputs = {}, {}
+    for variant in args.variants:
+        for engine in args.engines:
+            name = f"{engine}:{variant}"
+            results[name], outputs[name] = (run_asl if engine == "asl" else run_inline)(args, inputs, variant)
+            print(f"{name}: " + ", ".join(f"{key}={value}" for key, value in results[name].items()))
+        if len(args.engines) == 2:
+            # Same fakes and inputs: the in-process engine must return what the state machine returns
+            mismatches = sum(1 for asl_output, inline_output in zip(outputs[f"asl:{variant}"],
+                                                                   outputs[f"inline:{variant}"])
+                             if asl_output != inline_output)
+            results.setdefault("outputs_match", True)
+            results["outputs_match"] &= mismatches == 0
+            print(f"outputs {variant}: {len(inputs) - mismatches}/{len(inputs)} identical")
+    if len(args.variants) == 2:
+        results["speculative_savings"] = {
+            engine: speculative_savings(results[f"{engine}:standard"], results[f"{engine}:speculative"])
+            for engine in args.engines
+        }
+        for engine, savings in results["speculative_savings"].items():
+            print(f"speculative savings {engine}: " + ", ".join(f"{key}={value}" for key, value in savings.items()))
+
+    regressions = check_baseline(results, args.baseline, args.tolerance) if args.baseline else []
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"benchmark": "workflow", "app": args.app, "args": vars(args), "results": results},
+                      output_file, indent=2)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Local stand-ins for the boto3 clients used by the example apps. They reproduce the response shapes and the
+# blocking behaviour of the real clients (time.sleep while "waiting on the network") without an AWS account. The
+# workflow task fakes also serve as Task handlers of asl_interpreter.py, awaited with asyncio.sleep.
+
+import asyncio
+import hashlib
+import io
+import json
+import math
+import random
+import threading
+import time
+
+
+class FakeEventStream:
+    """Blocking iterator over pre-built events, similar to botocore's EventStream. Closing it stops the events, as
+    closing the HTTP connection stops Bedrock."""
+
+    def __init__(self, events, first_event_delay, event_delay):
+        self._events = events
+        self._first_event_delay = first_event_delay
+        self._event_delay = event_delay
+        self.closed = False
+        self.closed_at = None
+        self.events_sent = 0
+
+    def __iter__(self):
+        for index, event in enumerate(self._events):
+            time.sleep(self._first_event_delay if index == 0 else self._event_delay)
+            if self.closed:
+                return
+            self.events_sent += 1
+            yield event
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.closed_at = time.perf_counter()
+
+
+class FakeBedrockRuntime:
+    """Fake bedrock-runtime client streaming `output_tokens` words with configurable latencies."""
+
+    def __init__(self, output_tokens=50, first_token_latency=0.2, inter_token_latency=0.01):
+        self.output_tokens = output_tokens
+        self.first_token_latency = first_token_latency
+        self.inter_token_latency = inter_token_latency
+        self.calls = 0
+        self.streams = []
+
+    def _words(self):
+        return [f"token{i} " for i in range(self.output_tokens)]
+
+    def converse_stream(self, **kwargs):
+        self.calls += 1
+        events = [{"messageStart": {"role": "assistant"}}]
+        events += [{"contentBlockDelta": {"delta": {"text": word}, "contentBlockIndex": 0}} for word in self._words()]
+        events += [
+            {"contentBlockStop": {"contentBlockIndex": 0}},
+            {"messageStop": {"stopReason": "end_turn"}},
+            {"metadata": {
+                "usage": {"inputTokens": 100, "outputTokens": self.output_tokens, "totalTokens": 100 + self.output_tokens},
+                "metrics": {"latencyMs": int(1000 * (self.first_token_latency
+                                                     + self.inter_token_latency * self.output_tokens))}
+            }},
+        ]
+        stream = FakeEventStream(events, self.first_token_latency, self.inter_token_latency)
+        self.streams.append(stream)
+        return {"stream": stream}
+
+    def invoke_model_with_response_stream(self, body, modelId, **kwargs):
+        self.calls += 1
+        chunks = [{"type": "message_start", "message": {"role": "assistant", "usage": {"input_tokens": 100}}}]
+        chunks += [{"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": word}}
+                   for word in self._words()]
+        chunks += [
+            {"type": "content_block_stop", "index": 0},
+            {"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+             "usage": {"output_tokens": self.output_tokens}},
+            {"type": "message_stop", "amazon-bedrock-invocationMetrics": {
+                "inputTokenCount": 100, "outputTokenCount": self.output_tokens,
+                "invocationLatency": int(1000 * (self.first_token_latency
+                                                 + self.inter_token_latency * self.output_tokens))}},
+        ]
+        events = [{"chunk": {"bytes": json.dumps(chunk).encode()}} for chunk in chunks]
+        stream = FakeEventStream(events, self.first_token_latency, self.inter_token_latency)
+        self.streams.append(stream)
+        return {"body": stream}
+
+
+class FakeStepFunctions:
+    """Fake stepfunctions client: start_sync_execution blocks for `latency` seconds and succeeds with `output`."""
+
+    def __init__(self, output, latency=0.2):
+        self.output = output
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def start_sync_execution(self, stateMachineArn, input, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return {"executionArn": f"{stateMachineArn}:execution", "status": "SUCCEEDED", "output": json.dumps(self.output)}
+
+
+def retrieval_results(documents=3, document_chars=None, top_score=1.0):
+    """Knowledge Base Retrieve results as boto3 returns them, with `document_chars` characters of text each if set, by
+    descending score."""
+    results = []
+    for i in range(documents):
+        text = f"Document {i} text."
+        if document_chars:
+            text = (text + " " + "lorem ipsum " * (document_chars // 12 + 1))[:document_chars]
+        results.append({"content": {"text": text}, "location": {"s3Location": {"uri": f"s3://docs/{i}.txt"}},
+                        "score": round(top_score * (1 - i / 10), 4)})
+    return results
+
+
+def step_functions_keys(value):
+    """A boto3 response as the aws-sdk integrations of Step Functions return it: PascalCase keys at every level.
+    The keys of metadata maps are data, they are kept as they are."""
+    if isinstance(value, list):
+        return [step_functions_keys(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return {key[:1].upper() + key[1:]: item if key == "metadata" else step_functions_keys(item)
+            for key, item in value.items()}
+
+
+def retrieval_output(documents=3):
+    """Workflow output of a Knowledge Base retrieval, as the apps' StepFunctionResponse models expect it."""
+    return {
+        "bedrock_details": {"task_details": [], "total_input_tokens": 0, "total_output_tokens": 0},
+        "context_data": step_functions_keys(retrieval_results(documents)),
+    }
+
+
+class Latency:
+    """Latency distribution of a fake call in seconds, from a spec: "fixed:<s>", "uniform:<low>:<high>" or
+    "lognormal:<median>:<p99>"."""
+
+    def __init__(self, spec, seed=0):
+        self.spec = spec
+        kind, *values = spec.split(":")
+        self.kind = kind
+        self.values = [float(value) for value in values]
+        if (kind, len(self.values)) not in (("fixed", 1), ("uniform", 2), ("lognormal", 2)):
+            raise ValueError(f"Invalid latency spec: {spec}")
+        self._random = random.Random(seed)
+
+    def sample(self):
+        if self.kind == "fixed":
+            return self.values[0]
+        if self.kind == "uniform":
+            return self._random.uniform(*self.values)
+        median, p99 = self.values
+        # z of the 99th percentile of the standard normal distribution
+        sigma = max(0.0, math.log(p99 / median) / 2.326)
+        return self._random.lognormvariate(math.log(median), sigma)
+
+    def __repr__(self):
+        return f"Latency({self.spec!r})"
+
+
+def _fraction(text):
+    """Stable pseudo random number in [0, 1) for a text, so decisions repeat for the same request."""
+    return int(hashlib.sha256(text.encode()).hexdigest()[:8], 16) / 2 ** 32
+
+
+def _service_error(code, operation):
+    from botocore.exceptions import ClientError
+    return ClientError({"Error": {"Code": code, "Message": f"Injected {code}"}}, operation)
+
+
+class FakeBedrockModels:
+    """Fake Bedrock InvokeModel for the workflow tasks, with Claude (Messages API) and Llama 3 response bodies.
+
+    The Llama answer to the KB bypass policy prompt is false, i.e. "retrieve", for `retrieve_rate` of the
+    conversations, and `error_rate` of the requests fail with a ThrottlingException. Both are decided by the request
+    content, so two engines running the same conversations get the same answers. `latency` is a Latency, or a dict
+    of them by model provider ("anthropic", "meta"). Serves the bedrock:invokeModel Task of asl_interpreter
+    (awaited) and the invoke_model calls of inline_workflow (blocking).
+    """
+
+    def __init__(self, latency="fixed:0.3", retrieve_rate=1.0, keywords="serverless, aws lambda, step functions",
+                 error_rate=0.0, seed=0):
+        latencies = latency if isinstance(latency, dict) else {"anthropic": latency, "meta": latency}
+        self.latencies = {provider: Latency(spec, seed + index) if isinstance(spec, str) else spec
+                          for index, (provider, spec) in enumerate(sorted(latencies.items()))}
+        self.retrieve_rate = retrieve_rate
+        self.keywords = keywords
+        self.error_rate = error_rate
+        self.seed = seed
+        self.calls = 0
+
+    def _provider(self, model_id):
+        return model_id.split("/")[-1].split(".", 1)[0]
+
+    def respond(self, model_id, body):
+        """Response body of InvokeModel for the model and request body."""
+        self.calls += 1
+        if _fraction(f"{self.seed}:error:{model_id}:{json.dumps(body, sort_keys=True)}") < self.error_rate:
+            raise _service_error("ThrottlingException", "InvokeModel")
+        name = model_id.split("/")[-1]
+        if self._provider(model_id) == "anthropic":
+            return {
+                "id": f"msg_{self.calls}", "type": "message", "role": "assistant",
+                "model": name.split(".", 1)[1].rsplit("-v", 1)[0],
+                "content": [{"type": "text", "text": self.keywords}],
+                "stop_reason": "stop_sequence", "stop_sequence": "</keywords>",
+                "usage": {"input_tokens": len(json.dumps(body.get("messages", []))) // 4 + 1,
+                          "output_tokens": len(self.keywords.split())},
+            }
+        if self._provider(model_id) == "meta":
+            retrieve = _fraction(body["prompt"]) < self.retrieve_rate
+            return {"generation": " false" if retrieve else " true", "prompt_token_count": len(body["prompt"]) // 4,
+                    "generation_token_count": 2, "stop_reason": "stop"}
+        raise _service_error("ValidationException", "InvokeModel")
+
+    def _latency(self, model_id):
+        latency = self.latencies.get(self._provider(model_id))
+        return latency.sample() if latency else 0.0
+
+    async def __call__(self, parameters):
+        await asyncio.sleep(self._latency(parameters["ModelId"]))
+        return {"Body": self.respond(parameters["ModelId"], parameters["Body"]), "ContentType": "application/json"}
+
+    def invoke_model(self, modelId, body, **kwargs):
+        time.sleep(self._latency(modelId))
+        response_body = self.respond(modelId, json.loads(body))
+        return {"body": io.BytesIO(json.dumps(response_body).encode()), "contentType": "application/json"}
+
+
+class FakeKnowledgeBase:
+    """Fake Knowledge Base Retrieve returning `documents` results of `document_chars` characters. The best score of
+    a query is between `min_top_score` and 1, decided by the query. Serves the aws-sdk:bedrockagentruntime:retrieve
+    Task of asl_interpreter (awaited) and the retrieve calls of inline_workflow (blocking)."""
+
+    def __init__(self, documents=5, document_chars=1000, latency="fixed:0.2", error_rate=0.0, min_top_score=1.0,
+                 seed=0):
+        self.documents = documents
+        self.document_chars = document_chars
+        self.min_top_score = min_top_score
+        self.latency = Latency(latency, seed) if isinstance(latency, str) else latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self.calls = 0
+        self.queries = []
+
+    def results(self, knowledge_base_id, query):
+        self.calls += 1
+        self.queries.append(query)
+        if not knowledge_base_id:
+            raise _service_error("ValidationException", "Retrieve")
+        if _fraction(f"{self.seed}:error:{query}") < self.error_rate:
+            raise _service_error("ThrottlingException", "Retrieve")
+        top_score = 1 - (1 - self.min_top_score) * _fraction(f"{self.seed}:score:{query}")
+        return retrieval_results(self.documents, self.document_chars, top_score)
+
+    async def __call__(self, parameters):
+        await asyncio.sleep(self.latency.sample())
+        return step_functions_keys({
+            "retrievalResults": self.results(parameters["KnowledgeBaseId"], parameters["RetrievalQuery"]["Text"])
+        })
+
+    def retrieve(self, knowledgeBaseId, retrievalQuery, **kwargs):
+        time.sleep(self.latency.sample())
+        return {"retrievalResults": self.results(knowledgeBaseId, retrievalQuery["text"])}
+
+
+class FakeAccountDataAccess:
+    """Stand-in for the web app's AccountDataAccess: every workflow runs the same state machine."""
+
+    state_machine_arn = "arn:aws:states:us-east-1:123456789012:stateMachine:benchmark"
+
+    def __init__(self, claims):
+        self.claims = claims
+        self.account_id = claims.get("custom:account_id")
+
+    def get_workflow_details(self, workflow_id):
+        return {"arn": self.state_machine_arn, "item_type": workflow_id}
+
+
+class FakeDynamoDBClient:
+    """Low-level DynamoDB client stand-in keeping items in memory.
+
+    batch_write_item leaves a random share of the requests unprocessed, like a throttled table does.
+    """
+
+    def __init__(self, latency=0.005, unprocessed_ratio=0.0, seed=0):
+        self.latency = latency
+        self.unprocessed_ratio = unprocessed_ratio
+        self.items = {}
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def put_item(self, TableName, Item):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            self.items[(TableName, Item["id"]["S"], Item["item_type"]["S"])] = Item
+        return {}
+
+    def get_item(self, TableName, Key, **kwargs):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            item = self.items.get((TableName, Key["id"]["S"], Key["item_type"]["S"]))
+        return {"Item": item} if item else {}
+
+    def batch_write_item(self, RequestItems):
+        time.sleep(self.latency)
+        unprocessed = {}
+        with self._lock:
+            self.calls += 1
+            for table_name, requests in RequestItems.items():
+                if len(requests) > 25:
+                    raise ValueError("Too many items requested for the BatchWriteItem call")
+                for request in requests:
+                    if self._random.random() < self.unprocessed_ratio:
+                        unprocessed.setdefault(table_name, []).append(request)
+                        continue
+                    item = request["PutRequest"]["Item"]
+                    self.items[(table_name, item["id"]["S"], item["item_type"]["S"])] = item
+        return {"UnprocessedItems": unprocessed}
@@ -0,0 +1,102 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Serves one of the example apps with uvicorn, like run.sh does in Lambda, with the fakes of fakes.py in place of
+# Bedrock, Step Functions and DynamoDB. Started by bench_load.py, it can also be run on its own to drive the app
+# with another load generator.
+#
+# GET /_benchmark/usage answers with the CPU time and memory of the server process, so a load generator can
+# attribute them to the requests it sent.
+#
+#   python benchmarks/load_server.py --app web --port 8081 --tokens 200
+
+import argparse
+import json
+import resource
+import sys
+
+import uvicorn
+
+from apps import APP_ENV, load_app
+from fakes import FakeBedrockRuntime, FakeDynamoDBClient, FakeStepFunctions, retrieval_output
+
+USAGE_PATH = "/_benchmark/usage"
+# Account of the x-access-token sent by apps.request_body, and the workflow item its requests run. With --accounts,
+# the other accounts are numbered after it.
+ACCOUNT_ID = "benchmark"
+WORKFLOW_ITEM_TYPE = "workflow#details#1"
+
+
+def rss_kb():
+    """Resident memory of this process, None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+    except OSError:
+        return None
+
+
+def usage():
+    rusage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss_kb = rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss
+    return {"cpu_seconds": rusage.ru_utime + rusage.ru_stime, "rss_kb": rss_kb(), "max_rss_kb": max_rss_kb}
+
+
+def with_usage_endpoint(app):
+    """ASGI app answering USAGE_PATH itself and passing every other request to `app`."""
+    async def serve(scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != USAGE_PATH:
+            return await app(scope, receive, send)
+        body = json.dumps(usage()).encode()
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+    return serve
+
+
+def account_ids(accounts):
+    return [ACCOUNT_ID] + [f"{ACCOUNT_ID}-{index}" for index in range(1, accounts)]
+
+
+def workflow_item(account_id=ACCOUNT_ID):
+    """The web app's workflow config item, in DynamoDB's attribute value format."""
+    return {"id": {"S": f"account#{account_id}"}, "item_type": {"S": WORKFLOW_ITEM_TYPE},
+            "type": {"S": "stepfunctions"}, "arn": {"S": APP_ENV["STATEMACHINE_STATE_MACHINE_ARN"]}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Example app served against local fakes")
+    parser.add_argument("--app", choices=["web", "rag"], default="web")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--tokens", type=int, default=200, help="output tokens of an answer")
+    parser.add_argument("--first-token-ms", type=float, default=200)
+    parser.add_argument("--inter-token-ms", type=float, default=10)
+    parser.add_argument("--workflow-ms", type=float, default=500, help="Step Functions sync execution latency")
+    parser.add_argument("--documents", type=int, default=3, help="Knowledge Base results in the workflow output")
+    parser.add_argument("--dynamodb-ms", type=float, default=5)
+    parser.add_argument("--accounts", type=int, default=1, help="web app accounts with a workflow item")
+    args = parser.parse_args()
+
+    app_main = load_app(args.app)
+    app_main.bedrock_boto_client = FakeBedrockRuntime(
+        output_tokens=args.tokens, first_token_latency=args.first_token_ms / 1000,
+        inter_token_latency=args.inter_token_ms / 1000
+    )
+    app_main.sf_boto_client = FakeStepFunctions(retrieval_output(args.documents), latency=args.workflow_ms / 1000)
+    if args.app == "web":
+        from assistant_config_interface.data_manager import set_client_factory
+        dynamodb = FakeDynamoDBClient(latency=args.dynamodb_ms / 1000)
+        for account_id in account_ids(args.accounts):
+            dynamodb.put_item(TableName=APP_ENV["TABLE_NAME"], Item=workflow_item(account_id))
+        dynamodb.calls = 0
+        set_client_factory(lambda service_name: dynamodb)
+
+    uvicorn.run(with_usage_endpoint(app_main.app), host=args.host, port=args.port, log_level="warning",
+                access_log=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import math
+import time
+from collections import Counter, OrderedDict
+from os import environ
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger()
+
+# Admission control of the requests of this process, per account. Token buckets on requests and on estimated tokens
+# (history, system prompt and maxTokens) keep one account from using the whole Bedrock RPM and TPM quota, and the
+# admitted requests share ADMISSION_MAX_CONCURRENCY slots with weighted fair queuing across accounts. A request that
+# would wait more than ADMISSION_MAX_WAIT_SECONDS is rejected right away: 429 when its account is over its limits, 503
+# when the process is.
+ADMISSION_CONTROL_ENABLED = environ.get("ADMISSION_CONTROL_ENABLED", "false").lower() == "true"
+# Limits of each account, 0 for none
+ADMISSION_REQUESTS_PER_MINUTE = float(environ.get("ADMISSION_REQUESTS_PER_MINUTE", "60"))
+ADMISSION_TOKENS_PER_MINUTE = float(environ.get("ADMISSION_TOKENS_PER_MINUTE", "200000"))
+# Size of the buckets, in seconds of refill: the burst an idle account can send at once
+ADMISSION_BURST_SECONDS = float(environ.get("ADMISSION_BURST_SECONDS", "10"))
+# Requests running (workflow and model stream) at the same time, and requests waiting for their bucket or a slot
+ADMISSION_MAX_CONCURRENCY = int(environ.get("ADMISSION_MAX_CONCURRENCY", "32"))
+ADMISSION_MAX_QUEUE = int(environ.get("ADMISSION_MAX_QUEUE", "128"))
+ADMISSION_MAX_QUEUE_PER_ACCOUNT = int(environ.get("ADMISSION_MAX_QUEUE_PER_ACCOUNT", "16"))
+ADMISSION_MAX_WAIT_SECONDS = float(environ.get("ADMISSION_MAX_WAIT_SECONDS", "5"))
+# Share of the slots of each account when they compete for them, as JSON {"<account id>": weight}. Accounts not
+# listed have weight 1.
+ADMISSION_ACCOUNT_WEIGHTS = environ.get("ADMISSION_ACCOUNT_WEIGHTS", "{}")
+# Output tokens counted for a request that doesn't set its maximum
+ADMISSION_DEFAULT_MAX_TOKENS = int(environ.get("ADMISSION_DEFAULT_MAX_TOKENS", "1024"))
+# Accounts whose buckets are kept. Above it the least recently seen idle account is forgotten, and starts again with
+# full buckets.
+ADMISSION_MAX_ACCOUNTS = int(environ.get("ADMISSION_MAX_ACCOUNTS", "10000"))
+
+# Account of the requests that don't name one
+DEFAULT_ACCOUNT = "default"
+
+
+class AdmissionRejected(Exception):
+    """The request was not admitted. Retry after retry_after seconds."""
+
+    def __init__(self, message: str, status_code: int, retry_after: float, reason: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason
+
+
+class TokenBucket:
+    """Refills at rate units per second, up to capacity.
+
+    take() may leave the bucket below zero. The next request then waits until it is back, so an account's waiting
+    requests go in arrival order and a request larger than the bucket only waits for a full one.
+    """
+
+    def __init__(self, rate: float, capacity: float, now: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken."""
+        self._refill(now)
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.level -= amount
+
+    def give_back(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.level >= self.capacity
+
+
+class AccountState:
+    """Buckets and fair queuing state of one account."""
+
+    def __init__(self, requests: Optional[TokenBucket], tokens: Optional[TokenBucket], weight: float):
+        self.requests = requests
+        self.tokens = tokens
+        self.weight = weight
+        self.last_finish = 0.0  # virtual finish tag of its last queued request
+        self.waiting = 0
+        self.running = 0
+
+    def buckets(self, tokens: int) -> List[Tuple[TokenBucket, float]]:
+        return [(bucket, amount) for bucket, amount in ((self.requests, 1), (self.tokens, tokens)) if bucket]
+
+    def idle(self, now: float) -> bool:
+        return not self.waiting and not self.running and all(bucket.full(now) for bucket, _ in self.buckets(0))
+
+
+class AdmissionTicket:
+    """Slot of an admitted request. release() it when the response ends, settle() it with the tokens the model used."""
+
+    def __init__(self, controller: "AdmissionController", account: AccountState, tokens: int, wait_ms: float,
+                 queue_depth: int):
+        self.controller = controller
+        self.account = account
+        self.tokens = tokens
+        self.wait_ms = wait_ms
+        self.queue_depth = queue_depth  # requests waiting when it arrived
+        self._settled = False
+        self._released = False
+
+    def settle(self, tokens_used: int) -> None:
+        """Gives back the estimated tokens the model didn't use, or takes the ones it used over the estimate."""
+        if self._settled:
+            return
+        self._settled = True
+        now = time.monotonic()
+        if self.account.tokens:
+            if tokens_used < self.tokens:
+                self.account.tokens.give_back(self.tokens - tokens_used, now)
+            else:
+                self.account.tokens.take(tokens_used - self.tokens, now)
+
+    def release(self) -> None:
+        """Frees the slot. Safe to call more than once."""
+        if self._released:
+            return
+        self._released = True
+        self.controller._release(self.account)
+
+
+class AdmissionController:
+    """Admits the requests of each account within its limits, and queues them fairly for the concurrency slots.
+
+    Weighted fair queuing, self-clocked: a queued request gets the finish tag max(virtual time, finish tag of the
+    account's previous request) + estimated tokens / account weight, and the free slots go to the lowest tags. The
+    virtual time is the tag of the last request that got a slot. An account sending many large requests pushes its own
+    tags back, not the other accounts' ones. Runs on the event loop, it is not thread safe.
+    """
+
+    def __init__(
+            self,
+            requests_per_minute: float = ADMISSION_REQUESTS_PER_MINUTE,
+            tokens_per_minute: float = ADMISSION_TOKENS_PER_MINUTE,
+            burst_seconds: float = ADMISSION_BURST_SECONDS,
+            max_concurrency: int = ADMISSION_MAX_CONCURRENCY,
+            max_queue: int = ADMISSION_MAX_QUEUE,
+            max_queue_per_account: int = ADMISSION_MAX_QUEUE_PER_ACCOUNT,
+            max_wait_seconds: float = ADMISSION_MAX_WAIT_SECONDS,
+            weights: Optional[Dict[str, float]] = None,
+            max_accounts: int = ADMISSION_MAX_ACCOUNTS
+    ):
+        self.requests_per_second = requests_per_minute / 60
+        self.tokens_per_second = tokens_per_minute / 60
+        self.burst_seconds = burst_seconds
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_account = max_queue_per_account
+        self.max_wait_seconds = max_wait_seconds
+        self.weights = weights if weights is not None else json.loads(ADMISSION_ACCOUNT_WEIGHTS)
+        self.max_accounts = max_accounts
+        self.virtual_time = 0.0
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected: Counter = Counter()
+        self._accounts: "OrderedDict[str, AccountState]" = OrderedDict()
+        # Heap of (finish tag, arrival, waiter, account)
+        self._queue: List[Tuple[float, int, asyncio.Future, AccountState]] = []
+        self._arrivals = itertools.count()
+
+    async def admit(self, account_id: str, tokens: int) -> AdmissionTicket:
+        """Waits until the request may run. Raises AdmissionRejected when it would wait too long."""
+        started = time.monotonic()
+        account = self._account(account_id, started)
+        queue_depth = self.waiting
+        if self.waiting >= self.max_queue:
+            raise self._reject("queue_full", 503, self.max_wait_seconds,
+                               f"Too many requests waiting ({self.waiting}), try again later")
+        if account.waiting >= self.max_queue_per_account:
+            raise self._reject("account_queue_full", 429, self.max_wait_seconds,
+                               f"Too many requests of account {account_id} waiting ({account.waiting})")
+        rate_wait = max([bucket.wait_time(amount, started) for bucket, amount in account.buckets(tokens)], default=0)
+        if rate_wait > self.max_wait_seconds:
+            raise self._reject("rate_limited", 429, rate_wait,
+                               f"Account {account_id} is over its request or token rate limit")
+
+        for bucket, amount in account.buckets(tokens):
+            bucket.take(amount, started)
+        self.waiting += 1
+        account.waiting += 1
+        try:
+            if rate_wait:
+                await asyncio.sleep(rate_wait)
+            await self._acquire_slot(account, tokens, started + self.max_wait_seconds)
+        except BaseException:
+            # Not admitted, so nothing was sent to the model
+            now = time.monotonic()
+            for bucket, amount in account.buckets(tokens):
+                bucket.give_back(amount, now)
+            raise
+        finally:
+            self.waiting -= 1
+            account.waiting -= 1
+
+        self.admitted += 1
+        return AdmissionTicket(self, account, tokens, 1000 * (time.monotonic() - started), queue_depth)
+
+    async def _acquire_slot(self, account: AccountState, tokens: int, deadline: float) -> None:
+        if self.running < self.max_concurrency and not self._queue:
+            self._start(account)
+            return
+        finish = max(self.virtual_time, account.last_finish) + max(1, tokens) / account.weight
+        account.last_finish = finish
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (finish, next(self._arrivals), waiter, account))
+        self._dispatch()
+        try:
+            await asyncio.wait_for(waiter, max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            raise self._reject("wait_timeout", 503, self.max_wait_seconds,
+                               f"No capacity within {self.max_wait_seconds} seconds, try again later")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release(account)
+            raise
+
+    def _dispatch(self) -> None:
+        while self._queue and self.running < self.max_concurrency:
+            finish, _, waiter, account = heapq.heappop(self._queue)
+            if waiter.done():
+                # Timed out or cancelled
+                continue
+            self.virtual_time = max(self.virtual_time, finish)
+            self._start(account)
+            waiter.set_result(None)
+
+    def _start(self, account: AccountState) -> None:
+        self.running += 1
+        account.running += 1
+
+    def _release(self, account: AccountState) -> None:
+        self.running -= 1
+        account.running -= 1
+        self._dispatch()
+
+    def _account(self, account_id: str, now: float) -> AccountState:
+        account = self._accounts.get(account_id)
+        if account is not None:
+            self._accounts.move_to_end(account_id)
+            return account
+        burst = self.burst_seconds
+        account = self._accounts[account_id] = AccountState(
+            TokenBucket(self.requests_per_second, max(1.0, self.requests_per_second * burst), now)
+            if self.requests_per_second else None,
+            TokenBucket(self.tokens_per_second, self.tokens_per_second * burst, now) if self.tokens_per_second else None,
+            float(self.weights.get(account_id, 1.0))
+        )
+        if len(self._accounts) > self.max_accounts:
+            idle_id = next((key for key, state in self._accounts.items() if state.idle(now)), None)
+            if idle_id is not None:
+                del self._accounts[idle_id]
+        return account
+
+    def _reject(self, reason: str, status_code: int, retry_after: float, message: str) -> AdmissionRejected:
+        self.rejected[reason] += 1
+        logger.warning(f"Request rejected ({reason}): {message}")
+        return AdmissionRejected(message, status_code, retry_after, reason)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "accounts": len(self._accounts),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
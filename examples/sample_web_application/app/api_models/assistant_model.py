@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Literal, Optional
 from pydantic import BaseModel, Field
 
 
@@ -15,3 +15,21 @@ class AssistantParameters(BaseModel):
         default={},
         description="Additional params to handle in the workflow"
     )
+    bypass_workflow_cache: bool = Field(
+        default=False,
+        description="Run the workflow even if a cached result exists for the same conversation window"
+    )
+    system_prompt_id: Optional[str] = Field(
+        default=None,
+        description="ID of a workflow#prompt#<workflow_id>#<prompt_id> item holding the system prompt, "
+                    "used instead of bedrock_converse_parameters.system_prompts"
+    )
+    history_token_budget: Optional[int] = Field(
+        default=None,
+        description="Estimated tokens of conversation history sent to the model, HISTORY_TOKEN_BUDGET if not set"
+    )
+    stream_format: Literal["text", "sse", "ndjson"] = Field(
+        default="text",
+        description="Response body format: the answer text, or typed events (content, context, usage, stop, error) "
+                    "as Server-Sent Events or newline delimited JSON"
+    )
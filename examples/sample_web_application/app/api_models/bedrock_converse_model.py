@@ -35,5 +35,5 @@ class BedrockConverseAPIRequest(BaseModel):
                                                                    pattern=r'^/[^/]+(?:/[^/]+)*$')
     inference_config: Optional[dict] = None
     messages: List
-    system_prompts: List[dict]
+    system_prompts: List[dict] = []
     #tool_config: Optional[ToolConfiguration] = None
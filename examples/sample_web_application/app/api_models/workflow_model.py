@@ -49,3 +49,8 @@ class StepFunctionResponse(BaseModel):
     )
 
     additional_messages: Optional[List] = None
+
+    error: bool = Field(
+        default=False,
+        description="Set when the workflow caught a task error and its output handles it"
+    )
@@ -0,0 +1,267 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from os import environ
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger()
+
+# In-process version of statemachine/rag_parallel_tasks/RagGenAI.asl.json: the same Bedrock and Knowledge Base calls,
+# made by this process with asyncio instead of a Step Functions express execution, and the same output. Changes to
+# the state machine must be made here too.
+INLINE_WORKFLOW_TYPE = "inline"
+
+# Knowledge Base of the Retrieve step, unless the workflow item sets knowledge_base_id
+KNOWLEDGE_BASE_ID = environ.get("KNOWLEDGE_BASE_ID", "")
+
+# Threads for the blocking Bedrock and Knowledge Base calls, two per execution during the Parallel state. A pool of its
+# own, as asyncio.to_thread's default one has min(32, CPUs + 4) threads and would queue the concurrent executions.
+INLINE_WORKFLOW_MAX_WORKERS = int(environ.get("INLINE_WORKFLOW_MAX_WORKERS", "128"))
+
+# Speculative variant (RagGenAISpeculative.asl.json): the Parallel state also retrieves with the last user query, and
+# the Retrieve with keywords only runs when the best speculative result scores below SPECULATIVE_MIN_SCORE
+SPECULATIVE_RETRIEVAL = environ.get("SPECULATIVE_RETRIEVAL", "false").lower() == "true"
+SPECULATIVE_MIN_SCORE = 0.5
+
+_workflow_executor = ThreadPoolExecutor(max_workers=INLINE_WORKFLOW_MAX_WORKERS, thread_name_prefix="inline-workflow")
+
+# Parallel state
+KEYWORDS_MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+KEYWORDS_PREFILL = {"role": "assistant", "content": "<keywords>"}
+KB_POLICY_MODEL_ID = "meta.llama3-8b-instruct-v1:0"
+KB_POLICY_SYSTEM = (
+    "You are a json object generator that follow the Rules: 1. Read the user/assistant JSON interaction history. "
+    "2. If the answer to the user's last query was clearly and detailed answered in the conversation history answer "
+    "the \"{\"boolean\":true}\". 3. If the user's last query was not clearly and detailed answered, return the "
+    "\"{\"boolean\":false}\". 4. use the json schema for boolean and answer with the json format "
+    "\"{\"boolean\":{value}\"."
+)
+KB_POLICY_PREFILL = "{\"boolean\":"
+KB_POLICY_PROMPT = (
+    "<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n{}<|eot_id|><|start_header_id|>user<|end_header_id|>"
+    "\n{}<|eot_id|><|start_header_id|)>assistant<end_header_id|>\n{}"
+)
+
+# Output states
+CHAIN_TAG = "chain-information"
+NO_RETRIEVAL_PROMPT = (
+    "No Data generated this time, this is likely due to a greeting, repeated user's query or the answer is already "
+    "provided in the conversation history. Check carefully and do not invent any information. You can answer user "
+    "greetings in a friendly way."
+)
+KB_INSTRUCTIONS_MESSAGE = {
+    "role": "assistant",
+    "content": [{"text": "<instructions>I will follow the instructions in system parameters to provide the answer."
+                         "</instructions>"}]
+}
+KB_ERROR_PROMPT = (
+    "You are an error handler task. Your rules are: 1. Inform that you are a error handler task. 2. Inform the user "
+    "you can't answer any question. 3. explain the bedrock error content bellow: Error: {} Cause: {}."
+)
+
+
+class WorkflowTaskFailed(Exception):
+    """A step failed without a Catch, which fails a Step Functions execution."""
+
+    def __init__(self, error: str, cause: str):
+        super().__init__(f"{error}: {cause}")
+        self.error = error
+        self.cause = cause
+
+
+def task_error(service: str, error: Exception) -> Tuple[str, str]:
+    """Error name and cause of a failed step, named like the Step Functions service integrations name them."""
+    response = getattr(error, "response", None)
+    if isinstance(response, dict) and "Error" in response:
+        return f"{service}.{response['Error'].get('Code')}", str(error)
+    return type(error).__name__, str(error)
+
+
+def step_functions_keys(value: Any) -> Any:
+    """A boto3 response as the aws-sdk integrations of Step Functions return it: PascalCase keys at every level, so
+    the output has the same shape with either engine. The keys of metadata maps are data, they are kept as they are."""
+    if isinstance(value, list):
+        return [step_functions_keys(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return {key[:1].upper() + key[1:]: item if key == "metadata" else step_functions_keys(item)
+            for key, item in value.items()}
+
+
+def format_argument(value: Any) -> str:
+    """An argument of States.Format: strings as is, other values as JSON."""
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class InlineWorkflow:
+    """Runs the workflow in process. Takes the place of the Step Functions client in WorkflowExecutor:
+    start_sync_execution returns a response like the Step Functions one.
+    """
+
+    def __init__(self, bedrock_client, agent_runtime_client, knowledge_base_id: str = KNOWLEDGE_BASE_ID,
+                 speculative_retrieval: bool = SPECULATIVE_RETRIEVAL):
+        self.bedrock_client = bedrock_client
+        self.agent_runtime_client = agent_runtime_client
+        self.knowledge_base_id = knowledge_base_id
+        self.speculative_retrieval = speculative_retrieval
+
+    @property
+    def name(self) -> str:
+        """Stands for the state machine ARN in logs and workflow cache keys."""
+        variant = "speculative:" if self.speculative_retrieval else ""
+        return f"{INLINE_WORKFLOW_TYPE}:{variant}{self.knowledge_base_id}"
+
+    async def start_sync_execution(self, stateMachineArn: str, input: str) -> Dict[str, Any]:
+        try:
+            output = await self.run(json.loads(input))
+        except WorkflowTaskFailed as e:
+            logger.warning(f"Inline workflow failed: {str(e)}")
+            return {"status": "FAILED", "error": e.error, "cause": e.cause}
+        return {"status": "SUCCEEDED", "output": json.dumps(output)}
+
+    async def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        # Parallel
+        branches = [self.insert_keywords(state["PromptInput"]), self.kb_bypass_policy(state["PromptInput"])]
+        if self.speculative_retrieval:
+            branches.append(self.speculative_retrieve(state["PromptInput"]))
+        try:
+            state["ParallelInput"] = list(await asyncio.gather(*branches))
+        except WorkflowTaskFailed:
+            raise
+        except Exception as e:
+            raise WorkflowTaskFailed(*task_error("Bedrock", e))
+
+        # Choice: retrieve unless the policy model answered that the history holds the answer
+        if state["ParallelInput"][1]["Body"]["content"][0]["text"] is not False:
+            return generate_response(state)
+
+        # Speculative Retrieve Choice
+        if self.speculative_retrieval and speculative_hit(state["ParallelInput"][2]):
+            state["KnowledgeBaseData"] = {"RetrievalResults": state["ParallelInput"][2]["RetrievalResults"]}
+            return generate_response_kb(state)
+
+        # Retrieve, with its Catch of States.ALL
+        try:
+            state["KnowledgeBaseData"] = {"RetrievalResults": await self.retrieve(state)}
+        except Exception as e:
+            error, cause = task_error("BedrockAgentRuntime", e)
+            state["KnowledgeBaseData"] = {"Error": error, "Cause": cause}
+            return generate_response_kb_error(state)
+        return generate_response_kb(state)
+
+    async def insert_keywords(self, messages: List) -> Dict[str, Any]:
+        body = await self._invoke_model(KEYWORDS_MODEL_ID, {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": 150,
+            "messages": [*messages, KEYWORDS_PREFILL],
+            "system": "",
+            "stop_sequences": ["</keywords>"],
+            "temperature": 0.7,
+        })
+        return {"Body": body}
+
+    async def kb_bypass_policy(self, messages: List) -> Dict[str, Any]:
+        body = await self._invoke_model(KB_POLICY_MODEL_ID, {
+            "prompt": KB_POLICY_PROMPT.format(KB_POLICY_SYSTEM, format_argument(messages), KB_POLICY_PREFILL),
+            "temperature": 0.3,
+            "top_p": 0.5,
+            "max_gen_len": 50,
+        })
+        # ResultSelector: the generation completes the prefilled JSON with a boolean
+        try:
+            decision = json.loads(body["generation"])
+        except ValueError:
+            raise WorkflowTaskFailed("States.Runtime", f"Invalid JSON in States.StringToJson: {body['generation']}")
+        return {"Body": {
+            "content": [{"text": decision}],
+            "model": KB_POLICY_MODEL_ID,
+            "usage": {"input_tokens": body["prompt_token_count"], "output_tokens": body["generation_token_count"]},
+        }}
+
+    async def speculative_retrieve(self, messages: List) -> Dict[str, Any]:
+        # With its Catch of States.ALL: a failure only means the Retrieve with keywords runs
+        try:
+            return {"RetrievalResults": await self._retrieve(format_argument(messages[-1]["content"]))}
+        except Exception as e:
+            error, cause = task_error("BedrockAgentRuntime", e)
+            return {"Error": error, "Cause": cause}
+
+    async def retrieve(self, state: Dict[str, Any]) -> List:
+        return await self._retrieve("{}, {}".format(
+            format_argument(state["PromptInput"][-1]["content"]),
+            format_argument(state["ParallelInput"][0]["Body"]["content"][0]["text"])
+        ))
+
+    async def _retrieve(self, query: str) -> List:
+        response = await asyncio.get_running_loop().run_in_executor(_workflow_executor, partial(
+            self.agent_runtime_client.retrieve,
+            knowledgeBaseId=self.knowledge_base_id,
+            retrievalQuery={"text": query}
+        ))
+        return step_functions_keys(response["retrievalResults"])
+
+    async def _invoke_model(self, model_id: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        response = await asyncio.get_running_loop().run_in_executor(_workflow_executor, partial(
+            self.bedrock_client.invoke_model,
+            modelId=model_id,
+            body=json.dumps(body),
+            contentType="application/json",
+            accept="application/json"
+        ))
+        return json.loads(response["body"].read())
+
+
+def speculative_hit(result: Dict[str, Any]) -> bool:
+    """Whether the speculative Retrieve found results relevant enough to skip the Retrieve with keywords."""
+    results = result.get("RetrievalResults") or [{}]
+    score = results[0].get("Score")
+    return isinstance(score, (int, float)) and not isinstance(score, bool) and score >= SPECULATIVE_MIN_SCORE
+
+
+def bedrock_details(state: Dict[str, Any]) -> Dict[str, Any]:
+    # The model branches; the speculative Retrieve one, if any, comes after them
+    bodies = [result["Body"] for result in state["ParallelInput"][:2]]
+    return {
+        "task_details": [
+            {"task_name": f"task{index}", "task_model_id": body["model"],
+             "input_token": body["usage"]["input_tokens"], "output_token": body["usage"]["output_tokens"]}
+            for index, body in enumerate(bodies)
+        ],
+        "total_input_tokens": sum(body["usage"]["input_tokens"] for body in bodies),
+        "total_output_tokens": sum(body["usage"]["output_tokens"] for body in bodies),
+    }
+
+
+def generate_response(state: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "bedrock_details": bedrock_details(state),
+        "context_data": [],
+        "system_chain_data": {"system_chain_prompt": NO_RETRIEVAL_PROMPT, "operation": "REPLACE_TAG",
+                              "configuration": {"replace_tag": CHAIN_TAG}},
+    }
+
+
+def generate_response_kb(state: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "bedrock_details": bedrock_details(state),
+        "system_chain_data": {"system_chain_prompt": format_argument(state["KnowledgeBaseData"]["RetrievalResults"]),
+                              "operation": "REPLACE_TAG", "configuration": {"replace_tag": CHAIN_TAG}},
+        "additional_messages": [KB_INSTRUCTIONS_MESSAGE],
+    }
+
+
+def generate_response_kb_error(state: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "bedrock_details": bedrock_details(state),
+        "system_chain_data": {
+            "system_chain_prompt": KB_ERROR_PROMPT.format(state["KnowledgeBaseData"]["Error"],
+                                                          state["KnowledgeBaseData"]["Cause"]),
+            "operation": "REPLACE_ALL",
+        },
+        "error": True,
+    }
@@ -1,19 +1,36 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+import asyncio
 import json
 import logging
-from typing import Dict, Any
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
 
-import boto3
 from fastapi import FastAPI, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
 
+from admission_control import (ADMISSION_CONTROL_ENABLED, ADMISSION_DEFAULT_MAX_TOKENS, DEFAULT_ACCOUNT,
+                               AdmissionController, AdmissionRejected, AdmissionTicket)
 from api_models.assistant_model import AssistantParameters
 from api_models.bedrock_converse_model import BedrockConverseAPIRequest
 from api_models.workflow_model import StepFunctionResponse, PromptChainParameters
-from assistant_config_interface.data_manager import AccountDataAccess
+from assistant_config_interface.data_manager import (AccountDataAccess, config_cache, set_client_factory,
+                                                     workflow_prompt_item_type)
+from clients import get_client
+from history_manager import HISTORY_TOKEN_BUDGET, WORKFLOW_HISTORY_TOKEN_BUDGET, HistoryManager
+from inline_workflow import INLINE_WORKFLOW_TYPE, KNOWLEDGE_BASE_ID, SPECULATIVE_RETRIEVAL, InlineWorkflow
+from prompt_cache import cache_usage, converse_system_blocks, use_prompt_cache
+from prompt_templates import PromptTemplate, prompt_templates
+from response_fanout import FANOUT_ENABLED, ResponseFanout, request_fingerprint
+from request_pipeline import REQUEST_PIPELINING, RequestStartMiddleware, StageTimer, warm_up_connection
+from stream_bridge import iterate_in_thread
+from stream_events import MEDIA_TYPES, content_event, encode_event, encode_stream, error_event
+from telemetry import count_disconnect, create_telemetry
+from workflow_cache import create_workflow_cache, workflow_cache_key
+from workflow_executor import WORKFLOW_COALESCING, ClientDisconnected, WorkflowExecutor
 
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
@@ -36,18 +53,74 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Boto3 clients
-bedrock_boto_client = boto3.client("bedrock-runtime")
-sf_boto_client = boto3.client("stepfunctions")
+# Records the arrival time of each request, before the body is parsed
+app.add_middleware(RequestStartMiddleware)
 
+# Boto3 clients, created on first use unless STARTUP_MODE=eager. They share the pool, timeout and retry settings of
+# clients.py, as does the DynamoDB client of the config layer.
+bedrock_boto_client = get_client("bedrock-runtime")
+sf_boto_client = get_client("stepfunctions")
+agent_runtime_boto_client = get_client("bedrock-agent-runtime")
+set_client_factory(get_client)
+
+# Awaits Step Functions sync executions without blocking the event loop
+workflow_executor = WorkflowExecutor()
+
+# Optional cache of workflow results for repeated questions, see WORKFLOW_CACHE_BACKEND
+workflow_cache = create_workflow_cache()
+
+# Per-request stage timings and token counts, see TELEMETRY_SINKS
+telemetry = create_telemetry()
+
+# Identical concurrent model requests share one Bedrock generation, see FANOUT_ENABLED
+response_fanout = ResponseFanout() if FANOUT_ENABLED else None
+
+# Per account rate limits and fair queuing of the requests, see ADMISSION_CONTROL_ENABLED
+admission_controller = AdmissionController() if ADMISSION_CONTROL_ENABLED else None
+
+
+async def execute_workflow(
+        state_machine_arn: str,
+        input_data: Dict[str, Any],
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+        use_cache: bool = True,
+        timer: Optional[StageTimer] = None,
+        workflow_client: Optional[Any] = None
+) -> StepFunctionResponse:
+    """Execute sync express workflow, or return the result of an identical execution: cached, or still running
+    for another request (WORKFLOW_COALESCING). workflow_client runs it, the Step Functions client by default."""
+    cache_key = None
+    if workflow_cache.enabled or WORKFLOW_COALESCING:
+        cache_key = workflow_cache_key(state_machine_arn, input_data)
+    # use_cache=False skips the cached result only: the execution is still shared with identical ones in flight, and
+    # its result refreshes the cache
+    if cache_key and workflow_cache.enabled and use_cache:
+        cached_output = await workflow_cache.get(cache_key)
+        logger.debug(f"Workflow cache: {workflow_cache.stats()}")
+        if cached_output is not None:
+            logger.info(f"Workflow result served from cache: {state_machine_arn}")
+            return StepFunctionResponse.model_validate_json(cached_output)
 
-def execute_workflow(state_machine_arn: str, input_data: Dict[str, Any]) -> StepFunctionResponse:
-    """Execute sync express workflow."""
     logger.info(f"Executing workflow: {state_machine_arn}")
-    response = sf_boto_client.start_sync_execution(
-        stateMachineArn=state_machine_arn,
-        input=json.dumps(input_data)
-    )
+    timer = timer or StageTimer()
+    coalesced = False
+
+    def record_coalesced(waiters: int) -> None:
+        nonlocal coalesced
+        coalesced = True
+        timer.count("workflow.coalesced", 1)
+        timer.count("workflow.coalesced_waiters", waiters)
+
+    response = await timer.measure("start_sync_execution", workflow_executor.start_sync_execution(
+        workflow_client or sf_boto_client,
+        state_machine_arn,
+        input_data,
+        is_disconnected=is_disconnected,
+        coalescing_key=cache_key if WORKFLOW_COALESCING else None,
+        on_coalesced=record_coalesced
+    ))
+    if coalesced:
+        logger.info(f"Workflow result shared with an identical execution in flight: {workflow_executor.stats()}")
 
     if response["status"] != "SUCCEEDED":
         error_msg = (
@@ -59,64 +132,176 @@ def execute_workflow(state_machine_arn: str, input_data: Dict[str, Any]) -> Step
 
     execution_data = StepFunctionResponse.model_validate_json(response['output'])
     logger.debug(f"Step Functions Response: {execution_data}")
+
+    # Results of a caught task error (e.g. the error handler prompt of a failed Retrieve) are not cached
+    caught_error = execution_data.error or any(
+        isinstance(item, dict) and "Error" in item for item in execution_data.context_data or []
+    )
+    # The call that started a shared execution caches its result for all of them
+    if cache_key and workflow_cache.enabled and not coalesced and not caught_error:
+        await workflow_cache.put(cache_key, response['output'])
     return execution_data
 
 
-def sf_build_context(
+async def sf_build_context(
         messages: list,
         system: str,
         assistant_parameters: AssistantParameters,
-        data_manager: AccountDataAccess
+        data_manager: AccountDataAccess,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+        timer: Optional[StageTimer] = None,
+        model_id: str = ""
 ) -> Dict[str, Any]:
-    """Build context """
+    """Build context. 'system_prompts' holds the converse API system blocks, with a cache checkpoint if possible."""
+    timer = timer or StageTimer()
+
     logger.info("Retrieving workload configuration")
-    workflow_details = data_manager.get_workflow_details(assistant_parameters.workflow_params['workflow_id'])
+    workflow_id = assistant_parameters.workflow_params['workflow_id']
+    if assistant_parameters.system_prompt_id:
+        # The system prompt is stored as a workflow#prompt item. When either item is not cached, both are read with
+        # one BatchGetItem and the lookups are answered from memory.
+        def load_config():
+            prompt_workflow_id = workflow_id.split("#")[-1]
+            data_manager.prefetch([
+                workflow_id,
+                workflow_prompt_item_type(prompt_workflow_id, assistant_parameters.system_prompt_id)
+            ])
+            return (
+                data_manager.get_workflow_details(workflow_id),
+                prompt_templates.from_prompt_item(data_manager, prompt_workflow_id,
+                                                  assistant_parameters.system_prompt_id)
+            )
 
-    logger.info(f"Executing Step Functions State Machine workflow arn: {workflow_details['arn']}")
-    sf_workflow_result = execute_workflow(
-        state_machine_arn=workflow_details['arn'],
+        workflow_details, template = await timer.measure("config_lookup", asyncio.to_thread(load_config))
+    else:
+        workflow_details = await timer.measure("config_lookup", asyncio.to_thread(
+            data_manager.get_workflow_details,
+            workflow_id
+        ))
+        template = prompt_templates.from_text(system)
+    logger.debug(f"Config cache: {config_cache.stats()}")
+
+    workflow_client, workflow_name = workflow_backend(workflow_details)
+    logger.info(f"Executing {workflow_details.get('type', 'stepfunctions')} workflow: {workflow_name}")
+    sf_workflow_result = await timer.measure("workflow", execute_workflow(
+        state_machine_arn=workflow_name,
         input_data={
             "PromptInput": messages,
             "state_machine_custom_params": assistant_parameters.state_machine_custom_params,
         },
-    )
+        is_disconnected=is_disconnected,
+        use_cache=not assistant_parameters.bypass_workflow_cache,
+        timer=timer,
+        workflow_client=workflow_client
+    ))
+    for task in sf_workflow_result.bedrock_details.task_details:
+        timer.count(f"{task.task_name}.input_tokens", task.input_token)
+        timer.count(f"{task.task_name}.output_tokens", task.output_token)
 
-    context = {
-        'system': build_system_context(system, sf_workflow_result.system_chain_data)
-    }
+    with timer.stage("prompt_assembly"):
+        static_prefix, dynamic_suffix = build_cacheable_system_context(template, sf_workflow_result.system_chain_data)
+        if use_prompt_cache(model_id, static_prefix):
+            system_prompts = converse_system_blocks(static_prefix, dynamic_suffix)
+        else:
+            system_prompts = [{'text': build_system_context(template, sf_workflow_result.system_chain_data)}]
+        context = {
+            'system_prompts': system_prompts
+        }
 
     if sf_workflow_result.additional_messages:
         context['additional_messages'] = sf_workflow_result.additional_messages
 
+    context['summary'] = workflow_summary(sf_workflow_result)
     return context
 
 
-def build_system_context(system: str, system_chain_data: PromptChainParameters) -> str:
+def workflow_backend(workflow_details: Dict[str, Any]) -> Tuple[Any, str]:
+    """Client running the workflow item and the name its executions are logged and cached under.
+
+    Items of type INLINE_WORKFLOW_TYPE run the steps of the state machine in this process, skipping the Step
+    Functions hop, against their knowledge_base_id or KNOWLEDGE_BASE_ID. Their speculative_retrieval attribute
+    overrides SPECULATIVE_RETRIEVAL.
+    """
+    if workflow_details.get('type') == INLINE_WORKFLOW_TYPE:
+        inline_workflow = InlineWorkflow(
+            bedrock_boto_client,
+            agent_runtime_boto_client,
+            workflow_details.get('knowledge_base_id') or KNOWLEDGE_BASE_ID,
+            workflow_details.get('speculative_retrieval', SPECULATIVE_RETRIEVAL)
+        )
+        return inline_workflow, inline_workflow.name
+    return sf_boto_client, workflow_details['arn']
+
+
+def workflow_summary(sf_workflow_result: StepFunctionResponse) -> Dict[str, Any]:
+    """Workflow output sent to the client as the context event of the typed stream formats."""
+    system_chain_data = sf_workflow_result.system_chain_data
+    return {
+        "tasks": [
+            {"task_name": task.task_name, "model_id": task.task_model_id,
+             "input_tokens": task.input_token, "output_tokens": task.output_token}
+            for task in sf_workflow_result.bedrock_details.task_details
+        ],
+        "operation": system_chain_data.operation if system_chain_data else None,
+        "additional_messages": len(sf_workflow_result.additional_messages or []),
+    }
+
+
+def build_system_context(template: PromptTemplate, system_chain_data: PromptChainParameters) -> str:
     """Build system context based on the operation returned from the workflow"""
-    logger.debug(f"Building system context with input: system='{system}', system_chain_data={system_chain_data}")
+    logger.debug(f"Building system context with input: template={template.content_hash}, "
+                 f"system_chain_data={system_chain_data}")
 
     if system_chain_data is None:
-        return system
+        return template.text
     else:
         operation = system_chain_data.operation
         system_chain_prompt = system_chain_data.system_chain_prompt
 
     if operation == "APPEND":
-        return f"{system}\n\n{system_chain_prompt}"
+        return f"{template.text}\n\n{system_chain_prompt}"
     elif operation == "REPLACE_TAG":
-        replace_tag = system_chain_data.configuration.replace_tag
-        opening_tag, closing_tag = f"<{replace_tag}>", f"</{replace_tag}>"
-        formatted_prompt = f"{opening_tag}{system_chain_prompt}{closing_tag}"
-        return system.replace(f"{opening_tag}{closing_tag}", formatted_prompt)
+        return template.render({system_chain_data.configuration.replace_tag: system_chain_prompt})
     elif operation == "REPLACE_ALL":
         return system_chain_prompt
     else:
-        return system
+        return template.text
 
 
-async def stream_bedrock_converse_api(bedrock_converse_params: BedrockConverseAPIRequest):
-    """Stream response from Bedrock converse API."""
-    try:
+def build_cacheable_system_context(
+        template: PromptTemplate,
+        system_chain_data: PromptChainParameters
+) -> Tuple[str, str]:
+    """Split the system context in a static prefix, identical across turns, and the dynamic workflow output.
+
+    Unlike build_system_context, REPLACE_TAG leaves the tag empty in the prefix and sends the filled tag after it, so
+    the prefix can be cached.
+    """
+    if system_chain_data is None:
+        return template.text, ""
+
+    operation = system_chain_data.operation
+    system_chain_prompt = system_chain_data.system_chain_prompt
+    if operation == "APPEND":
+        return template.text, system_chain_prompt
+    elif operation == "REPLACE_TAG":
+        replace_tag = system_chain_data.configuration.replace_tag
+        return template.text, f"<{replace_tag}>{system_chain_prompt}</{replace_tag}>"
+    elif operation == "REPLACE_ALL":
+        return "", system_chain_prompt
+    else:
+        return template.text, ""
+
+
+async def stream_bedrock_converse_api(
+        bedrock_converse_params: BedrockConverseAPIRequest,
+        timer: Optional[StageTimer] = None,
+        context_summary: Optional[Dict[str, Any]] = None,
+        admission_ticket: Optional[AdmissionTicket] = None
+):
+    """Stream response events from Bedrock converse API, see stream_events for the event types."""
+    def open_stream():
+        # Runs in a stream_bridge worker thread: both the request and the EventStream reads block
         stream_response = bedrock_boto_client.converse_stream(
             modelId=bedrock_converse_params.model_id,
             messages=bedrock_converse_params.messages,
@@ -124,24 +309,102 @@ async def stream_bedrock_converse_api(bedrock_converse_params: BedrockConverseAP
             inferenceConfig=bedrock_converse_params.inference_config,
             additionalModelRequestFields=bedrock_converse_params.additional_model_fields
         )
+        return stream_response.get('stream') or []
+
+    if context_summary is not None:
+        yield "context", context_summary
+
+    stop_reason = None
+    streamed_chars = 0
+    replayed = False
+    try:
+        if response_fanout is not None:
+            fingerprint = request_fingerprint({
+                "modelId": bedrock_converse_params.model_id,
+                "messages": bedrock_converse_params.messages,
+                "system": bedrock_converse_params.system_prompts,
+                "inferenceConfig": bedrock_converse_params.inference_config,
+                "additionalModelRequestFields": bedrock_converse_params.additional_model_fields,
+            })
+            model_events, replayed = response_fanout.subscribe(fingerprint, lambda: iterate_in_thread(open_stream))
+            if replayed and timer:
+                timer.count("fanout.replayed", 1)
+        else:
+            model_events = iterate_in_thread(open_stream)
+
+        async for event in model_events:
+            if 'contentBlockDelta' in event:
+                if timer:
+                    timer.token()
+                streamed_chars += len(event['contentBlockDelta']['delta']['text'])
+                yield content_event(event['contentBlockDelta']['delta']['text'])
 
-        stream = stream_response.get('stream')
-        if stream:
-            for event in stream:
-                if 'contentBlockDelta' in event:
-                    yield event['contentBlockDelta']['delta']['text']
-
-                if 'metadata' in event:
-                    metadata = event['metadata']
-                    if 'usage' in metadata:
-                        logger.info(f"Token usage: Input tokens: {metadata['usage']['inputTokens']}, "
-                                    f"Output tokens: {metadata['usage']['outputTokens']}, "
-                                    f"Total tokens: {metadata['usage']['totalTokens']}")
-                    if 'metrics' in metadata:
-                        logger.info(f"Latency: {metadata['metrics']['latencyMs']} milliseconds")
+            if 'messageStop' in event:
+                stop_reason = event['messageStop'].get('stopReason')
+
+            if 'metadata' in event:
+                metadata = event['metadata']
+                if 'usage' in metadata:
+                    prompt_cache = cache_usage(metadata['usage'])
+                    # The tokens of a replayed generation were counted by the request that started it
+                    if timer and not replayed:
+                        timer.count("model.input_tokens", metadata['usage']['inputTokens'])
+                        timer.count("model.output_tokens", metadata['usage']['outputTokens'])
+                        timer.count("model.cache_read_tokens", prompt_cache['cache_read_tokens'])
+                        timer.count("model.cache_write_tokens", prompt_cache['cache_write_tokens'])
+                    if admission_ticket:
+                        admission_ticket.settle(0 if replayed else metadata['usage']['totalTokens'])
+                    logger.info(f"Token usage: Input tokens: {metadata['usage']['inputTokens']}, "
+                                f"Output tokens: {metadata['usage']['outputTokens']}, "
+                                f"Total tokens: {metadata['usage']['totalTokens']}, "
+                                f"Cache read tokens: {prompt_cache['cache_read_tokens']}, "
+                                f"Cache write tokens: {prompt_cache['cache_write_tokens']}")
+                if 'metrics' in metadata:
+                    logger.info(f"Latency: {metadata['metrics']['latencyMs']} milliseconds")
+                if 'usage' in metadata:
+                    yield "usage", {
+                        "input_tokens": metadata['usage']['inputTokens'],
+                        "output_tokens": metadata['usage']['outputTokens'],
+                        **prompt_cache,
+                        "latency_ms": metadata.get('metrics', {}).get('latencyMs'),
+                        "replayed": replayed,
+                    }
+
+        yield "stop", {"stop_reason": stop_reason}
+        if timer:
+            timer.mark('total')
+            logger.info(f"Stage timings (ms): {timer.server_timing()}")
+            telemetry.emit(timer, "/bedrock_converse_api", model_id=bedrock_converse_params.model_id, outcome="ok")
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client went away: iterate_in_thread closed the Bedrock stream, or the shared generation goes on for
+        # the other requests reading it
+        logger.info(f"Client disconnected after {streamed_chars} characters, Bedrock stream closed")
+        if timer:
+            if not replayed:
+                count_disconnect(timer, streamed_chars,
+                                 (bedrock_converse_params.inference_config or {}).get('maxTokens'))
+            telemetry.emit(timer, "/bedrock_converse_api", model_id=bedrock_converse_params.model_id,
+                           outcome="client_disconnected")
+        raise
     except Exception as e:
         logger.error(f"Error in stream_bedrock_converse_api: {str(e)}")
-        yield str(e)
+        if timer:
+            telemetry.emit(timer, "/bedrock_converse_api", model_id=bedrock_converse_params.model_id, outcome="error",
+                           error_type=type(e).__name__)
+        yield error_event(e)
+    finally:
+        if admission_ticket:
+            admission_ticket.release()
+
+
+def admission_rejected_response(error: AdmissionRejected, stream_format: str) -> Response:
+    """Response to a request that was not admitted, with the status and Retry-After of the rejection."""
+    return Response(
+        encode_event(stream_format, error_event(error)),
+        status_code=error.status_code,
+        media_type=MEDIA_TYPES[stream_format],
+        headers={"Retry-After": str(error.retry_after)}
+    )
 
 
 @app.post("/bedrock_converse_api")
@@ -151,7 +414,29 @@ async def execute_chain_converse_api(
         assistant_parameters: AssistantParameters
 ):
     """Execute the flow with converse API."""
+    if not bedrock_converse_parameters.system_prompts and not assistant_parameters.system_prompt_id:
+        # The two parameters are in different models. Without either one the model would get an empty system block,
+        # which Bedrock rejects.
+        raise RequestValidationError([{
+            "type": "missing",
+            "loc": ("body", "bedrock_converse_parameters", "system_prompts"),
+            "msg": "Field required unless assistant_parameters.system_prompt_id is set",
+            "input": None
+        }])
+    timer = StageTimer(started=getattr(request.state, "received_at", None))
+    timer.mark("request_parse")
+    admission_ticket = None
+    # Set once the response's background task and stream release the ticket
+    ticket_handed_over = False
+    bedrock_warm_up = None
     try:
+        if REQUEST_PIPELINING:
+            # Open the Bedrock connection while the config lookup and the workflow are running
+            bedrock_warm_up = asyncio.ensure_future(timer.measure(
+                "bedrock_warm_up",
+                asyncio.to_thread(warm_up_connection, bedrock_boto_client)
+            ))
+
         request_access_token = json.loads(request.headers['x-access-token'])
         data_manager = AccountDataAccess(request_access_token)
 
@@ -161,23 +446,97 @@ async def execute_chain_converse_api(
             for message in bedrock_converse_parameters.messages
         ]
 
-        chain_data = sf_build_context(
-            claude_message_format,
-            bedrock_converse_parameters.system_prompts[0]["text"],
+        # Fit the workflow input and the model history to their token budgets. One manager per request, so every
+        # message is estimated once.
+        history_manager = HistoryManager()
+        with timer.stage("history_window"):
+            workflow_history = history_manager.window(claude_message_format, WORKFLOW_HISTORY_TOKEN_BUDGET)
+            model_history = history_manager.window(
+                bedrock_converse_parameters.messages,
+                assistant_parameters.history_token_budget or HISTORY_TOKEN_BUDGET
+            )
+        logger.info(f"History tokens saved: model {model_history.tokens_saved} "
+                    f"({model_history.dropped_messages} messages dropped, "
+                    f"{model_history.condensed_messages} condensed), workflow {workflow_history.tokens_saved}")
+
+        # Empty when the system prompt is referenced by assistant_parameters.system_prompt_id
+        system_prompts = bedrock_converse_parameters.system_prompts
+        system_text = system_prompts[0]["text"] if system_prompts else ""
+
+        if admission_controller is not None:
+            # The workflow and the model stream run in the slot. Estimated tokens: the history and system prompt
+            # sent to the model and its maximum output.
+            max_tokens = (bedrock_converse_parameters.inference_config or {}).get('maxTokens')
+            estimated_tokens = (model_history.tokens + history_manager.estimator.text_tokens(system_text)
+                                + (max_tokens or ADMISSION_DEFAULT_MAX_TOKENS))
+            with timer.stage("admission"):
+                admission_ticket = await admission_controller.admit(data_manager.account_id or DEFAULT_ACCOUNT,
+                                                                    estimated_tokens)
+            timer.count("admission.queue_depth", admission_ticket.queue_depth)
+
+        chain_data = await sf_build_context(
+            workflow_history.messages,
+            system_text,
             assistant_parameters,
-            data_manager
+            data_manager,
+            is_disconnected=request.is_disconnected,
+            timer=timer,
+            model_id=bedrock_converse_parameters.model_id
         )
 
-        bedrock_converse_parameters.system_prompts[0]["text"] = chain_data['system']
-        bedrock_converse_parameters.messages.extend(chain_data.get('additional_messages', []))
+        bedrock_converse_parameters.system_prompts[0:1] = chain_data['system_prompts']
+        bedrock_converse_parameters.messages = model_history.messages + chain_data.get('additional_messages', [])
 
-        return StreamingResponse(
-            stream_bedrock_converse_api(bedrock_converse_parameters),
-            media_type="text/plain; charset=utf-8"
+        if REQUEST_PIPELINING:
+            await bedrock_warm_up
+
+        stream_format = assistant_parameters.stream_format
+        response = StreamingResponse(
+            encode_stream(
+                stream_bedrock_converse_api(bedrock_converse_parameters, timer, chain_data['summary'],
+                                            admission_ticket),
+                stream_format,
+                is_disconnected=request.is_disconnected
+            ),
+            media_type=MEDIA_TYPES[stream_format],
+            headers={
+                "Server-Timing": timer.server_timing(),
+                "X-History-Tokens-Saved": str(model_history.tokens_saved),
+                "X-Workflow-History-Tokens-Saved": str(workflow_history.tokens_saved),
+            },
+            # Frees the slot also when the client leaves before the stream starts
+            background=BackgroundTask(admission_ticket.release) if admission_ticket else None
         )
+        ticket_handed_over = True
+        return response
+    except AdmissionRejected as e:
+        timer.count("admission.rejected", 1)
+        telemetry.emit(timer, "/bedrock_converse_api", model_id=bedrock_converse_parameters.model_id,
+                       outcome="rejected")
+        return admission_rejected_response(e, assistant_parameters.stream_format)
+    except ClientDisconnected as e:
+        logger.info(str(e))
+        telemetry.emit(timer, "/bedrock_converse_api", model_id=bedrock_converse_parameters.model_id,
+                       outcome="client_disconnected")
+        return Response(status_code=499)
     except Exception as e:
         logger.error(f"Error in execute_chain_converse_api: {str(e)}")
+        # Failures before the stream started, e.g. of the config lookup or the workflow
+        telemetry.emit(timer, "/bedrock_converse_api", model_id=bedrock_converse_parameters.model_id,
+                       outcome="error", error_type=type(e).__name__)
+        if assistant_parameters.stream_format != "text":
+            return Response(
+                encode_event(assistant_parameters.stream_format, error_event(e)),
+                media_type=MEDIA_TYPES[assistant_parameters.stream_format]
+            )
         return StreamingResponse(
             str(e),
             media_type="text/plain; charset=utf-8"
-        )
\ No newline at end of file
+        )
+    finally:
+        # Also on cancellation, or any error before the response took the ticket
+        if admission_ticket and not ticket_handed_over:
+            admission_ticket.release()
+        # The request ended before the model call, e.g. on an error or a disconnect
+        if bedrock_warm_up is not None and not bedrock_warm_up.done():
+            bedrock_warm_up.cancel()
\ No newline at end of file
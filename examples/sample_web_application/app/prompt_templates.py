@@ -0,0 +1,83 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from os import environ
+from typing import Dict, List, Optional
+
+# Parsed system prompts kept per container
+PROMPT_TEMPLATE_CACHE_SIZE = int(environ.get("PROMPT_TEMPLATE_CACHE_SIZE", "256"))
+
+# An empty tag pair, e.g. <chain-information></chain-information>, is a slot the workflow output can fill
+_SLOT = re.compile(r"<([^<>/\s]+)></\1>")
+
+
+class PromptTemplate:
+    """System prompt parsed into literal segments and named slots, rendered with a single join."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.content_hash = hashlib.sha256(text.encode()).hexdigest()
+        self.segments: List[str] = []
+        # Position in segments of every occurrence of each slot
+        self.slots: Dict[str, List[int]] = {}
+        position = 0
+        for match in _SLOT.finditer(text):
+            self.segments.append(text[position:match.start()])
+            self.slots.setdefault(match.group(1), []).append(len(self.segments))
+            self.segments.append(match.group(0))
+            position = match.end()
+        self.segments.append(text[position:])
+
+    def render(self, values: Optional[Dict[str, str]] = None) -> str:
+        """Prompt with the given slots filled with <slot>value</slot>. Other slots stay empty."""
+        if not values:
+            return self.text
+        segments = list(self.segments)
+        for slot, value in values.items():
+            for index in self.slots.get(slot, ()):
+                segments[index] = f"<{slot}>{value}</{slot}>"
+        return "".join(segments)
+
+
+class PromptTemplateRegistry:
+    """LRU cache of parsed templates keyed by the SHA-256 of the prompt text.
+
+    Templates referenced by prompt ID are loaded through the data manager, which caches the DynamoDB item; an updated
+    item has a new hash, so it is parsed again.
+    """
+
+    def __init__(self, max_templates: int = PROMPT_TEMPLATE_CACHE_SIZE):
+        self.max_templates = max_templates
+        self._templates: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def from_text(self, text: str) -> PromptTemplate:
+        content_hash = hashlib.sha256(text.encode()).hexdigest()
+        with self._lock:
+            template = self._templates.get(content_hash)
+            if template is not None:
+                self._templates.move_to_end(content_hash)
+                return template
+        template = PromptTemplate(text)
+        with self._lock:
+            self._templates[content_hash] = template
+            while len(self._templates) > self.max_templates:
+                self._templates.popitem(last=False)
+        return template
+
+    def from_prompt_item(self, data_manager, workflow_id: str, prompt_id: str) -> PromptTemplate:
+        """Template stored as the content of the workflow#prompt#<workflow_id>#<prompt_id> item."""
+        items = data_manager.get_workflow_prompt(workflow_id, prompt_id)
+        if not items or "content" not in items[0]:
+            raise ValueError(f"Prompt not found: workflow#prompt#{workflow_id}#{prompt_id}")
+        return self.from_text(items[0]["content"])
+
+    def __len__(self):
+        return len(self._templates)
+
+
+prompt_templates = PromptTemplateRegistry()
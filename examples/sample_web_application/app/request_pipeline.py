@@ -0,0 +1,128 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import time
+from contextlib import contextmanager
+from os import environ
+from typing import Awaitable, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+logger = logging.getLogger()
+
+# When enabled, the Bedrock connection is prepared while the config lookup and the workflow are running.
+# Set to "false" to run the stages strictly in sequence, e.g. to compare time-to-first-token.
+REQUEST_PIPELINING = environ.get("REQUEST_PIPELINING", "true").lower() == "true"
+
+
+class StageTimer:
+    """Collects the duration of each request stage in milliseconds, the arrival of output tokens and token counts."""
+
+    def __init__(self, started: Optional[float] = None):
+        # perf_counter() value of the request start, e.g. recorded by a middleware before the body is parsed
+        self.started = started or time.perf_counter()
+        self.started_at = time.time() - (time.perf_counter() - self.started)
+        self.stages: Dict[str, float] = {}
+        # Offset of each stage from the request start, in milliseconds
+        self.starts: Dict[str, float] = {}
+        self.token_times: List[float] = []
+        self.counters: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        self.starts[name] = (start - self.started) * 1000
+        try:
+            yield
+        finally:
+            self.stages[name] = (time.perf_counter() - start) * 1000
+
+    async def measure(self, name: str, awaitable: Awaitable[T]) -> T:
+        with self.stage(name):
+            return await awaitable
+
+    def mark(self, name: str) -> None:
+        """Record the time elapsed since the request started, e.g. time_to_first_token."""
+        self.starts[name] = 0.0
+        self.stages[name] = (time.perf_counter() - self.started) * 1000
+
+    def token(self) -> None:
+        """Record the arrival of an output chunk. The first one marks time_to_first_token."""
+        self.token_times.append(time.perf_counter())
+        if len(self.token_times) == 1:
+            self.mark("time_to_first_token")
+
+    def inter_token_gaps(self) -> List[float]:
+        times = self.token_times
+        return [(times[index] - times[index - 1]) * 1000 for index in range(1, len(times))]
+
+    def count(self, name: str, value: int) -> None:
+        self.counters[name] = self.counters.get(name, 0) + (value or 0)
+
+    def server_timing(self) -> str:
+        """Format the stages as a Server-Timing header value."""
+        return ", ".join(f"{name};dur={duration:.1f}" for name, duration in self.stages.items())
+
+
+class RequestStartMiddleware:
+    """ASGI middleware storing the arrival time of each request in request.state.received_at.
+
+    The difference with the start of the endpoint is the body parsing and validation time.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            scope.setdefault("state", {})["received_at"] = time.perf_counter()
+        await self.app(scope, receive, send)
+
+
+# warm_up_connection reaches into private botocore and urllib3 attributes, checked with botocore 1.34 to 1.43 and
+# urllib3 1.26 and 2.x: client._endpoint.http_session is botocore's URLLib3Session, whose _proxy_config and
+# _get_connection_manager() give the urllib3 pool of the endpoint, and the pool's pool, _get_conn and _put_conn hold
+# its idle connections. When one of them is missing, e.g. after a botocore upgrade, the warm-up turns itself off.
+_warm_up_supported = True
+
+
+def _connection_pool(client):
+    endpoint = client._endpoint
+    url = endpoint.host
+    http_session = endpoint.http_session
+    proxy_url = http_session._proxy_config.proxy_url_for(url)
+    pool = http_session._get_connection_manager(url, proxy_url).connection_from_url(url)
+    for name in ("pool", "_get_conn", "_put_conn"):
+        getattr(pool, name)
+    return pool
+
+
+def warm_up_connection(client) -> bool:
+    """Open a TLS connection to the client endpoint and park it in the botocore pool.
+
+    Does nothing when the pool already holds an idle connection. Any failure is logged and ignored: the real call
+    then opens its own connection as usual.
+    """
+    global _warm_up_supported
+    if not _warm_up_supported:
+        return False
+    try:
+        pool = _connection_pool(client)
+    except AttributeError as e:
+        _warm_up_supported = False
+        logger.warning(f"Connection warm-up disabled, the botocore internals it uses are missing: {str(e)}")
+        return False
+    except Exception as e:
+        logger.debug(f"Connection warm-up skipped: {str(e)}")
+        return False
+    try:
+        if any(connection is not None for connection in list(pool.pool.queue)):
+            return False
+        connection = pool._get_conn()
+        connection.connect()
+        pool._put_conn(connection)
+        return True
+    except Exception as e:
+        logger.debug(f"Connection warm-up skipped: {str(e)}")
+        return False
@@ -0,0 +1,212 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from os import environ
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger()
+
+# Identical model requests (same model, system prompt, messages and inference parameters) running at the same time,
+# or within FANOUT_TTL_SECONDS of each other, share one Bedrock generation: the first request records the response
+# stream events in a replay buffer and every request reads them from there at its own pace.
+FANOUT_ENABLED = environ.get("FANOUT_ENABLED", "false").lower() == "true"
+FANOUT_TTL_SECONDS = float(environ.get("FANOUT_TTL_SECONDS", "30"))
+FANOUT_MAX_BUFFERS = int(environ.get("FANOUT_MAX_BUFFERS", "64"))
+# Memory of one buffer. A longer generation still reaches the requests reading it, but the buffer stops taking new
+# readers and drops the events all of them have read; a reader that falls further behind is cut off.
+FANOUT_MAX_BUFFER_BYTES = int(environ.get("FANOUT_MAX_BUFFER_BYTES", str(1024 * 1024)))
+
+
+class FanoutLagError(Exception):
+    """The reader fell more than the buffer size behind the shared generation."""
+
+
+class FanoutAbandoned(Exception):
+    """Every reader left before the generation ended, so it was stopped."""
+
+
+def request_fingerprint(model_request: Dict[str, Any]) -> str:
+    """Hash of everything sent to the model."""
+    payload = json.dumps(model_request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def event_size(event: Any) -> int:
+    """Approximate memory of a response stream event: its JSON length."""
+    return len(json.dumps(event, separators=(",", ":"), default=str))
+
+
+class ReplayBuffer:
+    """Events of one generation, read by any number of readers at their own pace."""
+
+    def __init__(self, max_bytes: int = FANOUT_MAX_BUFFER_BYTES):
+        self.max_bytes = max_bytes
+        self.events: List[Any] = []
+        self.sizes: List[int] = []
+        self.offset = 0  # stream index of events[0]
+        self.bytes = 0
+        self.overflowed = False
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.completed_at: Optional[float] = None
+        self.producer: Optional[asyncio.Future] = None
+        self.stopping = False
+        self._cursors: Dict[int, int] = {}
+        self._next_reader = 0
+        self._appended: Optional[asyncio.Future] = None
+
+    @property
+    def length(self) -> int:
+        return self.offset + len(self.events)
+
+    def append(self, event: Any, size: int) -> None:
+        self.events.append(event)
+        self.sizes.append(size)
+        self.bytes += size
+        if self.bytes > self.max_bytes:
+            self.overflowed = True
+            self._trim()
+        self._notify()
+
+    def finish(self, error: Optional[Exception] = None) -> None:
+        self.done = True
+        self.error = error
+        self.completed_at = time.monotonic()
+        self._notify()
+
+    def add_reader(self) -> int:
+        """Register a reader starting at the first event. Only possible before the buffer overflows."""
+        reader = self._next_reader
+        self._next_reader += 1
+        self._cursors[reader] = self.offset
+        return reader
+
+    async def read(self, reader: int) -> AsyncIterator[Any]:
+        try:
+            while True:
+                cursor = self._cursors.get(reader)
+                if cursor is None:
+                    raise FanoutLagError(f"Reader fell more than {self.max_bytes} bytes behind the generation")
+                if cursor < self.length:
+                    self._cursors[reader] = cursor + 1
+                    yield self.events[cursor - self.offset]
+                elif self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                else:
+                    if self._appended is None:
+                        self._appended = asyncio.get_running_loop().create_future()
+                    # Shielded: a cancelled reader must not cancel the future the other readers wait on
+                    await asyncio.shield(self._appended)
+        finally:
+            self._cursors.pop(reader, None)
+            if not self._cursors and not self.done and self.producer is not None:
+                self.stopping = True
+                self.producer.cancel()
+
+    def _notify(self) -> None:
+        if self._appended is not None and not self._appended.done():
+            self._appended.set_result(None)
+        self._appended = None
+
+    def _trim(self) -> None:
+        # Drop the events every reader has read, then cut off the slowest readers until the buffer fits
+        while True:
+            oldest = min(self._cursors.values(), default=self.length)
+            read_by_all = oldest - self.offset
+            if read_by_all > 0:
+                self.bytes -= sum(self.sizes[:read_by_all])
+                del self.events[:read_by_all]
+                del self.sizes[:read_by_all]
+                self.offset = oldest
+            if self.bytes <= self.max_bytes or not self._cursors:
+                return
+            for reader, cursor in list(self._cursors.items()):
+                if cursor == oldest:
+                    del self._cursors[reader]
+
+
+class ResponseFanout:
+    """Replay buffers by request fingerprint, bounded in number (LRU) and kept FANOUT_TTL_SECONDS after the end."""
+
+    def __init__(
+            self,
+            ttl: float = FANOUT_TTL_SECONDS,
+            max_buffers: int = FANOUT_MAX_BUFFERS,
+            max_buffer_bytes: int = FANOUT_MAX_BUFFER_BYTES
+    ):
+        self.ttl = ttl
+        self.max_buffers = max_buffers
+        self.max_buffer_bytes = max_buffer_bytes
+        self._buffers: "OrderedDict[str, ReplayBuffer]" = OrderedDict()
+        self.generations = 0
+        self.replays = 0
+        self.evictions = 0
+
+    def subscribe(self, key: str, open_events: Callable[[], AsyncIterator[Any]]) -> Tuple[AsyncIterator[Any], bool]:
+        """Events of the generation for key, started with open_events unless one is running or recent.
+
+        Returns the events and whether they are replayed from the generation of another request.
+        """
+        for stale_key, stale_buffer in list(self._buffers.items()):
+            if self._expired(stale_buffer):
+                self._discard(stale_key, stale_buffer)
+
+        buffer = self._replayable(key)
+        if buffer is not None:
+            self.replays += 1
+            return buffer.read(buffer.add_reader()), True
+
+        buffer = ReplayBuffer(self.max_buffer_bytes)
+        reader = buffer.add_reader()
+        buffer.producer = asyncio.ensure_future(self._produce(key, buffer, open_events))
+        self._buffers[key] = buffer
+        self.generations += 1
+        while len(self._buffers) > self.max_buffers:
+            self._buffers.popitem(last=False)
+            self.evictions += 1
+        return buffer.read(reader), False
+
+    def stats(self) -> Dict[str, int]:
+        return {"generations": self.generations, "replays": self.replays, "evictions": self.evictions,
+                "buffers": len(self._buffers), "bytes": sum(buffer.bytes for buffer in self._buffers.values())}
+
+    def _replayable(self, key: str) -> Optional[ReplayBuffer]:
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            return None
+        if buffer.error is not None or buffer.overflowed or buffer.stopping:
+            self._discard(key, buffer)
+            return None
+        self._buffers.move_to_end(key)
+        return buffer
+
+    def _expired(self, buffer: ReplayBuffer) -> bool:
+        return buffer.done and time.monotonic() - buffer.completed_at > self.ttl
+
+    def _discard(self, key: str, buffer: ReplayBuffer) -> None:
+        if self._buffers.get(key) is buffer:
+            del self._buffers[key]
+
+    async def _produce(self, key: str, buffer: ReplayBuffer, open_events: Callable[[], AsyncIterator[Any]]) -> None:
+        try:
+            async for event in open_events():
+                buffer.append(event, event_size(event))
+        except asyncio.CancelledError:
+            # Cancelled by the last reader leaving; the source closes the Bedrock stream
+            self._discard(key, buffer)
+            buffer.finish(FanoutAbandoned("Generation stopped, no request was reading it"))
+            raise
+        except Exception as e:
+            logger.warning(f"Shared generation failed: {str(e)}")
+            self._discard(key, buffer)
+            buffer.finish(e)
+        else:
+            buffer.finish()
@@ -0,0 +1,171 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import asyncio
+import json
+from os import environ
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from workflow_executor import DISCONNECT_POLL_SECONDS
+
+# Response body formats of the streaming endpoints, chosen per request. "text" is the answer text only, with errors
+# written as text. "sse" (Server-Sent Events) and "ndjson" (one JSON object per line) carry typed events:
+#   content  {"text"}                                        answer text, micro-batched
+#   context  {...}                                           summary of the workflow output the answer is based on
+#   usage    {"input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens", "latency_ms",
+#             "replayed"}                                    replayed: generation shared with another request
+#   stop     {"stop_reason"}                                 last event of a complete answer
+#   error    {"error_type", "message", "error_code"?}        last event of a failed answer
+STREAM_FORMATS = ("text", "sse", "ndjson")
+MEDIA_TYPES = {
+    "text": "text/plain; charset=utf-8",
+    "sse": "text/event-stream; charset=utf-8",
+    "ndjson": "application/x-ndjson; charset=utf-8",
+}
+
+# Consecutive content events are merged into one write until the batch holds STREAM_BATCH_MAX_CHARS characters or its
+# first text is STREAM_BATCH_MAX_LATENCY_MS old. 0 sends every delta as it comes.
+STREAM_BATCH_MAX_CHARS = int(environ.get("STREAM_BATCH_MAX_CHARS", "256"))
+STREAM_BATCH_MAX_LATENCY_MS = float(environ.get("STREAM_BATCH_MAX_LATENCY_MS", "50"))
+
+StreamEvent = Tuple[str, Dict[str, Any]]
+_END_OF_EVENTS = object()
+
+
+def content_event(text: str) -> StreamEvent:
+    return "content", {"text": text}
+
+
+def error_event(error: Exception) -> StreamEvent:
+    data = {"error_type": type(error).__name__, "message": str(error)}
+    # botocore ClientError carries the service error code, e.g. ThrottlingException
+    response = getattr(error, "response", None)
+    if isinstance(response, dict) and "Error" in response:
+        data["error_code"] = response["Error"].get("Code")
+    return "error", data
+
+
+def encode_event(stream_format: str, event: StreamEvent) -> str:
+    event_type, data = event
+    if stream_format == "sse":
+        return f"event: {event_type}\ndata: {json.dumps(data, separators=(',', ':'), default=str)}\n\n"
+    if stream_format == "ndjson":
+        return json.dumps({"type": event_type, **data}, separators=(",", ":"), default=str) + "\n"
+    # text keeps the answer and the error message, the other events are dropped
+    if event_type == "content":
+        return data["text"]
+    if event_type == "error":
+        return data["message"]
+    return ""
+
+
+async def batch_content(
+        events: AsyncIterator[StreamEvent],
+        max_chars: int = STREAM_BATCH_MAX_CHARS,
+        max_latency_ms: float = STREAM_BATCH_MAX_LATENCY_MS
+) -> AsyncIterator[StreamEvent]:
+    """Merge consecutive content events. A batch is sent when it is full, when another event type comes, or
+    max_latency_ms after its first text even if the model is slow to send the next one."""
+    if max_chars <= 1 or max_latency_ms <= 0:
+        async for event in events:
+            yield event
+        return
+
+    # The source is read by a task so the max latency flush does not depend on the next event
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+
+    async def read_events():
+        try:
+            async for event in events:
+                await queue.put((event, None))
+        except Exception as e:
+            await queue.put((_END_OF_EVENTS, e))
+        else:
+            await queue.put((_END_OF_EVENTS, None))
+        finally:
+            await events.aclose()
+
+    reader = asyncio.ensure_future(read_events())
+    batch, batch_chars, deadline = [], 0, None
+    try:
+        while True:
+            try:
+                timeout = None if deadline is None else max(0.0, deadline - loop.time())
+                event, error = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                event, error = None, None
+
+            if event is not None and event is not _END_OF_EVENTS and event[0] == "content":
+                batch.append(event[1]["text"])
+                batch_chars += len(event[1]["text"])
+                if deadline is None:
+                    deadline = loop.time() + max_latency_ms / 1000
+                if batch_chars < max_chars:
+                    continue
+
+            if batch:
+                yield content_event("".join(batch))
+                batch, batch_chars, deadline = [], 0, None
+            if event is _END_OF_EVENTS:
+                if error is not None:
+                    raise error
+                break
+            if event is not None and event[0] != "content":
+                yield event
+    finally:
+        # Stops the source, and the Bedrock stream behind it, when the response is closed early
+        reader.cancel()
+
+
+async def until_disconnected(
+        events: AsyncIterator[StreamEvent],
+        is_disconnected: Callable[[], Awaitable[bool]],
+        poll_interval: float = DISCONNECT_POLL_SECONDS
+) -> AsyncIterator[StreamEvent]:
+    """Pass the events through until the client goes away, even while waiting for the model.
+
+    The pending read is cancelled, so the source sees CancelledError and stops the Bedrock stream.
+    """
+    async def wait_disconnect():
+        while not await is_disconnected():
+            await asyncio.sleep(poll_interval)
+
+    watcher = asyncio.ensure_future(wait_disconnect())
+    next_event = None
+    try:
+        while True:
+            next_event = asyncio.ensure_future(events.__anext__())
+            await asyncio.wait([next_event, watcher], return_when=asyncio.FIRST_COMPLETED)
+            if not next_event.done():
+                next_event.cancel()
+                await asyncio.gather(next_event, return_exceptions=True)
+                return
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                return
+            yield event
+    finally:
+        watcher.cancel()
+        if next_event is not None and not next_event.done():
+            # The response itself was cancelled while waiting for an event
+            next_event.cancel()
+        else:
+            await events.aclose()
+
+
+async def encode_stream(
+        events: AsyncIterator[StreamEvent],
+        stream_format: str,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+) -> AsyncIterator[str]:
+    """Response body of the events in the requested format, stopped early if the client disconnects."""
+    if is_disconnected is not None:
+        events = until_disconnected(events, is_disconnected)
+    if stream_format != "text":
+        events = batch_content(events)
+    async for event in events:
+        body = encode_event(stream_format, event)
+        if body:
+            yield body
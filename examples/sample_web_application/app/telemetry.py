@@ -0,0 +1,157 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import logging
+import math
+import sys
+from os import environ
+from typing import Any, Dict, List, Optional
+
+from history_manager import HISTORY_CHARS_PER_TOKEN
+from request_pipeline import StageTimer
+
+logger = logging.getLogger()
+
+# Comma separated sinks for the per-request record: "emf" (CloudWatch Embedded Metric Format on stdout),
+# "otel" (OpenTelemetry spans, needs the opentelemetry-api package and a configured SDK) or "none"
+TELEMETRY_SINKS = environ.get("TELEMETRY_SINKS", "emf")
+TELEMETRY_NAMESPACE = environ.get("TELEMETRY_NAMESPACE", "ServerlessGenAIAssistant")
+
+
+def percentile(values: List[float], ratio: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(ratio * len(ordered)))]
+
+
+def request_record(timer: StageTimer, endpoint: str, **properties: Any) -> Dict[str, Any]:
+    """Summary of a finished request: stage durations, output token gaps and token counts."""
+    gaps = timer.inter_token_gaps()
+    if gaps:
+        gap_metrics = {
+            "inter_token_gap_p50": percentile(gaps, 0.5),
+            "inter_token_gap_p99": percentile(gaps, 0.99),
+            "inter_token_gap_max": max(gaps),
+        }
+    else:
+        gap_metrics = {}
+    stream_time = {}
+    if timer.token_times:
+        stream_time["stream"] = (timer.token_times[-1] - timer.token_times[0]) * 1000
+    return {
+        "endpoint": endpoint,
+        "started_at": timer.started_at,
+        "stages": dict(timer.stages),
+        "starts": dict(timer.starts),
+        "timings": {**gap_metrics, **stream_time},
+        "output_chunks": len(timer.token_times),
+        "counters": dict(timer.counters),
+        "properties": properties,
+    }
+
+
+def count_disconnect(timer: StageTimer, streamed_chars: int, max_tokens: Optional[int] = None) -> None:
+    """Counters of an answer stopped because the client went away. The tokens saved are an upper bound, the model
+    could have ended the answer before max_tokens."""
+    streamed_tokens = math.ceil(streamed_chars / HISTORY_CHARS_PER_TOKEN)
+    timer.count("disconnect.streams_closed", 1)
+    timer.count("disconnect.output_tokens_streamed", streamed_tokens)
+    if max_tokens:
+        timer.count("disconnect.output_tokens_saved", max(0, max_tokens - streamed_tokens))
+
+
+class InMemorySink:
+    """Keeps the records, for tests and benchmarks."""
+
+    def __init__(self):
+        self.records: List[Dict[str, Any]] = []
+
+    def emit(self, record: Dict[str, Any]) -> None:
+        self.records.append(record)
+
+
+class EMFSink:
+    """Writes each record as one CloudWatch Embedded Metric Format line. Lambda ships stdout to CloudWatch Logs."""
+
+    def __init__(self, namespace: str = TELEMETRY_NAMESPACE, stream=None):
+        self.namespace = namespace
+        self.stream = stream or sys.stdout
+
+    def format(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        millisecond_metrics = {**record["stages"], **record["timings"]}
+        count_metrics = {**record["counters"], "output_chunks": record["output_chunks"]}
+        metrics = [{"Name": name, "Unit": "Milliseconds"} for name in millisecond_metrics]
+        metrics += [{"Name": name, "Unit": "Count"} for name in count_metrics]
+        return {
+            "_aws": {
+                "Timestamp": int(record["started_at"] * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [["Endpoint"]],
+                    "Metrics": metrics,
+                }],
+            },
+            "Endpoint": record["endpoint"],
+            **record["properties"],
+            **{name: round(value, 3) for name, value in millisecond_metrics.items()},
+            **count_metrics,
+        }
+
+    def emit(self, record: Dict[str, Any]) -> None:
+        self.stream.write(json.dumps(self.format(record), separators=(",", ":"), default=str) + "\n")
+        self.stream.flush()
+
+
+class OpenTelemetrySink:
+    """Turns each record into a request span with one child span per stage, on the global tracer provider."""
+
+    def __init__(self, tracer=None):
+        from opentelemetry import trace
+
+        self.tracer = tracer or trace.get_tracer(TELEMETRY_NAMESPACE)
+        self._set_span_in_context = trace.set_span_in_context
+
+    def emit(self, record: Dict[str, Any]) -> None:
+        started_ns = int(record["started_at"] * 1e9)
+        ended_ns = started_ns + int(max(
+            [record["starts"][name] + duration for name, duration in record["stages"].items()] or [0]
+        ) * 1e6)
+        attributes = {f"counter.{name}": value for name, value in record["counters"].items()}
+        attributes.update({f"timing.{name}": value for name, value in record["timings"].items()})
+        attributes.update({key: str(value) for key, value in record["properties"].items()})
+        root = self.tracer.start_span(record["endpoint"], start_time=started_ns, attributes=attributes)
+        context = self._set_span_in_context(root)
+        for name, duration in record["stages"].items():
+            start_ns = started_ns + int(record["starts"].get(name, 0) * 1e6)
+            span = self.tracer.start_span(name, context=context, start_time=start_ns)
+            span.end(end_time=start_ns + int(duration * 1e6))
+        root.end(end_time=ended_ns)
+
+
+class Telemetry:
+    """Sends request records to the configured sinks. A failing sink never fails the request."""
+
+    def __init__(self, sinks: Optional[List] = None):
+        self.sinks = sinks or []
+
+    def emit(self, timer: StageTimer, endpoint: str, **properties: Any) -> None:
+        if not self.sinks:
+            return
+        record = request_record(timer, endpoint, **properties)
+        for sink in self.sinks:
+            try:
+                sink.emit(record)
+            except Exception as e:
+                logger.warning(f"Telemetry sink {type(sink).__name__} failed: {str(e)}")
+
+
+def create_telemetry(sink_names: str = TELEMETRY_SINKS) -> Telemetry:
+    sinks = []
+    for name in (name.strip() for name in sink_names.split(",")):
+        if name == "emf":
+            sinks.append(EMFSink())
+        elif name == "otel":
+            sinks.append(OpenTelemetrySink())
+        elif name not in ("", "none"):
+            raise ValueError(f"Unsupported TELEMETRY_SINKS entry: {name}")
+    return Telemetry(sinks)
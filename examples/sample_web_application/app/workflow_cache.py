@@ -0,0 +1,237 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from os import environ
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger()
+
+# "none" disables the cache, "memory" keeps results in the container, "dynamodb" adds a shared DynamoDB tier
+# behind the in-process one. The DynamoDB table needs a string partition key "cache_key" and TTL on "expires_at".
+WORKFLOW_CACHE_BACKEND = environ.get("WORKFLOW_CACHE_BACKEND", "none")
+WORKFLOW_CACHE_TABLE = environ.get("WORKFLOW_CACHE_TABLE", "")
+WORKFLOW_CACHE_TTL_SECONDS = float(environ.get("WORKFLOW_CACHE_TTL_SECONDS", "300"))
+WORKFLOW_CACHE_MAX_ENTRIES = int(environ.get("WORKFLOW_CACHE_MAX_ENTRIES", "1000"))
+WORKFLOW_CACHE_MAX_BYTES = int(environ.get("WORKFLOW_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# DynamoDB items are limited to 400 KB
+DYNAMODB_MAX_VALUE_BYTES = 350 * 1024
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    """Case-fold and collapse whitespace of a question so near-identical questions share a key."""
+    return _WHITESPACE.sub(" ", text).strip().casefold()
+
+
+def _normalize_content(content: Any) -> Any:
+    if isinstance(content, str):
+        return normalize(content)
+    if isinstance(content, list):
+        return [
+            {**block, "text": normalize(block["text"])}
+            if isinstance(block, dict) and isinstance(block.get("text"), str) else block
+            for block in content
+        ]
+    return content
+
+
+def normalize_messages(messages: Any) -> Any:
+    """The messages with their text normalized. Roles and any other values are kept exact."""
+    if not isinstance(messages, list):
+        return messages
+    return [
+        {**message, "content": _normalize_content(message["content"])}
+        if isinstance(message, dict) and "content" in message else message
+        for message in messages
+    ]
+
+
+def workflow_cache_key(state_machine_arn: str, input_data: Dict[str, Any]) -> str:
+    """Hash of the workflow ARN, the sampled messages and the custom params.
+
+    Only the text of the messages is normalized: custom params (IDs, filters, S3 keys) are often case sensitive.
+    """
+    if "PromptInput" in input_data:
+        input_data = {**input_data, "PromptInput": normalize_messages(input_data["PromptInput"])}
+    payload = json.dumps(
+        {"arn": state_machine_arn, "input": input_data},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class MemoryCacheBackend:
+    """In-process TTL cache bounded by entry count and total value size, evicting the least recently used."""
+
+    blocking = False
+
+    def __init__(
+            self,
+            max_entries: int = WORKFLOW_CACHE_MAX_ENTRIES,
+            max_bytes: int = WORKFLOW_CACHE_MAX_BYTES
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str, ttl: float, expires_at: Optional[float] = None) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at or time.time() + ttl, value)
+            self.size_bytes += len(value)
+            while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        _, value = self._entries.pop(key)
+        self.size_bytes -= len(value)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DynamoDBCacheBackend:
+    """Cache shared by every container, stored in a DynamoDB table with TTL enabled on expires_at."""
+
+    blocking = True
+
+    def __init__(self, table_name: str = WORKFLOW_CACHE_TABLE, dynamodb_client=None):
+        self.table_name = table_name
+        if dynamodb_client is None:
+            from clients import get_client
+            dynamodb_client = get_client("dynamodb")
+        self.dynamodb_client = dynamodb_client
+
+    def get_entry(self, key: str) -> Optional[Tuple[str, float]]:
+        """Return the cached value with its expiry timestamp."""
+        item = self.dynamodb_client.get_item(
+            TableName=self.table_name,
+            Key={"cache_key": {"S": key}}
+        ).get("Item")
+        # TTL deletion is lazy, so expired items can still be returned by DynamoDB
+        if not item or float(item["expires_at"]["N"]) <= time.time():
+            return None
+        return item["value"]["S"], float(item["expires_at"]["N"])
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.get_entry(key)
+        return entry[0] if entry else None
+
+    def put(self, key: str, value: str, ttl: float, expires_at: Optional[float] = None) -> None:
+        if len(value.encode()) > DYNAMODB_MAX_VALUE_BYTES:
+            return
+        self.dynamodb_client.put_item(
+            TableName=self.table_name,
+            Item={
+                "cache_key": {"S": key},
+                "value": {"S": value},
+                "expires_at": {"N": str(int(expires_at or time.time() + ttl))}
+            }
+        )
+
+
+class TieredCacheBackend:
+    """In-process tier in front of a shared tier. Shared hits are copied to the local tier."""
+
+    blocking = True
+
+    def __init__(self, local: MemoryCacheBackend, shared: DynamoDBCacheBackend):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.local.get(key)
+        if value is None:
+            entry = self.shared.get_entry(key)
+            if entry is not None:
+                value, expires_at = entry
+                # The local copy must not outlive the shared entry
+                self.local.put(key, value, ttl=0, expires_at=expires_at)
+        return value
+
+    def put(self, key: str, value: str, ttl: float, expires_at: Optional[float] = None) -> None:
+        expires_at = expires_at or time.time() + ttl
+        self.local.put(key, value, ttl, expires_at)
+        self.shared.put(key, value, ttl, expires_at)
+
+
+class WorkflowCache:
+    """Caches the raw output of workflow executions, keyed by workflow_cache_key."""
+
+    def __init__(self, backend=None, ttl: float = WORKFLOW_CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None and self.ttl > 0
+
+    async def get(self, key: str) -> Optional[str]:
+        try:
+            value = await self._call(self.backend.get, key)
+        except Exception as e:
+            # A failing cache tier must not fail the request: run the workflow instead
+            logger.warning(f"Workflow cache read failed: {str(e)}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def put(self, key: str, value: str) -> None:
+        try:
+            await self._call(self.backend.put, key, value, self.ttl)
+        except Exception as e:
+            logger.warning(f"Workflow cache write failed: {str(e)}")
+
+    async def _call(self, method, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def create_workflow_cache(backend_name: str = WORKFLOW_CACHE_BACKEND) -> WorkflowCache:
+    if backend_name == "none":
+        return WorkflowCache(backend=None)
+    if backend_name == "memory":
+        return WorkflowCache(backend=MemoryCacheBackend())
+    if backend_name == "dynamodb":
+        if not WORKFLOW_CACHE_TABLE:
+            raise ValueError("WORKFLOW_CACHE_TABLE is required by the dynamodb workflow cache backend")
+        return WorkflowCache(backend=TieredCacheBackend(MemoryCacheBackend(), DynamoDBCacheBackend()))
+    raise ValueError(f"Unsupported WORKFLOW_CACHE_BACKEND: {backend_name}")
@@ -0,0 +1,147 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from os import environ
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# Maximum number of Step Functions sync executions awaited at the same time by one process
+WORKFLOW_MAX_CONCURRENCY = int(environ.get("WORKFLOW_MAX_CONCURRENCY", "64"))
+
+# Time budget for a workflow execution, including the wait for a free execution slot
+WORKFLOW_TIMEOUT_SECONDS = float(environ.get("WORKFLOW_TIMEOUT_SECONDS", "30"))
+
+# How often the client connection is checked while a workflow is running
+DISCONNECT_POLL_SECONDS = float(environ.get("DISCONNECT_POLL_SECONDS", "0.25"))
+
+# Concurrent calls with the same coalescing key (workflow ARN and normalized input) wait for one execution
+WORKFLOW_COALESCING = environ.get("WORKFLOW_COALESCING", "true").lower() == "true"
+
+
+class ClientDisconnected(Exception):
+    """The caller went away before the workflow result was available."""
+
+
+class _Flight:
+    """An execution shared by the calls with the same coalescing key."""
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class WorkflowExecutor:
+    """Awaits blocking start_sync_execution calls in a thread pool with a concurrency limit and a timeout.
+
+    Express workflows can't be stopped through the API, so timeouts and disconnects stop waiting for the
+    execution and release its slot; the boto3 call finishes in the background, bounded by the client read timeout.
+
+    Calls with the same coalescing key share one execution (single-flight). Timeouts and disconnects stay per
+    call; the shared execution is only abandoned when no call waits for it anymore.
+
+    sf_client can also be an in-process workflow engine (inline_workflow.InlineWorkflow) whose start_sync_execution
+    is a coroutine. It is awaited on the event loop, with the same limits.
+    """
+
+    def __init__(
+            self,
+            max_concurrency: int = WORKFLOW_MAX_CONCURRENCY,
+            timeout: float = WORKFLOW_TIMEOUT_SECONDS,
+            disconnect_poll_interval: float = DISCONNECT_POLL_SECONDS
+    ):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.disconnect_poll_interval = disconnect_poll_interval
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._thread_pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="workflow")
+        self._flights: Dict[str, _Flight] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def start_sync_execution(
+            self,
+            sf_client,
+            state_machine_arn: str,
+            input_data: Dict[str, Any],
+            is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+            coalescing_key: Optional[str] = None,
+            on_coalesced: Optional[Callable[[int], None]] = None
+    ) -> Dict[str, Any]:
+        """Run the express workflow and return the raw start_sync_execution response.
+
+        With a coalescing_key, joins the execution already running for the key if any, and calls on_coalesced with
+        the number of calls now waiting for it.
+        """
+        if coalescing_key is None:
+            execution = asyncio.ensure_future(self._execute(sf_client, state_machine_arn, input_data))
+        else:
+            execution = self._join(coalescing_key, sf_client, state_machine_arn, input_data, on_coalesced)
+        watcher = asyncio.ensure_future(self._wait_disconnect(is_disconnected)) if is_disconnected else None
+        try:
+            done, _ = await asyncio.wait(
+                [task for task in (execution, watcher) if task],
+                timeout=self.timeout,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if execution in done:
+                return execution.result()
+            if watcher in done:
+                raise ClientDisconnected(f"Client disconnected while running workflow: {state_machine_arn}")
+            raise TimeoutError(f"Workflow {state_machine_arn} did not complete in {self.timeout} seconds")
+        finally:
+            for task in (execution, watcher):
+                if task and not task.done():
+                    task.cancel()
+
+    def _join(self, key: str, sf_client, state_machine_arn: str, input_data: Dict[str, Any],
+              on_coalesced: Optional[Callable[[int], None]]) -> asyncio.Future:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight(
+                asyncio.ensure_future(self._execute(sf_client, state_machine_arn, input_data))
+            )
+            flight.task.add_done_callback(lambda _: self._land(key, flight))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+            if on_coalesced:
+                on_coalesced(flight.waiters + 1)
+        flight.waiters += 1
+
+        async def wait():
+            try:
+                # Shielded: a call giving up must not cancel the execution the other calls wait for
+                return await asyncio.shield(flight.task)
+            finally:
+                flight.waiters -= 1
+                if flight.waiters == 0 and not flight.task.done():
+                    # Later calls with the key start a new execution instead of joining a cancelled one
+                    self._land(key, flight)
+                    flight.task.cancel()
+
+        return asyncio.ensure_future(wait())
+
+    def _land(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {"executions": self.executions, "coalesced": self.coalesced, "in_flight": len(self._flights)}
+
+    async def _execute(self, sf_client, state_machine_arn: str, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        async with self._semaphore:
+            if asyncio.iscoroutinefunction(sf_client.start_sync_execution):
+                return await sf_client.start_sync_execution(
+                    stateMachineArn=state_machine_arn, input=json.dumps(input_data)
+                )
+            return await asyncio.get_running_loop().run_in_executor(
+                self._thread_pool,
+                partial(sf_client.start_sync_execution, stateMachineArn=state_machine_arn, input=json.dumps(input_data))
+            )
+
+    async def _wait_disconnect(self, is_disconnected: Callable[[], Awaitable[bool]]) -> None:
+        while not await is_disconnected():
+            await asyncio.sleep(self.disconnect_poll_interval)
@@ -1,17 +1,25 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+from concurrent.futures import ThreadPoolExecutor
 from random import random
 
+import argparse
 import boto3
 import botocore.exceptions
 import json
+import threading
+import time
 import uuid
 from botocore.config import Config
 
 # This script is used to set up the initial data
 # 1 - Populates the DynamoDB table with the initial data.
 # 2 - Create a Cognito user to app auth
+#
+# It can also bulk import items from a JSONL file, e.g. to provision tenants for load tests:
+#   python assistant_config.py --import-jsonl items.jsonl --workers 8 [--endpoint-url http://localhost:8000]
+# Each line is an item in DynamoDB JSON ({"id": {"S": "account#1"}, ...}) or a DynamoDB export line ({"Item": {...}}).
 
 # configuration data
 # AWS profile name and region
@@ -96,19 +104,110 @@ table_items = [
 ]
 
 
-def populate_table():
-    print("Populating table with initial data")
+# BatchWriteItem accepts up to 25 put requests per call
+BATCH_WRITE_MAX_ITEMS = 25
+BATCH_WRITE_MAX_ATTEMPTS = 8
+BATCH_WRITE_BASE_DELAY_SECONDS = 0.05
+
+
+def dynamodb_client(workers=1, endpoint_url=None):
+    # One pooled connection per worker thread. endpoint_url points the import to DynamoDB Local or another stand-in
     try:
-        dynamodb = boto3.Session(profile_name=profile_name, region_name=region_name).client('dynamodb')
+        return boto3.Session(profile_name=profile_name, region_name=region_name).client(
+            'dynamodb',
+            endpoint_url=endpoint_url,
+            config=Config(max_pool_connections=max(workers, 10), retries={"mode": "adaptive"})
+        )
     except botocore.exceptions.ClientError as e:
         raise e
 
-    for item in table_items:
-        try:
-            response = dynamodb.put_item(TableName=table_name, Item=item)
-            print("Item added successfully" + str(item['id']) + "|" + str(item['item_type']))
-        except Exception as e:
-            raise e
+
+def read_jsonl_items(path):
+    with open(path) as jsonl_file:
+        for line_number, line in enumerate(jsonl_file, start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON: {e}")
+            yield item.get("Item", item)
+
+
+def item_key(item):
+    # Primary key of the config table
+    return item["id"]["S"], item["item_type"]["S"]
+
+
+def chunk_items(items, size=BATCH_WRITE_MAX_ITEMS):
+    """Chunks of up to `size` items with distinct keys, the last item of a key wins.
+
+    BatchWriteItem rejects a request that writes the same key twice with a ValidationException.
+    """
+    chunk = {}
+    for item in items:
+        key = item_key(item)
+        chunk.pop(key, None)
+        chunk[key] = item
+        if len(chunk) == size:
+            yield list(chunk.values())
+            chunk = {}
+    if chunk:
+        yield list(chunk.values())
+
+
+def batch_write_chunk(dynamodb, chunk):
+    """Write up to 25 items, retrying unprocessed items with exponential backoff and jitter."""
+    request_items = {table_name: [{"PutRequest": {"Item": item}} for item in chunk]}
+    for attempt in range(BATCH_WRITE_MAX_ATTEMPTS):
+        response = dynamodb.batch_write_item(RequestItems=request_items)
+        request_items = response.get("UnprocessedItems")
+        if not request_items:
+            return len(chunk)
+        time.sleep(BATCH_WRITE_BASE_DELAY_SECONDS * 2 ** attempt * (0.5 + random()))
+    unprocessed = len(request_items.get(table_name, []))
+    raise RuntimeError(f"{unprocessed} items still unprocessed after {BATCH_WRITE_MAX_ATTEMPTS} attempts")
+
+
+def bulk_import(dynamodb, items, workers=8, report_every=10000):
+    """Write items with BatchWriteItem from parallel worker threads and return throughput stats."""
+    written = 0
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def write(chunk):
+        nonlocal written
+        count = batch_write_chunk(dynamodb, chunk)
+        with lock:
+            previous, written = written, written + count
+            if report_every and previous // report_every != written // report_every:
+                print(f"{written} items written ({written / (time.perf_counter() - started):.0f} items/s)")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Bound the chunks in flight so a large file is streamed instead of loaded in memory
+        in_flight = []
+        for chunk in chunk_items(items):
+            keys = {item_key(item) for item in chunk}
+            # A key written again by a later chunk keeps its last item: the earlier chunk must be written first
+            for future, chunk_keys in in_flight:
+                if keys & chunk_keys:
+                    future.result()
+            in_flight.append((executor.submit(write, chunk), keys))
+            if len(in_flight) >= workers * 4:
+                in_flight.pop(0)[0].result()
+        for future, _ in in_flight:
+            future.result()
+
+    elapsed = time.perf_counter() - started
+    return {"items": written, "seconds": round(elapsed, 3), "items_per_second": round(written / elapsed, 1)}
+
+
+def populate_table(items=None, workers=1, endpoint_url=None):
+    print("Populating table with initial data")
+    dynamodb = dynamodb_client(workers, endpoint_url)
+    stats = bulk_import(dynamodb, table_items if items is None else items, workers=workers)
+    print(f"{stats['items']} items added in {stats['seconds']}s ({stats['items_per_second']} items/s)")
+    return stats
 
 
 def create_cognito_user():
@@ -150,5 +249,14 @@ def create_cognito_user():
 
 
 if __name__ == "__main__":
-    create_cognito_user()
-    populate_table()
+    parser = argparse.ArgumentParser(description="Set up the assistant config table and Cognito user")
+    parser.add_argument("--import-jsonl", help="bulk import the items of this JSONL file instead of the initial data")
+    parser.add_argument("--workers", type=int, default=8, help="parallel BatchWriteItem workers")
+    parser.add_argument("--endpoint-url", help="DynamoDB endpoint, e.g. DynamoDB Local")
+    args = parser.parse_args()
+
+    if args.import_jsonl:
+        populate_table(read_jsonl_items(args.import_jsonl), workers=args.workers, endpoint_url=args.endpoint_url)
+    else:
+        create_cognito_user()
+        populate_table()
@@ -1,6 +1,30 @@
-from assistant_config_interface.data_manager import AccountDataAccess
+from assistant_config_interface.data_manager import AccountDataAccess, collect_pages, set_client_factory
+from clients import get_client
 import json
 
+set_client_factory(get_client)
+
+# Upper bound for the `limit` query string parameter of the list routes
+MAX_PAGE_LIMIT = 100
+
+
+def load_listing_snapshot(account_data, item_type_prefix, limit, cursor):
+    """A full listing reads every item under its prefix anyway: load them as a snapshot, cached by the container,
+    so the same listing is answered from memory until it expires. Paged listings query only their page."""
+    if limit is None and cursor is None:
+        account_data.load_snapshot(item_type_prefix)
+
+
+def get_page_parameters(event):
+    """Read the optional `limit` and `cursor` query string parameters of the list routes."""
+    query_parameters = event.get('queryStringParameters') or {}
+    limit = query_parameters.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or not 0 < int(limit) <= MAX_PAGE_LIMIT:
+            raise ValueError(f"limit must be an integer between 1 and {MAX_PAGE_LIMIT}")
+        limit = int(limit)
+    return limit, query_parameters.get('cursor')
+
 
 def lambda_handler(event, context):
     try:
@@ -15,6 +39,7 @@ def lambda_handler(event, context):
         route_key = event['routeKey']
         account_id = path_parameters.get('accountID')
         workflow_id = path_parameters.get('WorkflowID')
+        next_cursor = None
 
         # Ensure the account_id from the path matches the one in the token
         if account_id != claims.get('custom:account_id'):
@@ -25,7 +50,9 @@ def lambda_handler(event, context):
         elif route_key == 'GET /accounts/{accountID}/inference-endpoint':
             result = account_data.get_inference_endpoint()
         elif route_key == 'GET /accounts/{accountID}/workflows':
-            result = account_data.list_workflows()
+            limit, cursor = get_page_parameters(event)
+            load_listing_snapshot(account_data, "workflow#details#", limit, cursor)
+            result, next_cursor = collect_pages(account_data.iter_workflow_pages(limit=limit, cursor=cursor))
         elif route_key == 'GET /accounts/{accountID}/workflows/{WorkflowID}':
             if not workflow_id:
                 raise ValueError("WorkflowID is required for this endpoint")
@@ -33,16 +60,30 @@ def lambda_handler(event, context):
         elif route_key == 'GET /accounts/{accountID}/workflows/{WorkflowID}/prompts':
             if not workflow_id:
                 raise ValueError("WorkflowID is required for this endpoint")
-            result = account_data.list_workflow_prompts(workflow_id)
+            limit, cursor = get_page_parameters(event)
+            load_listing_snapshot(account_data, f"workflow#prompt#{workflow_id}#", limit, cursor)
+            result, next_cursor = collect_pages(
+                account_data.iter_workflow_prompt_pages(workflow_id, limit=limit, cursor=cursor)
+            )
+        elif route_key == 'GET /accounts/{accountID}/workflows/{WorkflowID}/prompts/{PromptID}':
+            prompt_id = path_parameters.get('PromptID')
+            if not workflow_id or not prompt_id:
+                raise ValueError("WorkflowID and PromptID are required for this endpoint")
+            result = account_data.get_workflow_prompt(workflow_id, prompt_id)
         else:
             raise ValueError(f"Unsupported route: {route_key}")
 
+        headers = {
+            'Content-Type': 'application/json'
+        }
+        # List routes keep returning a JSON array; the cursor of the next page travels in a header
+        if next_cursor:
+            headers['X-Next-Cursor'] = next_cursor
+
         return {
             'statusCode': 200,
             'body': json.dumps(result),
-            'headers': {
-                'Content-Type': 'application/json'
-            }
+            'headers': headers
         }
     except ValueError as ve:
         return {
@@ -1,49 +1,401 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
-import boto3
-from boto3.dynamodb.conditions import Key
+from collections import OrderedDict
+from decimal import Decimal
+import base64
+import json
 import os
+import threading
+import time
 
 
 # Get the DynamoDB table name from the environment variable
 table_name = os.environ["TABLE_NAME"]
-dynamodb = boto3.resource("dynamodb")
-table = dynamodb.Table(table_name)
+
+# The low-level client is created on first use. It skips the model loading of the boto3 resource API, and boto3
+# itself is only imported then. The functions that use the layer pass their shared client factory to
+# set_client_factory so DynamoDB calls get the same pool, timeout and retry configuration as their other clients.
+_dynamodb_client = None
+_dynamodb_client_lock = threading.Lock()
+_client_factory = None
+
+# Config items change rarely, so lookups are cached per container. A TTL of 0 disables the cache.
+CONFIG_CACHE_TTL_SECONDS = float(os.environ.get("CONFIG_CACHE_TTL_SECONDS", "60"))
+# Missing items (e.g. an unknown workflow id) are cached for a shorter time
+CONFIG_CACHE_NEGATIVE_TTL_SECONDS = float(os.environ.get("CONFIG_CACHE_NEGATIVE_TTL_SECONDS", "10"))
+CONFIG_CACHE_MAX_ITEMS = int(os.environ.get("CONFIG_CACHE_MAX_ITEMS", "1024"))
+
+# Items requested per DynamoDB query page when listing workflows and prompts. Unset uses the 1 MB page of DynamoDB.
+CONFIG_QUERY_PAGE_SIZE = int(os.environ["CONFIG_QUERY_PAGE_SIZE"]) if os.environ.get("CONFIG_QUERY_PAGE_SIZE") else None
+
+# BatchGetItem accepts up to 100 keys per call
+BATCH_GET_MAX_KEYS = 100
+BATCH_GET_MAX_ATTEMPTS = 5
+
+# Cache key prefix of account snapshots, followed by the item_type prefix they were loaded with
+SNAPSHOT_CACHE_PREFIX = "snapshot#"
+
+
+class ConfigCache:
+    """TTL cache with LRU eviction for config items, keyed by account id and item_type."""
+
+    def __init__(self, ttl=CONFIG_CACHE_TTL_SECONDS, negative_ttl=CONFIG_CACHE_NEGATIVE_TTL_SECONDS,
+                 max_items=CONFIG_CACHE_MAX_ITEMS):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, account_id, item_type):
+        """Return (True, value) for a fresh entry, (False, None) otherwise."""
+        key = (account_id, item_type)
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._items[key]
+                self.misses += 1
+                return False, None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def __contains__(self, key):
+        """Whether the (account_id, item_type) key has a fresh entry. Unlike get, not counted as a hit or a miss."""
+        with self._lock:
+            entry = self._items.get(key)
+            return entry is not None and entry[0] > time.monotonic()
+
+    def record_misses(self, count):
+        """Count lookups answered from the table without going through get, e.g. from a BatchGetItem."""
+        with self._lock:
+            self.misses += count
+
+    def put(self, account_id, item_type, value):
+        ttl = self.ttl if value else min(self.ttl, self.negative_ttl)
+        if ttl <= 0:
+            return
+        key = (account_id, item_type)
+        with self._lock:
+            self._items[key] = (time.monotonic() + ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, account_id, item_type=None, item_type_prefix=None):
+        """Drop one item of an account, the items matching item_type_prefix, or every item when both are None."""
+        with self._lock:
+            if item_type is not None:
+                self._items.pop((account_id, item_type), None)
+            if item_type_prefix is not None or item_type is None:
+                for key in [key for key in self._items
+                            if key[0] == account_id and key[1].startswith(item_type_prefix or "")]:
+                    del self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._items), "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions}
+
+
+config_cache = ConfigCache()
+
+
+def set_client_factory(factory):
+    """Create the DynamoDB client with `factory(service_name)` instead of boto3's defaults."""
+    global _client_factory, _dynamodb_client
+    with _dynamodb_client_lock:
+        _client_factory = factory
+        _dynamodb_client = None
+
+
+def dynamodb_client():
+    global _dynamodb_client
+    if _dynamodb_client is None:
+        with _dynamodb_client_lock:
+            if _dynamodb_client is None:
+                if _client_factory is not None:
+                    _dynamodb_client = _client_factory("dynamodb")
+                else:
+                    import boto3
+                    _dynamodb_client = boto3.client("dynamodb")
+    return _dynamodb_client
+
+
+def from_attribute_value(value):
+    """Python value of a DynamoDB attribute value, as the boto3 resource API returns it."""
+    (data_type, data), = value.items()
+    if data_type in ("S", "BOOL", "B"):
+        return data
+    if data_type == "N":
+        return Decimal(data)
+    if data_type == "NULL":
+        return None
+    if data_type == "M":
+        return {name: from_attribute_value(item) for name, item in data.items()}
+    if data_type == "L":
+        return [from_attribute_value(item) for item in data]
+    if data_type == "NS":
+        return {Decimal(item) for item in data}
+    if data_type in ("SS", "BS"):
+        return set(data)
+    raise ValueError(f"Unsupported DynamoDB attribute type: {data_type}")
+
+
+def deserialize_item(item):
+    return {name: from_attribute_value(value) for name, value in item.items()}
+
+
+def item_key(key):
+    """DynamoDB key of a plain {"id", "item_type"} key."""
+    return {"id": {"S": key["id"]}, "item_type": {"S": key["item_type"]}}
+
+
+def encode_cursor(last_evaluated_key):
+    """Turn a DynamoDB LastEvaluatedKey into an opaque, url safe cursor."""
+    if not last_evaluated_key:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(last_evaluated_key, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, dict) or set(key) != {"id", "item_type"}:
+        raise ValueError("Invalid cursor")
+    return key
+
+
+def collect_pages(pages):
+    """Concatenate the items of (items, next_cursor) pages and return them with the last cursor."""
+    items, next_cursor = [], None
+    for page_items, next_cursor in pages:
+        items.extend(page_items)
+    return items, next_cursor
+
+
+def item_type_sort_key(item_type):
+    # DynamoDB orders string sort keys by their UTF-8 bytes
+    return item_type.encode()
+
+
+def workflow_prompt_item_type(workflow_id, prompt_id):
+    return f"workflow#prompt#{workflow_id}#{prompt_id}"
+
+
+class AccountSnapshot:
+    """In-memory copy of the config items of one account, indexed by item_type.
+
+    A snapshot loaded by item_type prefix holds every item under that prefix, so prefix listings can be answered
+    from it. A snapshot loaded from known keys can only answer lookups of those keys.
+    """
+
+    def __init__(self, account_id, items, prefix=None, item_types=None):
+        self.account_id = account_id
+        self.prefix = prefix
+        self.item_types = set(item_types) if item_types is not None else None
+        self.items = {item["item_type"]: item for item in items}
+        self._sorted_item_types = sorted(self.items, key=item_type_sort_key)
+
+    def covers(self, item_type, is_prefix=False):
+        if self.prefix is not None:
+            return item_type.startswith(self.prefix)
+        return not is_prefix and item_type in self.item_types
+
+    def get(self, item_type):
+        return self.items.get(item_type)
+
+    def with_prefix(self, item_type_prefix, start_after=None):
+        """Items whose item_type starts with the prefix, in table order, after the start_after item_type."""
+        return [
+            self.items[item_type] for item_type in self._sorted_item_types
+            if item_type.startswith(item_type_prefix) and
+            (start_after is None or item_type_sort_key(item_type) > item_type_sort_key(start_after))
+        ]
+
+    def __len__(self):
+        return len(self.items)
 
 
 class AccountDataAccess:
-    def __init__(self, cognito_access_token):
+    def __init__(self, cognito_access_token, snapshot=None):
         # Get the account ID from the Cognito access token
         self.account_id = cognito_access_token.get("custom:account_id")
+        # When set, lookups covered by the snapshot are answered from memory
+        self.snapshot = snapshot
 
-    def get_account_details(self):
-        response = table.query(
-            KeyConditionExpression=Key("id").eq(f"account#{self.account_id}") &
-                                   Key("item_type").eq("account#details")
+    def _cached(self, item_type, load):
+        found, value = config_cache.get(self.account_id, item_type)
+        if not found:
+            value = load()
+            config_cache.put(self.account_id, item_type, value)
+        return value
+
+    def _lookup(self, item_type, load, as_list=True):
+        """Answer a single item lookup from the snapshot when it covers item_type, else from the cache or table.
+        Items answered from the snapshot are cached for the next requests."""
+        if self.snapshot is not None and self.snapshot.covers(item_type):
+            item = self.snapshot.get(item_type)
+            value = ([item] if item else []) if as_list else (item or {})
+            config_cache.put(self.account_id, item_type, value)
+            return value
+        return self._cached(item_type, load)
+
+    def invalidate_cache(self, item_type=None):
+        """Drop cached config of this account. For a function that writes config items: the ones written elsewhere,
+        e.g. by assistant_config.py, are only refreshed when their cache entry expires."""
+        # Snapshots hold copies of every item, so they are dropped with any item
+        config_cache.invalidate(self.account_id, item_type, SNAPSHOT_CACHE_PREFIX if item_type else None)
+        self.snapshot = None
+
+    def load_snapshot(self, item_type_prefix=""):
+        """Load every item of the account under item_type_prefix with one paginated query and attach it.
+
+        The snapshot is cached like the single item lookups, so further requests served by the container
+        don't query the table again until it expires.
+        """
+        def load():
+            items, _ = collect_pages(self._query_pages(item_type_prefix, use_snapshot=False))
+            return AccountSnapshot(self.account_id, items, prefix=item_type_prefix)
+
+        self.snapshot = self._cached(f"{SNAPSHOT_CACHE_PREFIX}{item_type_prefix}", load)
+        return self.snapshot
+
+    def batch_get_snapshot(self, item_types):
+        """Load known item_types of the account with BatchGetItem and attach them as a snapshot."""
+        keys = [{"id": f"account#{self.account_id}", "item_type": item_type} for item_type in dict.fromkeys(item_types)]
+        items = []
+        for start in range(0, len(keys), BATCH_GET_MAX_KEYS):
+            request_items = {table_name: {"Keys": [item_key(key) for key in keys[start:start + BATCH_GET_MAX_KEYS]]}}
+            for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+                response = dynamodb_client().batch_get_item(RequestItems=request_items)
+                items.extend(deserialize_item(item) for item in response.get("Responses", {}).get(table_name, []))
+                request_items = response.get("UnprocessedKeys")
+                if not request_items:
+                    break
+                time.sleep(0.05 * 2 ** attempt)
+            else:
+                raise RuntimeError(f"BatchGetItem left unprocessed keys after {BATCH_GET_MAX_ATTEMPTS} attempts")
+
+        self.snapshot = AccountSnapshot(self.account_id, items, item_types=[key["item_type"] for key in keys])
+        return self.snapshot
+
+    def prefetch(self, item_types):
+        """Read the item_types that are not cached with one BatchGetItem, so that looking all of them up takes one
+        round trip instead of one per item."""
+        missing = [item_type for item_type in dict.fromkeys(item_types)
+                   if (self.account_id, item_type) not in config_cache]
+        if missing:
+            self.batch_get_snapshot(missing)
+            config_cache.record_misses(len(missing))
+
+    def _query_item_type(self, item_type):
+        response = dynamodb_client().query(
+            TableName=table_name,
+            KeyConditionExpression="#id = :id AND #item_type = :item_type",
+            ExpressionAttributeNames={"#id": "id", "#item_type": "item_type"},
+            ExpressionAttributeValues={":id": {"S": f"account#{self.account_id}"}, ":item_type": {"S": item_type}}
         )
-        return response.get("Items", [])
+        return [deserialize_item(item) for item in response.get("Items", [])]
+
+    def get_account_details(self):
+        return self._lookup("account#details", lambda: self._query_item_type("account#details"))
 
     def get_inference_endpoint(self):
-        response = table.query(
-            KeyConditionExpression=Key("id").eq(f"account#{self.account_id}") &
-                                   Key("item_type").eq("account#inference_endpoint")
-        )
-        return response.get("Items", [])
-
-    def list_workflows(self):
-        attributes = ["id", "item_type", "name", "description"]
-        expression_attribute_names = {
-            f"#{word}": word for word in attributes
-        }
-        projection_expression = ",".join([f"#{word}" for word in attributes])
-        response = table.query(
-            KeyConditionExpression=Key("id").eq(f"account#{self.account_id}") &
-                                   Key("item_type").begins_with("workflow#details#"),
-            ProjectionExpression=projection_expression,
-            ExpressionAttributeNames=expression_attribute_names
+        return self._lookup("account#inference_endpoint", lambda: self._query_item_type("account#inference_endpoint"))
+
+    def _snapshot_pages(self, item_type_prefix, limit, start_key, attributes):
+        items = self.snapshot.with_prefix(item_type_prefix, start_after=start_key and start_key["item_type"])
+        next_cursor = None
+        if limit is not None and len(items) > limit:
+            items = items[:limit]
+            next_cursor = encode_cursor({"id": items[-1]["id"], "item_type": items[-1]["item_type"]})
+        if attributes:
+            items = [{name: item[name] for name in attributes if name in item} for item in items]
+        yield items, next_cursor
+
+    def _query_pages(self, item_type_prefix, limit=None, cursor=None, page_size=CONFIG_QUERY_PAGE_SIZE,
+                     attributes=None, use_snapshot=True):
+        """Yield (items, next_cursor) for each query page of the item_type prefix, following LastEvaluatedKey.
+
+        Stops after `limit` items; next_cursor is None once the query is exhausted. Served from the snapshot in a
+        single page when it covers the prefix.
+        """
+        if limit is not None and limit <= 0:
+            raise ValueError("limit must be a positive integer")
+        query_kwargs = {}
+        start_key = None
+        if cursor:
+            start_key = decode_cursor(cursor)
+            if start_key["id"] != f"account#{self.account_id}" or \
+                    not start_key["item_type"].startswith(item_type_prefix):
+                raise ValueError("Invalid cursor")
+            query_kwargs["ExclusiveStartKey"] = item_key(start_key)
+
+        if use_snapshot and self.snapshot is not None and self.snapshot.covers(item_type_prefix, is_prefix=True):
+            yield from self._snapshot_pages(item_type_prefix, limit, start_key, attributes)
+            return
+
+        attribute_names = {"#id": "id"}
+        attribute_values = {":id": {"S": f"account#{self.account_id}"}}
+        key_condition = "#id = :id"
+        if item_type_prefix:
+            attribute_names["#item_type"] = "item_type"
+            attribute_values[":item_type_prefix"] = {"S": item_type_prefix}
+            key_condition += " AND begins_with(#item_type, :item_type_prefix)"
+        if attributes:
+            attribute_names.update({f"#{word}": word for word in attributes})
+            query_kwargs["ProjectionExpression"] = ",".join([f"#{word}" for word in attributes])
+
+        remaining = limit
+        while True:
+            page_limits = [size for size in (page_size, remaining) if size]
+            if page_limits:
+                query_kwargs["Limit"] = min(page_limits)
+            response = dynamodb_client().query(
+                TableName=table_name,
+                KeyConditionExpression=key_condition,
+                ExpressionAttributeNames=attribute_names,
+                ExpressionAttributeValues=attribute_values,
+                **query_kwargs
+            )
+            items = [deserialize_item(item) for item in response.get("Items", [])]
+            last_evaluated_key = response.get("LastEvaluatedKey")
+            yield items, encode_cursor(last_evaluated_key and deserialize_item(last_evaluated_key))
+
+            if remaining is not None:
+                remaining -= len(items)
+            if not last_evaluated_key or remaining == 0:
+                return
+            query_kwargs["ExclusiveStartKey"] = last_evaluated_key
+
+    def iter_workflow_pages(self, limit=None, cursor=None, page_size=CONFIG_QUERY_PAGE_SIZE):
+        return self._query_pages(
+            "workflow#details#",
+            limit=limit,
+            cursor=cursor,
+            page_size=page_size,
+            attributes=["id", "item_type", "name", "description"]
         )
-        return response.get("Items", [])
+
+    def iter_workflows(self, limit=None, cursor=None, page_size=CONFIG_QUERY_PAGE_SIZE):
+        for items, _ in self.iter_workflow_pages(limit, cursor, page_size):
+            yield from items
+
+    def list_workflows(self, limit=None, cursor=None, page_size=CONFIG_QUERY_PAGE_SIZE):
+        return list(self.iter_workflows(limit, cursor, page_size))
 
     def get_workflow_details(self, workflow_id):
         # Split the workflow ID to get the actual ID
@@ -53,26 +405,23 @@ class AccountDataAccess:
         else:
             raise ValueError("Invalid item_type string format")
         # get the id from ex: workflow#details#1
-        response = table.get_item(
-            Key={
-                "id": f"account#{self.account_id}",
-                "item_type": f"workflow#details#{workflow_id}"
-            }
-        )
+        item_type = f"workflow#details#{workflow_id}"
+        return self._lookup(item_type, lambda: deserialize_item(dynamodb_client().get_item(
+            TableName=table_name,
+            Key=item_key({"id": f"account#{self.account_id}", "item_type": item_type})
+        ).get("Item", {})), as_list=False)
 
-        return response.get("Item", {})
+    def iter_workflow_prompt_pages(self, workflow_id, limit=None, cursor=None, page_size=CONFIG_QUERY_PAGE_SIZE):
+        return self._query_pages(f"workflow#prompt#{workflow_id}#", limit=limit, cursor=cursor, page_size=page_size)
 
-    def list_workflow_prompts(self, workflow_id):
-        response = table.query(
-            KeyConditionExpression=Key("id").eq(f"account#{self.account_id}") &
-                                   Key("item_type").begins_with(f"workflow#prompt#{workflow_id}#")
-        )
-        return response.get("Items", [])
+    def iter_workflow_prompts(self, workflow_id, limit=None, cursor=None, page_size=CONFIG_QUERY_PAGE_SIZE):
+        for items, _ in self.iter_workflow_prompt_pages(workflow_id, limit, cursor, page_size):
+            yield from items
+
+    def list_workflow_prompts(self, workflow_id, limit=None, cursor=None, page_size=CONFIG_QUERY_PAGE_SIZE):
+        return list(self.iter_workflow_prompts(workflow_id, limit, cursor, page_size))
 
     def get_workflow_prompt(self, workflow_id, prompt_id):
-        response = table.query(
-            KeyConditionExpression=Key("id").eq(f"account#{self.account_id}") &
-                                   Key("item_type").eq(f"workflow#prompt#{workflow_id}#{prompt_id}")
-        )
-        return response.get("Items", [])
+        item_type = workflow_prompt_item_type(workflow_id, prompt_id)
+        return self._lookup(item_type, lambda: self._query_item_type(item_type))
 
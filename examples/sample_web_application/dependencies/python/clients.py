@@ -0,0 +1,84 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import threading
+from os import environ
+from typing import Dict
+
+# boto3 clients of the app and of the config handler, both load this module from the ConfigLayer (/opt/python)
+
+# "lazy" creates the boto3 clients, and imports boto3, on first use so the Lambda init phase only loads the web
+# framework. "eager" creates them at import, e.g. with provisioned concurrency or SnapStart where init is not on the
+# request path.
+STARTUP_MODE = environ.get("STARTUP_MODE", "lazy")
+
+# Connections kept per client. It should cover the concurrent streams and workflow executions of the process
+# (STREAM_MAX_WORKERS, WORKFLOW_MAX_CONCURRENCY); botocore's default is 10.
+CLIENT_MAX_POOL_CONNECTIONS = int(environ.get("CLIENT_MAX_POOL_CONNECTIONS", "128"))
+CLIENT_CONNECT_TIMEOUT_SECONDS = float(environ.get("CLIENT_CONNECT_TIMEOUT_SECONDS", "3"))
+CLIENT_TCP_KEEPALIVE = environ.get("CLIENT_TCP_KEEPALIVE", "true").lower() == "true"
+# "adaptive" adds client side rate limiting to the standard retries once the service throttles
+CLIENT_RETRY_MODE = environ.get("CLIENT_RETRY_MODE", "adaptive")
+# Attempts per call, the first one included
+CLIENT_MAX_ATTEMPTS = int(environ.get("CLIENT_MAX_ATTEMPTS", "3"))
+
+# Longest wait for the next bytes of a response, per service
+CLIENT_READ_TIMEOUT_SECONDS = {
+    # Gap between two events of a response stream, including the time to the first token of long prompts
+    "bedrock-runtime": float(environ.get("BEDROCK_READ_TIMEOUT_SECONDS", "120")),
+    # start_sync_execution returns when the express workflow ends, a bit after WORKFLOW_TIMEOUT_SECONDS
+    "stepfunctions": float(environ.get("STEPFUNCTIONS_READ_TIMEOUT_SECONDS", "35")),
+    "dynamodb": float(environ.get("DYNAMODB_READ_TIMEOUT_SECONDS", "5")),
+}
+DEFAULT_READ_TIMEOUT_SECONDS = 60
+
+_lock = threading.Lock()
+_clients: Dict[str, "LazyClient"] = {}
+
+
+def client_config(service_name: str):
+    """botocore Config shared by every client of the service."""
+    from botocore.config import Config
+
+    return Config(
+        max_pool_connections=CLIENT_MAX_POOL_CONNECTIONS,
+        connect_timeout=CLIENT_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=CLIENT_READ_TIMEOUT_SECONDS.get(service_name, DEFAULT_READ_TIMEOUT_SECONDS),
+        tcp_keepalive=CLIENT_TCP_KEEPALIVE,
+        retries={"mode": CLIENT_RETRY_MODE, "total_max_attempts": CLIENT_MAX_ATTEMPTS},
+    )
+
+
+class LazyClient:
+    """Proxy of a boto3 client created on first attribute access, e.g. the first API call."""
+
+    def __init__(self, service_name: str):
+        self._service_name = service_name
+        self._client = None
+
+    def load(self):
+        if self._client is None:
+            # boto3's default session is not thread safe, so all clients are created under one lock
+            with _lock:
+                if self._client is None:
+                    import boto3
+                    self._client = boto3.client(self._service_name, config=client_config(self._service_name))
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        state = "loaded" if self._client is not None else "not loaded"
+        return f"LazyClient({self._service_name!r}, {state})"
+
+
+def get_client(service_name: str) -> LazyClient:
+    """Shared client of the service, created in eager mode."""
+    with _lock:
+        client = _clients.get(service_name)
+        if client is None:
+            client = _clients[service_name] = LazyClient(service_name)
+    if STARTUP_MODE == "eager":
+        client.load()
+    return client
@@ -0,0 +1,101 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import re
+from os import environ
+from typing import Any, List, Optional, Set, Tuple
+
+from history_manager import TokenEstimator
+
+# Set to "false" to serialize context_data with its Python repr, as before
+CONTEXT_PACKING = environ.get("CONTEXT_PACKING", "true").lower() == "true"
+
+# Estimated tokens of retrieved passages added to the system prompt. 0 disables the budget.
+CONTEXT_TOKEN_BUDGET = int(environ.get("CONTEXT_TOKEN_BUDGET", "4000"))
+
+# A passage whose word shingles are covered by already packed passages above this ratio is a duplicate
+CONTEXT_DEDUP_THRESHOLD = float(environ.get("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+
+SHINGLE_WORDS = 5
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def result_field(item: dict, name: str) -> Any:
+    """Key of a Retrieve result in boto3's camelCase (inline engine before it normalises them, recorded payloads), or
+    in the PascalCase of the Step Functions aws-sdk integration."""
+    value = item.get(name)
+    return item.get(name[:1].upper() + name[1:]) if value is None else value
+
+
+def source_uri(location: Optional[dict]) -> str:
+    """URI of a Knowledge Base Retrieve result location, whatever the data source type."""
+    if not isinstance(location, dict):
+        return ""
+    for value in location.values():
+        if isinstance(value, dict):
+            uri = result_field(value, "uri") or result_field(value, "url")
+            if uri:
+                return uri
+    return ""
+
+
+def shingles(text: str) -> Set[Tuple[str, ...]]:
+    words = text.casefold().split()
+    if len(words) <= SHINGLE_WORDS:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def retrieved_passage(item) -> Optional[Tuple[str, str, float]]:
+    """(text, source, score) of a Retrieve result, None for any other context_data item."""
+    if not isinstance(item, dict) or not isinstance(result_field(item, "content"), dict):
+        return None
+    text = result_field(result_field(item, "content"), "text")
+    if not isinstance(text, str):
+        return None
+    return (_WHITESPACE.sub(" ", text).strip(), source_uri(result_field(item, "location")),
+            float(result_field(item, "score") or 0))
+
+
+def pack_context(
+        context_data: List,
+        token_budget: int = CONTEXT_TOKEN_BUDGET,
+        estimator: Optional[TokenEstimator] = None,
+        dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD
+) -> str:
+    """Serialize context_data as numbered passages with their source, most relevant first.
+
+    Retrieve results are deduplicated (exact and overlapping chunks) and dropped by ascending score once the token
+    budget is spent; their metadata is left out. Other items, such as caught workflow errors, are kept as compact JSON.
+    """
+    estimator = estimator or TokenEstimator()
+    passages = []
+    others = []
+    for item in context_data:
+        passage = retrieved_passage(item)
+        if passage is None:
+            others.append(item if isinstance(item, str) else json.dumps(item, separators=(",", ":"), default=str))
+        elif passage[0]:
+            passages.append(passage)
+
+    # Stable order: score, then source and text for equal scores
+    passages.sort(key=lambda passage: (-passage[2], passage[1], passage[0]))
+
+    seen: Set[Tuple[str, ...]] = set()
+    tokens = sum(estimator.text_tokens(other) for other in others)
+    blocks = []
+    for text, source, _ in passages:
+        text_shingles = shingles(text)
+        if len(text_shingles & seen) >= dedup_threshold * len(text_shingles):
+            continue
+        block = f"[{len(blocks) + 1}] {source}\n{text}" if source else f"[{len(blocks) + 1}]\n{text}"
+        block_tokens = estimator.text_tokens(block)
+        if token_budget and tokens + block_tokens > token_budget:
+            continue
+        seen |= text_shingles
+        tokens += block_tokens
+        blocks.append(block)
+
+    return "\n\n".join(blocks + others)
@@ -0,0 +1,136 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import math
+from os import environ
+from typing import Dict, List, Optional
+
+# Estimated input tokens allowed for the conversation history sent to the model and to the workflow.
+# 0 disables the corresponding budget.
+HISTORY_TOKEN_BUDGET = int(environ.get("HISTORY_TOKEN_BUDGET", "8000"))
+WORKFLOW_HISTORY_TOKEN_BUDGET = int(environ.get("WORKFLOW_HISTORY_TOKEN_BUDGET", "2000"))
+
+# Older messages above this size are condensed to their beginning and end. The latest message is never condensed.
+HISTORY_MAX_MESSAGE_TOKENS = int(environ.get("HISTORY_MAX_MESSAGE_TOKENS", "1000"))
+
+# Average characters per token of English text for Claude tokenizers, on the conservative side
+HISTORY_CHARS_PER_TOKEN = float(environ.get("HISTORY_CHARS_PER_TOKEN", "3.5"))
+
+# Role and formatting tokens added by the model for every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+CONDENSED_MARKER = "\n[...]\n"
+
+
+class TokenEstimator:
+    """Character based token estimate, memoized per text. Create one per request."""
+
+    def __init__(self, chars_per_token: float = HISTORY_CHARS_PER_TOKEN):
+        self.chars_per_token = chars_per_token
+        self._memo: Dict[str, int] = {}
+
+    def text_tokens(self, text: str) -> int:
+        tokens = self._memo.get(text)
+        if tokens is None:
+            tokens = self._memo[text] = math.ceil(len(text) / self.chars_per_token)
+        return tokens
+
+    def message_tokens(self, message: dict) -> int:
+        return MESSAGE_OVERHEAD_TOKENS + sum(self.text_tokens(text) for text in message_texts(message))
+
+    def messages_tokens(self, messages: List[dict]) -> int:
+        return sum(self.message_tokens(message) for message in messages)
+
+
+def message_texts(message: dict) -> List[str]:
+    """Text of a Claude messages API (str content) or converse API (list of blocks) message."""
+    content = message.get("content")
+    if isinstance(content, str):
+        return [content]
+    return [block["text"] for block in content or [] if isinstance(block, dict) and "text" in block]
+
+
+class HistoryWindow:
+    """Messages kept by HistoryManager.window, with the estimated tokens before and after."""
+
+    def __init__(
+            self,
+            messages: List[dict],
+            original_tokens: int,
+            tokens: int,
+            dropped_messages: int,
+            condensed_messages: int
+    ):
+        self.messages = messages
+        self.original_tokens = original_tokens
+        self.tokens = tokens
+        self.dropped_messages = dropped_messages
+        self.condensed_messages = condensed_messages
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.original_tokens - self.tokens
+
+
+class HistoryManager:
+    """Keeps the most recent messages that fit a token budget.
+
+    Older messages larger than max_message_tokens are condensed first, then the oldest messages are dropped until the
+    history fits. The latest message is always kept whole, and the window starts with a user message as the Bedrock
+    APIs require.
+    """
+
+    def __init__(
+            self,
+            estimator: Optional[TokenEstimator] = None,
+            max_message_tokens: int = HISTORY_MAX_MESSAGE_TOKENS
+    ):
+        self.estimator = estimator or TokenEstimator()
+        self.max_message_tokens = max_message_tokens
+
+    def window(self, messages: List[dict], token_budget: int) -> HistoryWindow:
+        estimator = self.estimator
+        original_tokens = estimator.messages_tokens(messages)
+        if token_budget <= 0 or original_tokens <= token_budget or not messages:
+            return HistoryWindow(messages, original_tokens, original_tokens, 0, 0)
+
+        kept = [messages[-1]]
+        tokens = estimator.message_tokens(messages[-1])
+        condensed_messages = 0
+        for message in reversed(messages[:-1]):
+            condensed = bool(self.max_message_tokens) and estimator.message_tokens(message) > self.max_message_tokens
+            if condensed:
+                message = self.condense(message)
+            message_tokens = estimator.message_tokens(message)
+            if tokens + message_tokens > token_budget:
+                break
+            kept.append(message)
+            tokens += message_tokens
+            condensed_messages += condensed
+        kept.reverse()
+
+        while len(kept) > 1 and kept[0].get("role") != "user":
+            tokens -= estimator.message_tokens(kept.pop(0))
+
+        return HistoryWindow(kept, original_tokens, tokens, len(messages) - len(kept), condensed_messages)
+
+    def condense(self, message: dict) -> dict:
+        """Copy of the message with every text cut down to its beginning and end."""
+        max_chars = int(self.max_message_tokens * self.estimator.chars_per_token) - len(CONDENSED_MARKER)
+        head, tail = max_chars * 2 // 3, max_chars // 3
+
+        def condense_text(text: str) -> str:
+            if len(text) <= max_chars:
+                return text
+            return text[:head] + CONDENSED_MARKER + text[len(text) - tail:]
+
+        content = message.get("content")
+        if isinstance(content, str):
+            content = condense_text(content)
+        else:
+            content = [
+                {**block, "text": condense_text(block["text"])} if isinstance(block, dict) and "text" in block
+                else block
+                for block in content or []
+            ]
+        return {**message, "content": content}
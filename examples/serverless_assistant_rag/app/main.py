@@ -1,16 +1,34 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
-from fastapi.responses import StreamingResponse
-from typing import List, Optional, Literal
+from fastapi.responses import Response, StreamingResponse
+from typing import Any, Dict, List, Optional, Literal, Tuple, Union
 from typing_extensions import Annotated
 from pydantic_core import to_json
 from pydantic import BaseModel, field_validator, model_validator
 from pydantic import Field
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from starlette.background import BackgroundTask
 from os import environ
+import asyncio
 import json
-import boto3
+import logging
+
+from admission_control import ADMISSION_CONTROL_ENABLED, DEFAULT_ACCOUNT, AdmissionController, AdmissionRejected
+from clients import get_client
+from context_packer import CONTEXT_PACKING, pack_context, retrieved_passage
+from prompt_cache import cache_usage, messages_api_system_blocks, use_prompt_cache
+from history_manager import HISTORY_TOKEN_BUDGET, WORKFLOW_HISTORY_TOKEN_BUDGET, HistoryManager
+from inline_workflow import INLINE_WORKFLOW_TYPE, InlineWorkflow
+from request_pipeline import REQUEST_PIPELINING, RequestStartMiddleware, StageTimer, warm_up_connection
+from response_fanout import FANOUT_ENABLED, ResponseFanout, request_fingerprint
+from stream_bridge import iterate_in_thread
+from stream_events import MEDIA_TYPES, content_event, encode_event, encode_stream, error_event
+from telemetry import count_disconnect, create_telemetry
+from workflow_cache import create_workflow_cache, workflow_cache_key
+from workflow_executor import WORKFLOW_COALESCING, ClientDisconnected, WorkflowExecutor
+
+logger = logging.getLogger()
 
 # Create the FastAPI app
 app = FastAPI(
@@ -21,9 +39,41 @@ app = FastAPI(
     response quality"""
 )
 
-# Boto3 clients for bedrock and step functions
-bedrock_boto_client = boto3.client("bedrock-runtime")
-sf_boto_client = boto3.client("stepfunctions")
+# Records the arrival time of each request, before the body is parsed
+app.add_middleware(RequestStartMiddleware)
+
+# Boto3 clients for bedrock and step functions, created on first use unless STARTUP_MODE=eager
+bedrock_boto_client = get_client("bedrock-runtime")
+sf_boto_client = get_client("stepfunctions")
+agent_runtime_boto_client = get_client("bedrock-agent-runtime")
+
+# "stepfunctions" runs the workflow as the STATEMACHINE_STATE_MACHINE_ARN express execution. "inline" runs the same
+# steps in this process (inline_workflow.py) against KNOWLEDGE_BASE_ID, without the orchestration hop.
+WORKFLOW_ENGINE = environ.get("WORKFLOW_ENGINE", "stepfunctions")
+
+# Awaits Step Functions sync executions without blocking the event loop
+workflow_executor = WorkflowExecutor()
+
+# Optional cache of workflow results for repeated questions, see WORKFLOW_CACHE_BACKEND
+workflow_cache = create_workflow_cache()
+
+# Per-request stage timings and token counts, see TELEMETRY_SINKS
+telemetry = create_telemetry()
+
+# Identical concurrent model requests share one Bedrock generation, see FANOUT_ENABLED
+response_fanout = ResponseFanout() if FANOUT_ENABLED else None
+
+# Rate limits and queuing of the requests, see ADMISSION_CONTROL_ENABLED. The API has no accounts, so all the requests
+# share the limits of one.
+admission_controller = AdmissionController() if ADMISSION_CONTROL_ENABLED else None
+
+# Optional cache of Knowledge Base documents for semantically close questions. Needs numpy (commented out in
+# requirements.txt) and bedrock:InvokeModel on the embedding model, so it is only loaded when enabled.
+semantic_cache = None
+if environ.get("SEMANTIC_CACHE_ENABLED", "false").lower() == "true":
+    from semantic_cache import SemanticRetrievalCache, VectorIndex, bedrock_text_embedder, conversation_text
+
+    semantic_cache = SemanticRetrievalCache(bedrock_text_embedder(bedrock_boto_client), VectorIndex())
 
 
 class AssistantParameters(BaseModel):
@@ -41,6 +91,19 @@ class AssistantParameters(BaseModel):
         default={},
         description="Additional params to use as data in workflow"
     )
+    bypass_workflow_cache: bool = Field(
+        default=False,
+        description="Run the workflow even if a cached result exists for the same conversation window"
+    )
+    history_token_budget: Optional[int] = Field(
+        default=None,
+        description="Estimated tokens of conversation history sent to the model, HISTORY_TOKEN_BUDGET if not set"
+    )
+    stream_format: Literal["text", "sse", "ndjson"] = Field(
+        default="text",
+        description="Response body format: the answer text, or typed events (content, context, usage, stop, error) "
+                    "as Server-Sent Events or newline delimited JSON"
+    )
 
 
 class BedrockClaudeMessagesAPIRequest(BaseModel):
@@ -59,7 +122,7 @@ class BedrockClaudeMessagesAPIRequest(BaseModel):
     max_tokens: int = 1028
     stop_sequences: List[str] = ["\n\nHuman:"]
     modelId: str = "anthropic.claude-3-sonnet-20240229-v1:0"
-    system: str = ""
+    system: Union[str, List[dict]] = ""
 
 
 class WorkflowBedrockTaskDetails(BaseModel):
@@ -108,11 +171,33 @@ class StepFunctionResponse(BaseModel):
     )
 
 
-# Execute SF sync execution
-def execute_workflow(state_machine_arn, input_data):
-    response = sf_boto_client.start_sync_execution(
-        stateMachineArn=state_machine_arn, input=json.dumps(input_data)
-    )
+# Execute SF sync execution without blocking the event loop, or reuse the result of an identical execution: cached,
+# or still running for another request (WORKFLOW_COALESCING)
+async def execute_workflow(state_machine_arn, input_data, is_disconnected=None, use_cache=True, timer=None,
+                           workflow_client=None):
+    cache_key = None
+    if workflow_cache.enabled or WORKFLOW_COALESCING:
+        cache_key = workflow_cache_key(state_machine_arn, input_data)
+    # use_cache=False skips the cached result only: the execution is still shared with identical ones in flight, and
+    # its result refreshes the cache
+    if cache_key and workflow_cache.enabled and use_cache:
+        cached_output = await workflow_cache.get(cache_key)
+        if cached_output is not None:
+            return StepFunctionResponse.model_validate_json(cached_output)
+
+    timer = timer or StageTimer()
+    coalesced = False
+
+    def record_coalesced(waiters):
+        nonlocal coalesced
+        coalesced = True
+        timer.count("workflow.coalesced", 1)
+        timer.count("workflow.coalesced_waiters", waiters)
+
+    response = await timer.measure("start_sync_execution", workflow_executor.start_sync_execution(
+        workflow_client or sf_boto_client, state_machine_arn, input_data, is_disconnected=is_disconnected,
+        coalescing_key=cache_key if WORKFLOW_COALESCING else None, on_coalesced=record_coalesced
+    ))
     # raise errors from workflow step executions
     if response["status"] != "SUCCEEDED":
         error_msg = (f"State machine error. Expected: 'SUCCEEDED', Received:"
@@ -121,30 +206,113 @@ def execute_workflow(state_machine_arn, input_data):
         raise ValueError(error_msg)
 
     output_data = StepFunctionResponse.model_validate_json(response['output'])
+
+    # Results carrying a caught task error (e.g. a failed Retrieve) are not cached
+    caught_error = any(isinstance(item, dict) and "Error" in item for item in output_data.context_data)
+    # The call that started a shared execution caches its result for all of them
+    if cache_key and workflow_cache.enabled and not coalesced and not caught_error:
+        await workflow_cache.put(cache_key, response['output'])
     return output_data
 
 
-# Validate or Build KB context based on user prompt + context
-def sf_build_context(messages, system, content_tag, state_machine_custom_params):
-    sf_workflow_result = execute_workflow(
-        state_machine_arn=environ["STATEMACHINE_STATE_MACHINE_ARN"],
-        input_data={
-            "PromptInput": messages,
-            "state_machine_custom_params": state_machine_custom_params,
-        },
-    )
+def semantic_lookup(namespace, messages):
+    # Embedding errors must not fail the request: the workflow runs as if nothing was cached
+    try:
+        return semantic_cache.lookup(namespace, conversation_text(messages))
+    except Exception as e:
+        logger.warning(f"Semantic cache lookup failed: {str(e)}")
+        return None, None
+
 
-    context = sf_build_chain_content(
-        system,
-        sf_workflow_result,
-        content_tag
+def is_retrieval_result(sf_data: StepFunctionResponse) -> bool:
+    # Only the GenerateResponseKb state returns documents without chain instructions
+    return (
+        bool(sf_data.context_data)
+        and sf_data.system_chain_data is None
+        and not any(isinstance(item, dict) and "Error" in item for item in sf_data.context_data)
     )
 
-    return context
+
+# Workflow output sent to the client as the context event of the typed stream formats
+def workflow_summary(sf_data: StepFunctionResponse, semantic_cache_hit: bool = False) -> Dict[str, Any]:
+    passages = [passage for passage in map(retrieved_passage, sf_data.context_data) if passage]
+    return {
+        "tasks": [
+            {"task_name": task.task_name, "model_id": task.task_model_id,
+             "input_tokens": task.input_token, "output_tokens": task.output_token}
+            for task in sf_data.bedrock_details.task_details
+        ],
+        "operation": sf_data.system_chain_data.operation if sf_data.system_chain_data else None,
+        "documents": len(passages),
+        "sources": list(dict.fromkeys(source for _, source, _ in passages if source)),
+        "semantic_cache_hit": semantic_cache_hit,
+    }
+
+
+# Validate or Build KB context based on user prompt + context. Returns the system content and the workflow summary.
+async def sf_build_context(messages, system, content_tag, state_machine_custom_params, is_disconnected=None,
+                           timer=None, use_cache=True, model_id=""):
+    timer = timer or StageTimer()
+    if WORKFLOW_ENGINE == INLINE_WORKFLOW_TYPE:
+        workflow_client = InlineWorkflow(bedrock_boto_client, agent_runtime_boto_client)
+        state_machine_arn = workflow_client.name
+    else:
+        workflow_client = sf_boto_client
+        state_machine_arn = environ["STATEMACHINE_STATE_MACHINE_ARN"]
+
+    sf_workflow_result = None
+    embedding = None
+    semantic_cache_hit = False
+    if semantic_cache and use_cache:
+        namespace = f"{state_machine_arn}#{json.dumps(state_machine_custom_params, sort_keys=True, default=str)}"
+        embedding, cached_documents = await timer.measure(
+            "semantic_lookup", asyncio.to_thread(semantic_lookup, namespace, messages)
+        )
+        if cached_documents is not None:
+            # Reuse the documents retrieved for a close question, no workflow task runs
+            sf_workflow_result = StepFunctionResponse(
+                bedrock_details=WorkflowBedrockDetails(task_details=[], total_input_tokens=0, total_output_tokens=0),
+                context_data=cached_documents
+            )
+            semantic_cache_hit = True
+
+    if sf_workflow_result is None:
+        sf_workflow_result = await timer.measure("workflow", execute_workflow(
+            state_machine_arn=state_machine_arn,
+            input_data={
+                "PromptInput": messages,
+                "state_machine_custom_params": state_machine_custom_params,
+            },
+            is_disconnected=is_disconnected,
+            use_cache=use_cache,
+            timer=timer,
+            workflow_client=workflow_client,
+        ))
+        if embedding is not None and is_retrieval_result(sf_workflow_result):
+            semantic_cache.store(namespace, embedding, sf_workflow_result.context_data)
+
+    for task in sf_workflow_result.bedrock_details.task_details:
+        timer.count(f"{task.task_name}.input_tokens", task.input_token)
+        timer.count(f"{task.task_name}.output_tokens", task.output_token)
+
+    with timer.stage("prompt_assembly"):
+        static_prefix, dynamic_suffix = sf_build_chain_parts(system, sf_workflow_result, content_tag)
+        if use_prompt_cache(model_id, static_prefix):
+            # System blocks with the static prefix marked as cacheable
+            context = messages_api_system_blocks(static_prefix, dynamic_suffix)
+        else:
+            context = sf_build_chain_content(
+                system,
+                sf_workflow_result,
+                content_tag
+            )
+
+    return context, workflow_summary(sf_workflow_result, semantic_cache_hit)
 
 
 def sf_build_chain_content(system: str, sf_data: StepFunctionResponse, content_tag: str) -> str:
-    default_content = f"<{content_tag}>{sf_data.context_data}</{content_tag}>"
+    context = pack_context(sf_data.context_data) if CONTEXT_PACKING else sf_data.context_data
+    default_content = f"<{content_tag}>{context}</{content_tag}>"
     if sf_data.system_chain_data:
         system_chain_prompt, operation = sf_data.system_chain_data.system_chain_prompt, sf_data.system_chain_data.operation
         if operation == "APPEND":
@@ -167,28 +335,143 @@ def sf_build_chain_content(system: str, sf_data: StepFunctionResponse, content_t
         return f"{system}\n\n{default_content}"
 
 
-async def bedrock_stream(bedrock_params):
-    try:
+# Same content as sf_build_chain_content, split in the static system prompt and the workflow output. REPLACE_TAG
+# leaves the tag empty in the static part and sends the filled tag after it, so the static part can be cached.
+def sf_build_chain_parts(system: str, sf_data: StepFunctionResponse, content_tag: str) -> Tuple[str, str]:
+    context = pack_context(sf_data.context_data) if CONTEXT_PACKING else sf_data.context_data
+    default_content = f"<{content_tag}>{context}</{content_tag}>"
+    if sf_data.system_chain_data:
+        system_chain_prompt, operation = sf_data.system_chain_data.system_chain_prompt, sf_data.system_chain_data.operation
+        if operation == "APPEND":
+            return system, f"{default_content}\n\n{system_chain_prompt}"
+
+        elif operation == "REPLACE_TAG":
+            replace_tag = sf_data.system_chain_data.configuration.replace_tag
+            return system, f"<{replace_tag}>{system_chain_prompt}</{replace_tag}>\n\n{default_content}"
+
+        elif operation == "REPLACE_ALL":
+            return "", f"{system_chain_prompt}\n\n{default_content}"
+
+    return system, default_content
+
+
+# Response events of the messages API stream, see stream_events for the event types
+async def bedrock_stream(bedrock_params, timer=None, context_summary=None, admission_ticket=None):
+    # The request and the EventStream reads are blocking, so both run in a stream_bridge worker thread
+    def open_stream():
         response = bedrock_boto_client.invoke_model_with_response_stream(
             body=to_json(bedrock_params, exclude=["modelId"]),
             modelId=bedrock_params.modelId,
         )
-    except Exception as e:
-        yield str(e)
-    else:
-        for event in response.get("body"):
+        return response.get("body")
+
+    if context_summary is not None:
+        yield "context", context_summary
+
+    usage_event = {"input_tokens": None, "output_tokens": None, "cache_read_tokens": 0, "cache_write_tokens": 0,
+                   "latency_ms": None, "replayed": False}
+    stop_reason = None
+    streamed_chars = 0
+    replayed = False
+    try:
+        if response_fanout is not None:
+            model_events, replayed = response_fanout.subscribe(
+                request_fingerprint(bedrock_params.model_dump(mode="json")), lambda: iterate_in_thread(open_stream)
+            )
+            usage_event["replayed"] = replayed
+            if replayed and timer:
+                timer.count("fanout.replayed", 1)
+        else:
+            model_events = iterate_in_thread(open_stream)
+
+        async for event in model_events:
             chunk = json.loads(event["chunk"]["bytes"])
+            if chunk["type"] == "message_start" and "usage" in chunk.get("message", {}):
+                usage = chunk["message"]["usage"]
+                prompt_cache = cache_usage(usage)
+                usage_event.update(input_tokens=usage.get("input_tokens"), **prompt_cache)
+                logger.info(f"Input tokens: {usage.get('input_tokens')}, "
+                            f"Cache read tokens: {prompt_cache['cache_read_tokens']}, "
+                            f"Cache write tokens: {prompt_cache['cache_write_tokens']}")
+                # The tokens of a replayed generation were counted by the request that started it
+                if timer and not replayed:
+                    timer.count("model.input_tokens", usage.get("input_tokens"))
+                    timer.count("model.cache_read_tokens", prompt_cache["cache_read_tokens"])
+                    timer.count("model.cache_write_tokens", prompt_cache["cache_write_tokens"])
+            if chunk["type"] == "message_delta":
+                stop_reason = chunk.get("delta", {}).get("stop_reason")
+                usage_event["output_tokens"] = chunk.get("usage", {}).get("output_tokens")
+                if timer and not replayed:
+                    timer.count("model.output_tokens", usage_event["output_tokens"])
+            if chunk["type"] == "message_stop":
+                # Bedrock adds the invocation metrics to the last chunk
+                invocation_metrics = chunk.get("amazon-bedrock-invocationMetrics", {})
+                usage_event["latency_ms"] = invocation_metrics.get("invocationLatency")
+                if admission_ticket:
+                    admission_ticket.settle(
+                        0 if replayed else (usage_event["input_tokens"] or 0) + (usage_event["output_tokens"] or 0)
+                    )
             if chunk["type"] == "content_block_delta":
                 if chunk["delta"]["type"] == "text_delta":
-                    yield chunk["delta"]["text"]
+                    if timer:
+                        timer.token()
+                    streamed_chars += len(chunk["delta"]["text"])
+                    yield content_event(chunk["delta"]["text"])
+        yield "usage", usage_event
+        yield "stop", {"stop_reason": stop_reason}
+        if timer:
+            timer.mark("total")
+            telemetry.emit(timer, "/bedrock_claude_messages_api", model_id=bedrock_params.modelId, outcome="ok")
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client went away: iterate_in_thread closed the Bedrock stream, or the shared generation goes on for
+        # the other requests reading it
+        logger.info(f"Client disconnected after {streamed_chars} characters, Bedrock stream closed")
+        if timer:
+            if not replayed:
+                count_disconnect(timer, streamed_chars, bedrock_params.max_tokens)
+            telemetry.emit(timer, "/bedrock_claude_messages_api", model_id=bedrock_params.modelId,
+                           outcome="client_disconnected")
+        raise
+    except Exception as e:
+        if timer:
+            telemetry.emit(timer, "/bedrock_claude_messages_api", model_id=bedrock_params.modelId, outcome="error",
+                           error_type=type(e).__name__)
+        yield error_event(e)
+    finally:
+        if admission_ticket:
+            admission_ticket.release()
+
+
+# Response to a request that was not admitted, with the status and Retry-After of the rejection
+def admission_rejected_response(error: AdmissionRejected, stream_format: str) -> Response:
+    return Response(
+        encode_event(stream_format, error_event(error)),
+        status_code=error.status_code,
+        media_type=MEDIA_TYPES[stream_format],
+        headers={"Retry-After": str(error.retry_after)}
+    )
 
 
 @app.post("/bedrock_claude_messages_api")
 async def execute_chain(
+        request: Request,
         bedrock_parameters: BedrockClaudeMessagesAPIRequest,
         assistant_parameters: AssistantParameters,
 ):
+    timer = StageTimer(started=getattr(request.state, "received_at", None))
+    timer.mark("request_parse")
+    admission_ticket = None
+    # Set once the response's background task and stream release the ticket
+    ticket_handed_over = False
+    bedrock_warm_up = None
     try:
+        if REQUEST_PIPELINING:
+            # Open the Bedrock connection while the workflow is running
+            bedrock_warm_up = asyncio.ensure_future(timer.measure(
+                "bedrock_warm_up",
+                asyncio.to_thread(warm_up_connection, bedrock_boto_client)
+            ))
+
         # Filter the number of message history to be sent to the workflow
         messages = (
             bedrock_parameters.messages[-assistant_parameters.messages_to_sample:]
@@ -196,26 +479,91 @@ async def execute_chain(
             else bedrock_parameters.messages
         )
 
+        # Fit the workflow input and the model history to their token budgets. One manager per request, so every
+        # message is estimated once.
+        history_manager = HistoryManager()
+        with timer.stage("history_window"):
+            workflow_history = history_manager.window(messages, WORKFLOW_HISTORY_TOKEN_BUDGET)
+            model_history = history_manager.window(
+                bedrock_parameters.messages,
+                assistant_parameters.history_token_budget or HISTORY_TOKEN_BUDGET
+            )
+        messages = workflow_history.messages
+        bedrock_parameters.messages = model_history.messages
+
         system = bedrock_parameters.system
+        if not isinstance(system, str):
+            system = "".join(block.get("text", "") for block in system)
         content_tag = assistant_parameters.content_tag
         custom_params = assistant_parameters.state_machine_custom_params
 
+        if admission_controller is not None:
+            # The workflow and the model stream run in the slot. Estimated tokens: the history and system prompt
+            # sent to the model and its maximum output.
+            estimated_tokens = (model_history.tokens + history_manager.estimator.text_tokens(system)
+                                + bedrock_parameters.max_tokens)
+            with timer.stage("admission"):
+                admission_ticket = await admission_controller.admit(DEFAULT_ACCOUNT, estimated_tokens)
+            timer.count("admission.queue_depth", admission_ticket.queue_depth)
+
         # Generate chain instructions and context prompt
-        chain_data = sf_build_context(
+        chain_data, context_summary = await sf_build_context(
             messages,
             system,
             content_tag,
-            custom_params
+            custom_params,
+            is_disconnected=request.is_disconnected,
+            timer=timer,
+            use_cache=not assistant_parameters.bypass_workflow_cache,
+            model_id=bedrock_parameters.modelId
         )
 
         # Update chain instructions and context
         bedrock_parameters.system = chain_data
-        return StreamingResponse(
-            bedrock_stream(bedrock_parameters),
-            media_type="text/plain; charset=utf-8"
+
+        if REQUEST_PIPELINING:
+            await bedrock_warm_up
+
+        stream_format = assistant_parameters.stream_format
+        response = StreamingResponse(
+            encode_stream(
+                bedrock_stream(bedrock_parameters, timer, context_summary, admission_ticket),
+                stream_format,
+                is_disconnected=request.is_disconnected
+            ),
+            media_type=MEDIA_TYPES[stream_format],
+            headers={
+                "Server-Timing": timer.server_timing(),
+                "X-History-Tokens-Saved": str(model_history.tokens_saved),
+                "X-Workflow-History-Tokens-Saved": str(workflow_history.tokens_saved),
+            },
+            # Frees the slot also when the client leaves before the stream starts
+            background=BackgroundTask(admission_ticket.release) if admission_ticket else None
         )
+        ticket_handed_over = True
+        return response
+
+    except AdmissionRejected as e:
+        timer.count("admission.rejected", 1)
+        telemetry.emit(timer, "/bedrock_claude_messages_api", model_id=bedrock_parameters.modelId,
+                       outcome="rejected")
+        return admission_rejected_response(e, assistant_parameters.stream_format)
+
+    except ClientDisconnected:
+        # Nobody is left to read the answer
+        telemetry.emit(timer, "/bedrock_claude_messages_api", model_id=bedrock_parameters.modelId,
+                       outcome="client_disconnected")
+        return Response(status_code=499)
 
     except Exception as e:
+        # Failures before the stream started, e.g. of the workflow
+        telemetry.emit(timer, "/bedrock_claude_messages_api", model_id=bedrock_parameters.modelId,
+                       outcome="error", error_type=type(e).__name__)
+        if assistant_parameters.stream_format != "text":
+            return Response(
+                encode_event(assistant_parameters.stream_format, error_event(e)),
+                media_type=MEDIA_TYPES[assistant_parameters.stream_format]
+            )
         error_message = str(e) + "\n\nRequest content:"
         error_message += f"bedrock_parameters: {bedrock_parameters}"
         error_message += f"\nassistant_parameters: {assistant_parameters}"
@@ -223,3 +571,11 @@ async def execute_chain(
             error_message,
             media_type="text/plain; charset=utf-8"
         )
+
+    finally:
+        # Also on cancellation, or any error before the response took the ticket
+        if admission_ticket and not ticket_handed_over:
+            admission_ticket.release()
+        # The request ended before the model call, e.g. on an error or a disconnect
+        if bedrock_warm_up is not None and not bedrock_warm_up.done():
+            bedrock_warm_up.cancel()
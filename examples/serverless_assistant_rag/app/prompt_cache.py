@@ -0,0 +1,53 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+from os import environ
+from typing import Dict, List, Optional
+
+from history_manager import TokenEstimator
+
+# Bedrock prompt caching of the static part of the system prompt. Set to "false" to send the prompt as one block.
+PROMPT_CACHING = environ.get("PROMPT_CACHING", "true").lower() == "true"
+
+# Models reject cache checkpoints on shorter prefixes (1024 tokens for Claude Sonnet, 2048 for Claude Haiku)
+PROMPT_CACHE_MIN_TOKENS = int(environ.get("PROMPT_CACHE_MIN_TOKENS", "1024"))
+
+# Model ID fragments of the models that support prompt caching, also matched in inference profile IDs
+PROMPT_CACHE_MODELS = [
+    model.strip() for model in environ.get(
+        "PROMPT_CACHE_MODELS",
+        "anthropic.claude-3-7-sonnet,anthropic.claude-3-5-haiku,anthropic.claude-sonnet-4,anthropic.claude-opus-4,"
+        "amazon.nova"
+    ).split(",") if model.strip()
+]
+
+
+def use_prompt_cache(model_id: str, static_prefix: str, estimator: Optional[TokenEstimator] = None) -> bool:
+    """Whether a cache checkpoint can be placed after static_prefix for this model."""
+    if not PROMPT_CACHING or not static_prefix or not any(model in model_id for model in PROMPT_CACHE_MODELS):
+        return False
+    return (estimator or TokenEstimator()).text_tokens(static_prefix) >= PROMPT_CACHE_MIN_TOKENS
+
+
+def converse_system_blocks(static_prefix: str, dynamic_suffix: str) -> List[dict]:
+    """Converse API system blocks with a cache checkpoint between the static prefix and the dynamic suffix."""
+    blocks = [{"text": static_prefix}, {"cachePoint": {"type": "default"}}]
+    if dynamic_suffix:
+        blocks.append({"text": dynamic_suffix})
+    return blocks
+
+
+def messages_api_system_blocks(static_prefix: str, dynamic_suffix: str) -> List[dict]:
+    """Anthropic Claude messages API system blocks, the static prefix marked as cacheable."""
+    blocks = [{"type": "text", "text": static_prefix, "cache_control": {"type": "ephemeral"}}]
+    if dynamic_suffix:
+        blocks.append({"type": "text", "text": dynamic_suffix})
+    return blocks
+
+
+def cache_usage(usage: dict) -> Dict[str, int]:
+    """Cache read and write token counts of a converse metadata or messages API message_start usage."""
+    return {
+        "cache_read_tokens": usage.get("cacheReadInputTokens", usage.get("cache_read_input_tokens")) or 0,
+        "cache_write_tokens": usage.get("cacheWriteInputTokens", usage.get("cache_creation_input_tokens")) or 0,
+    }
@@ -0,0 +1,165 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import threading
+import time
+from os import environ
+from typing import TYPE_CHECKING, Any, Callable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+SEMANTIC_CACHE_EMBEDDING_MODEL_ID = environ.get("SEMANTIC_CACHE_EMBEDDING_MODEL_ID", "amazon.titan-embed-text-v2:0")
+SEMANTIC_CACHE_DIMENSIONS = int(environ.get("SEMANTIC_CACHE_DIMENSIONS", "512"))
+# Minimum cosine similarity between two questions to reuse the documents retrieved for the cached one
+SEMANTIC_CACHE_THRESHOLD = float(environ.get("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "10000"))
+SEMANTIC_CACHE_TTL_SECONDS = float(environ.get("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+# Messages of the conversation embedded with the question: the previous question, its answer and the question
+SEMANTIC_CACHE_HISTORY_MESSAGES = int(environ.get("SEMANTIC_CACHE_HISTORY_MESSAGES", "3"))
+
+
+def _numpy():
+    # numpy is only needed once the cache is used, it is not in requirements.txt by default
+    try:
+        import numpy
+    except ImportError as e:
+        raise ImportError("The semantic cache needs numpy, uncomment it in requirements.txt") from e
+    return numpy
+
+
+class VectorIndex:
+    """Fixed capacity ring buffer of unit float32 vectors searched by cosine similarity.
+
+    When full, a new entry overwrites the oldest one. Entries older than ttl are skipped by search.
+    Vectors are partitioned by namespace so results of different workflows never mix.
+    The max_entries x dimensions array is allocated by the first add.
+    """
+
+    def __init__(
+            self,
+            dimensions: int = SEMANTIC_CACHE_DIMENSIONS,
+            max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+            ttl: float = SEMANTIC_CACHE_TTL_SECONDS
+    ):
+        self.dimensions = dimensions
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.vectors = None
+        self.created_at = None
+        self.namespaces = None
+        self.payloads: List[Any] = []
+        self._namespace_ids = {}
+        self._next_slot = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _allocate(self) -> None:
+        np = _numpy()
+        self.vectors = np.zeros((self.max_entries, self.dimensions), dtype=np.float32)
+        self.created_at = np.full(self.max_entries, -np.inf)
+        self.namespaces = np.full(self.max_entries, -1, dtype=np.int32)
+        self.payloads = [None] * self.max_entries
+
+    @staticmethod
+    def _unit(vector) -> "np.ndarray":
+        np = _numpy()
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def add(self, namespace: str, vector, payload: Any, created_at: Optional[float] = None) -> None:
+        with self._lock:
+            if self.vectors is None:
+                self._allocate()
+            slot = self._next_slot
+            self.vectors[slot] = self._unit(vector)
+            self.created_at[slot] = time.time() if created_at is None else created_at
+            self.namespaces[slot] = self._namespace_ids.setdefault(namespace, len(self._namespace_ids))
+            self.payloads[slot] = payload
+            self._next_slot = (slot + 1) % self.max_entries
+            self._size = min(self._size + 1, self.max_entries)
+
+    def search(self, namespace: str, vector, k: int = 1, threshold: float = -1.0) -> List[Tuple[float, Any]]:
+        """Return up to k (similarity, payload) pairs above threshold, most similar first."""
+        with self._lock:
+            namespace_id = self._namespace_ids.get(namespace)
+            if namespace_id is None or self._size == 0:
+                return []
+            size = self._size
+            scores = self.vectors[:size] @ self._unit(vector)
+            stale = (self.namespaces[:size] != namespace_id) | (self.created_at[:size] < time.time() - self.ttl)
+            np = _numpy()
+            scores[stale] = -np.inf
+
+            k = min(k, size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(float(scores[slot]), self.payloads[slot]) for slot in top if scores[slot] >= threshold]
+
+    def __len__(self):
+        return self._size
+
+
+def bedrock_text_embedder(
+        bedrock_client,
+        model_id: str = SEMANTIC_CACHE_EMBEDDING_MODEL_ID,
+        dimensions: int = SEMANTIC_CACHE_DIMENSIONS
+) -> Callable[[str], "np.ndarray"]:
+    """Embed text with an Amazon Titan Text Embeddings V2 model."""
+    def embed(text: str) -> "np.ndarray":
+        np = _numpy()
+        response = bedrock_client.invoke_model(
+            modelId=model_id,
+            body=json.dumps({"inputText": text, "dimensions": dimensions, "normalize": True})
+        )
+        return np.asarray(json.loads(response["body"].read())["embedding"], dtype=np.float32)
+    return embed
+
+
+def _message_text(message: dict) -> str:
+    content = message.get("content")
+    if isinstance(content, str):
+        return content
+    return " ".join(block.get("text", "") for block in content if isinstance(block, dict))
+
+
+def conversation_text(messages: List[dict], max_messages: int = SEMANTIC_CACHE_HISTORY_MESSAGES) -> str:
+    """Text embedded for a request: the last user message, preceded by the messages before it in the window.
+
+    The retrieval query of a follow-up question depends on the previous turns, so they are part of the key. A single
+    turn request is embedded as the bare question.
+    """
+    end = next((i + 1 for i in range(len(messages) - 1, -1, -1) if messages[i].get("role") == "user"), 0)
+    window = messages[max(0, end - max(1, max_messages)):end]
+    if len(window) <= 1:
+        return _message_text(window[0]) if window else ""
+    return "\n".join(f"{message.get('role')}: {_message_text(message)}" for message in window)
+
+
+class SemanticRetrievalCache:
+    """Reuses the documents retrieved for a previous question when a new question is close enough to it."""
+
+    def __init__(self, embed: Callable[[str], "np.ndarray"], index: VectorIndex, threshold: float = SEMANTIC_CACHE_THRESHOLD):
+        self.embed = embed
+        self.index = index
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, namespace: str, question: str) -> Tuple[Optional["np.ndarray"], Optional[List]]:
+        """Return the question embedding and the cached documents of the most similar question, if any."""
+        embedding = self.embed(question)
+        matches = self.index.search(namespace, embedding, k=1, threshold=self.threshold)
+        if matches:
+            self.hits += 1
+            return embedding, matches[0][1]
+        self.misses += 1
+        return embedding, None
+
+    def store(self, namespace: str, embedding: "np.ndarray", documents: List) -> None:
+        self.index.add(namespace, embedding, documents)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.index)}
@@ -0,0 +1,93 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+from typing import AsyncIterator, Callable, Iterable, TypeVar
+
+T = TypeVar("T")
+
+logger = logging.getLogger()
+
+# Number of events buffered between the boto3 reader thread and the response. When the client reads slower
+# than Bedrock produces, the reader thread blocks instead of growing memory without bound.
+STREAM_QUEUE_SIZE = int(environ.get("STREAM_QUEUE_SIZE", "64"))
+
+# Upper bound of streams read concurrently by one process. The default asyncio executor is sized by CPU count,
+# which is far below the number of idle, network bound streams a single worker can hold.
+STREAM_MAX_WORKERS = int(environ.get("STREAM_MAX_WORKERS", "128"))
+
+_stream_executor = ThreadPoolExecutor(max_workers=STREAM_MAX_WORKERS, thread_name_prefix="bedrock-stream")
+_END_OF_STREAM = object()
+
+
+def close_stream(stream) -> None:
+    """Close a botocore EventStream, dropping its HTTP connection so Bedrock stops generating."""
+    close = getattr(stream, "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception as e:
+            logger.debug(f"Closing stream failed: {str(e)}")
+
+
+async def iterate_in_thread(
+        open_stream: Callable[[], Iterable[T]],
+        queue_size: int = STREAM_QUEUE_SIZE
+) -> AsyncIterator[T]:
+    """Open and consume a blocking stream in a worker thread, yielding its items on the event loop.
+
+    When the consumer stops early (client disconnect, cancellation) the stream is closed instead of being read to
+    the end.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    stopped = threading.Event()
+    finished = threading.Event()
+    opened = []
+
+    def put(item) -> bool:
+        if stopped.is_set():
+            return False
+        # Blocks the reader thread while the queue is full (back-pressure)
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+        return not stopped.is_set()
+
+    def read_stream():
+        stream = None
+        try:
+            stream = open_stream()
+            opened.append(stream)
+            for item in stream:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((_END_OF_STREAM, e))
+        else:
+            put((_END_OF_STREAM, None))
+        finally:
+            finished.set()
+            # Also covers a consumer that stopped while the stream was being opened
+            if stopped.is_set():
+                close_stream(stream)
+
+    loop.run_in_executor(_stream_executor, read_stream)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _END_OF_STREAM:
+                if error is not None:
+                    raise error
+                break
+            yield item
+    finally:
+        stopped.set()
+        # Interrupt a reader waiting for the next event instead of letting it drain the stream
+        if opened and not finished.is_set():
+            close_stream(opened[0])
+        # Release a reader blocked on a full queue so the worker thread returns to the pool
+        while not queue.empty():
+            queue.get_nowait()
@@ -67,6 +67,8 @@ def stream_bedrock_response():
             "messages_to_sample": messages_to_sample,
             "content_tag": "document",
             "state_machine_custom_params": {"hello": "state_machine"},
+            # One JSON event per line: content, context, usage, stop or error
+            "stream_format": "ndjson",
         },
     }
 
@@ -74,11 +76,19 @@ def stream_bedrock_response():
 
     if response.status_code == 200:
         bot_response = ""
-        for chunk in response.iter_content(chunk_size=256):
-            if chunk:
-                new_content = chunk.decode()
-                bot_response += new_content
-                yield new_content  # Yield only the new content
+        for line in response.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["type"] == "content":
+                bot_response += event["text"]
+                yield event["text"]  # Yield only the new content
+            elif event["type"] == "context" and event.get("sources"):
+                st.session_state.sources = event["sources"]
+            elif event["type"] == "usage":
+                st.session_state.usage = event
+            elif event["type"] == "error":
+                yield f"\n\nError: {event['message']}"
         return bot_response  # Return the complete bot response
     else:
         yield "An error occurred while processing the response"
@@ -140,3 +150,10 @@ if prompt := st.chat_input("Prompt"):
     st.session_state.messages.append(
         {"role": "assistant", "content": assistant_response}
     )
+
+    # Sources and token usage reported by the stream events
+    if st.session_state.get("sources"):
+        st.sidebar.caption("Sources: " + ", ".join(st.session_state.pop("sources")))
+    if st.session_state.get("usage"):
+        usage = st.session_state.pop("usage")
+        st.sidebar.caption(f"Tokens: {usage['input_tokens']} in, {usage['output_tokens']} out")
@@ -0,0 +1,39 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Unit tests of the example apps. The apps are not packages: like run.sh does in Lambda, the app directories are put
+# on sys.path. The modules both apps have are identical copies, they are imported from the web application, the RAG
+# app directory comes last for the modules only it has. load_app_module() imports a module that differs between the
+# apps under a name of its own.
+#
+#   python -m pytest tests
+
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from apps import APP_ENV, APP_PATHS  # noqa: E402
+
+for key, value in APP_ENV.items():
+    os.environ.setdefault(key, value)
+for path in reversed(APP_PATHS["web"]):
+    sys.path.insert(0, str(path))
+sys.path.extend(str(path) for path in APP_PATHS["rag"])
+
+
+def load_app_module(app_name, module_name):
+    """Module `module_name` of the `rag` or `web` app, imported as `<app_name>_<module_name>`."""
+    name = f"{app_name}_{module_name}"
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, APP_PATHS[app_name][0] / f"{module_name}.py")
+        sys.modules[name] = importlib.util.module_from_spec(spec)
+        try:
+            spec.loader.exec_module(sys.modules[name])
+        except BaseException:
+            del sys.modules[name]
+            raise
+    return sys.modules[name]
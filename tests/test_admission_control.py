@@ -0,0 +1,147 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import asyncio
+
+import pytest
+
+from admission_control import AdmissionController, AdmissionRejected, TokenBucket
+
+
+def test_bucket_refills_up_to_its_capacity():
+    bucket = TokenBucket(rate=2, capacity=10, now=0)
+    bucket.take(10, now=0)
+    assert bucket.wait_time(4, now=0) == 2
+    assert bucket.wait_time(4, now=1) == 1
+    assert bucket.wait_time(4, now=2) == 0
+    assert not bucket.full(now=4)
+    assert bucket.full(now=100)
+    assert bucket.level == 10
+
+
+def test_bucket_debt_delays_the_next_request():
+    bucket = TokenBucket(rate=1, capacity=5, now=0)
+    bucket.take(8, now=0)
+    assert bucket.level == -3
+    assert bucket.wait_time(1, now=0) == 4
+
+
+def test_request_larger_than_the_bucket_waits_for_a_full_one():
+    bucket = TokenBucket(rate=1, capacity=5, now=0)
+    bucket.take(3, now=0)
+    assert bucket.wait_time(50, now=0) == 3
+
+
+def test_give_back_is_capped_by_the_capacity():
+    bucket = TokenBucket(rate=1, capacity=5, now=0)
+    bucket.take(2, now=0)
+    bucket.give_back(10, now=0)
+    assert bucket.level == 5
+
+
+def admission_order(requests, weights=None):
+    """Names of the `(name, account, tokens)` requests in the order they get the only slot, queued in list order
+    behind a request that holds it."""
+    async def run():
+        controller = AdmissionController(requests_per_minute=0, tokens_per_minute=0, max_concurrency=1,
+                                         max_wait_seconds=5, weights=weights or {})
+        holder = await controller.admit("holder", 1)
+        order = []
+
+        async def request(name, account_id, tokens):
+            ticket = await controller.admit(account_id, tokens)
+            order.append(name)
+            await asyncio.sleep(0)
+            ticket.release()
+
+        tasks = []
+        for name, account_id, tokens in requests:
+            tasks.append(asyncio.create_task(request(name, account_id, tokens)))
+            await asyncio.sleep(0)
+        assert controller.waiting == len(requests)
+        holder.release()
+        await asyncio.gather(*tasks)
+        assert controller.stats()["running"] == 0
+        return order
+
+    return asyncio.run(run())
+
+
+def test_accounts_take_turns_for_the_slots():
+    requests = [("a1", "a", 100), ("a2", "a", 100), ("a3", "a", 100), ("b1", "b", 100), ("b2", "b", 100)]
+    assert admission_order(requests) == ["a1", "b1", "a2", "b2", "a3"]
+
+
+def test_large_requests_push_back_their_own_account_only():
+    requests = [("a1", "a", 1000), ("a2", "a", 1000), ("b1", "b", 100), ("b2", "b", 100), ("b3", "b", 100)]
+    assert admission_order(requests) == ["b1", "b2", "b3", "a1", "a2"]
+
+
+def test_weights_share_the_slots():
+    requests = [("a1", "a", 100), ("a2", "a", 100), ("a3", "a", 100), ("a4", "a", 100),
+                ("b1", "b", 100), ("b2", "b", 100)]
+    assert admission_order(requests, weights={"a": 2}) == ["a1", "a2", "b1", "a3", "a4", "b2"]
+
+
+def test_account_over_its_rate_is_rejected_with_429():
+    async def run():
+        controller = AdmissionController(requests_per_minute=60, tokens_per_minute=0, burst_seconds=1,
+                                         max_wait_seconds=0.5)
+        (await controller.admit("a", 10)).release()
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.admit("a", 10)
+        # Other accounts have buckets of their own
+        (await controller.admit("b", 10)).release()
+        return controller, rejected.value
+
+    controller, rejected = asyncio.run(run())
+    assert (rejected.status_code, rejected.reason, rejected.retry_after) == (429, "rate_limited", 1)
+    assert controller.stats()["rejected"] == {"rate_limited": 1}
+
+
+def test_wait_timeout_is_rejected_with_503_and_gives_the_tokens_back():
+    async def run():
+        controller = AdmissionController(requests_per_minute=0, tokens_per_minute=600, burst_seconds=10,
+                                         max_concurrency=1, max_wait_seconds=0.05)
+        holder = await controller.admit("a", 10)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.admit("b", 50)
+        holder.release()
+        return controller, rejected.value
+
+    controller, rejected = asyncio.run(run())
+    assert (rejected.status_code, rejected.reason) == (503, "wait_timeout")
+    assert controller._accounts["b"].tokens.level == pytest.approx(100, abs=1)
+    assert controller.stats()["waiting"] == controller.stats()["running"] == 0
+
+
+def test_full_queue_is_rejected_with_503():
+    async def run():
+        controller = AdmissionController(requests_per_minute=0, tokens_per_minute=0, max_concurrency=1, max_queue=1,
+                                         max_wait_seconds=5)
+        holder = await controller.admit("a", 1)
+        queued = asyncio.create_task(controller.admit("b", 1))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.admit("c", 1)
+        holder.release()
+        (await queued).release()
+        return rejected.value
+
+    rejected = asyncio.run(run())
+    assert (rejected.status_code, rejected.reason) == (503, "queue_full")
+
+
+def test_settle_gives_back_the_unused_tokens():
+    async def run():
+        controller = AdmissionController(requests_per_minute=0, tokens_per_minute=600, burst_seconds=10)
+        ticket = await controller.admit("a", 80)
+        ticket.settle(30)
+        ticket.settle(0)
+        ticket.release()
+        ticket.release()
+        return controller
+
+    controller = asyncio.run(run())
+    assert controller._accounts["a"].tokens.level == pytest.approx(70, abs=1)
+    assert controller.stats()["running"] == 0
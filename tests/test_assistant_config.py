@@ -0,0 +1,89 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import importlib.util
+import threading
+
+import pytest
+
+from conftest import ROOT
+
+spec = importlib.util.spec_from_file_location(
+    "assistant_config", ROOT / "examples" / "sample_web_application" / "assistant_config.py"
+)
+assistant_config = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(assistant_config)
+
+TABLE = assistant_config.table_name
+
+
+def item(account, item_type, **attributes):
+    return {"id": {"S": f"account#{account}"}, "item_type": {"S": item_type},
+            **{name: {"S": value} for name, value in attributes.items()}}
+
+
+class FakeDynamoDB:
+    """batch_write_item stores the items, leaving `unprocessed` of each of the first `throttled_calls` requests."""
+
+    def __init__(self, throttled_calls=0, unprocessed=1):
+        self.throttled_calls = throttled_calls
+        self.unprocessed = unprocessed
+        self.requests = []
+        self.table = {}
+        self._lock = threading.Lock()
+
+    def batch_write_item(self, RequestItems):
+        requests = RequestItems[TABLE]
+        keys = [assistant_config.item_key(request["PutRequest"]["Item"]) for request in requests]
+        if len(set(keys)) != len(keys):
+            raise ValueError("ValidationException: Provided list of item keys contains duplicates")
+        with self._lock:
+            self.requests.append(len(requests))
+            throttled = len(self.requests) <= self.throttled_calls
+        written, unprocessed = (requests[self.unprocessed:], requests[:self.unprocessed]) if throttled else (requests, [])
+        with self._lock:
+            for request in written:
+                put = request["PutRequest"]["Item"]
+                self.table[assistant_config.item_key(put)] = put
+        return {"UnprocessedItems": {TABLE: unprocessed} if unprocessed else {}}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(assistant_config, "BATCH_WRITE_BASE_DELAY_SECONDS", 0)
+
+
+def test_chunks_have_distinct_keys_and_the_last_item_wins():
+    items = [item("a", "workflow#details#1", name="old"), item("a", "account#details"),
+             item("a", "workflow#details#1", name="new")]
+    chunk, = assistant_config.chunk_items(items)
+    assert [assistant_config.item_key(entry) for entry in chunk] == [("account#a", "account#details"),
+                                                                     ("account#a", "workflow#details#1")]
+    assert chunk[1]["name"]["S"] == "new"
+
+
+def test_duplicates_do_not_shorten_chunks():
+    items = [item("a", f"workflow#details#{i % 30}") for i in range(60)]
+    assert [len(chunk) for chunk in assistant_config.chunk_items(items)] == [25, 25, 10]
+
+
+def test_unprocessed_items_are_retried():
+    dynamodb = FakeDynamoDB(throttled_calls=2, unprocessed=3)
+    assert assistant_config.batch_write_chunk(dynamodb, [item("a", str(i)) for i in range(10)]) == 10
+    assert dynamodb.requests == [10, 3, 3]
+    assert len(dynamodb.table) == 10
+
+
+def test_unprocessed_items_fail_after_the_last_attempt():
+    dynamodb = FakeDynamoDB(throttled_calls=assistant_config.BATCH_WRITE_MAX_ATTEMPTS, unprocessed=2)
+    with pytest.raises(RuntimeError, match="2 items still unprocessed"):
+        assistant_config.batch_write_chunk(dynamodb, [item("a", str(i)) for i in range(5)])
+
+
+def test_bulk_import_keeps_the_last_item_of_a_key():
+    items = [item(str(i % 40), "account#details", version=str(i)) for i in range(400)]
+    dynamodb = FakeDynamoDB(throttled_calls=5)
+    stats = assistant_config.bulk_import(dynamodb, items, workers=4, report_every=0)
+    assert stats["items"] == 400
+    assert len(dynamodb.table) == 40
+    assert all(dynamodb.table[(f"account#{i}", "account#details")]["version"]["S"] == str(360 + i) for i in range(40))
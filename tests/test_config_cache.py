@@ -0,0 +1,135 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import pytest
+
+from assistant_config_interface import data_manager
+from assistant_config_interface.data_manager import ConfigCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(data_manager.time, "monotonic", clock)
+    return clock
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = ConfigCache(ttl=60, negative_ttl=10)
+    cache.put("a", "workflow#details#1", {"name": "w"})
+    clock.now += 59
+    assert cache.get("a", "workflow#details#1") == (True, {"name": "w"})
+    clock.now += 1
+    assert cache.get("a", "workflow#details#1") == (False, None)
+    assert cache.stats()["size"] == 0
+
+
+def test_missing_items_use_the_negative_ttl(clock):
+    cache = ConfigCache(ttl=60, negative_ttl=10)
+    cache.put("a", "workflow#details#404", {})
+    clock.now += 9
+    assert cache.get("a", "workflow#details#404") == (True, {})
+    clock.now += 1
+    assert cache.get("a", "workflow#details#404") == (False, None)
+
+
+def test_negative_ttl_is_capped_by_ttl(clock):
+    cache = ConfigCache(ttl=5, negative_ttl=10)
+    cache.put("a", "account#details", [])
+    clock.now += 5
+    assert cache.get("a", "account#details") == (False, None)
+
+
+def test_zero_ttl_disables_the_cache(clock):
+    cache = ConfigCache(ttl=0)
+    cache.put("a", "account#details", [{"name": "x"}])
+    assert cache.get("a", "account#details") == (False, None)
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = ConfigCache(ttl=60, max_items=2)
+    cache.put("a", "1", [1])
+    cache.put("a", "2", [2])
+    cache.get("a", "1")
+    cache.put("a", "3", [3])
+    assert cache.get("a", "2") == (False, None)
+    assert cache.get("a", "1") == (True, [1])
+    assert cache.stats()["evictions"] == 1
+
+
+def test_hits_and_misses_are_counted(clock):
+    cache = ConfigCache(ttl=60)
+    cache.get("a", "1")
+    cache.put("a", "1", [1])
+    cache.get("a", "1")
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_invalidate_one_item_a_prefix_or_the_account(clock):
+    cache = ConfigCache(ttl=60)
+    for account in ("a", "b"):
+        for item_type in ("account#details", "workflow#details#1", "workflow#prompt#1#p1", "workflow#prompt#1#p2"):
+            cache.put(account, item_type, [item_type])
+
+    cache.invalidate("a", "account#details")
+    assert not cache.get("a", "account#details")[0]
+    assert cache.get("a", "workflow#details#1")[0]
+
+    cache.invalidate("a", item_type_prefix="workflow#prompt#1#")
+    assert not cache.get("a", "workflow#prompt#1#p1")[0]
+    assert not cache.get("a", "workflow#prompt#1#p2")[0]
+    assert cache.get("a", "workflow#details#1")[0]
+
+    cache.invalidate("a")
+    assert cache.stats()["size"] == 4
+    assert all(cache.get("b", item_type)[0] for item_type in ("account#details", "workflow#prompt#1#p2"))
+
+
+def test_membership_test_is_not_counted(clock):
+    cache = ConfigCache(ttl=60)
+    cache.put("a", "1", [1])
+    assert ("a", "1") in cache
+    assert ("a", "2") not in cache
+    clock.now += 60
+    assert ("a", "1") not in cache
+    assert cache.stats()["hits"] == cache.stats()["misses"] == 0
+
+
+class FakeDynamoDB:
+    def __init__(self, items):
+        self.items = items
+        self.batch_get_calls = 0
+
+    def batch_get_item(self, RequestItems):
+        self.batch_get_calls += 1
+        (table, request), = RequestItems.items()
+        keys = [key["item_type"]["S"] for key in request["Keys"]]
+        return {"Responses": {table: [self.items[key] for key in keys if key in self.items]}}
+
+
+def test_prefetch_counts_each_lookup_once(clock, monkeypatch):
+    cache = ConfigCache(ttl=60)
+    monkeypatch.setattr(data_manager, "config_cache", cache)
+    client = FakeDynamoDB({
+        "workflow#details#1": {"id": {"S": "account#a"}, "item_type": {"S": "workflow#details#1"},
+                               "arn": {"S": "arn:sm"}},
+    })
+    monkeypatch.setattr(data_manager, "_dynamodb_client", client)
+
+    for _ in range(2):
+        account = data_manager.AccountDataAccess({"custom:account_id": "a"})
+        account.prefetch(["workflow#details#1"])
+        assert account.get_workflow_details("workflow#details#1")["arn"] == "arn:sm"
+
+    assert client.batch_get_calls == 1
+    # The first lookup was answered by the prefetched snapshot, read from the table, the second one by the cache
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
@@ -0,0 +1,122 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import base64
+
+import pytest
+
+from assistant_config_interface import data_manager
+from assistant_config_interface.data_manager import ConfigCache, collect_pages, decode_cursor, encode_cursor
+
+WORKFLOW_IDS = ["1", "10", "11", "2", "3", "4", "5"]
+
+
+def item(account, item_type, **attributes):
+    return {"id": {"S": f"account#{account}"}, "item_type": {"S": item_type},
+            **{name: {"S": value} for name, value in attributes.items()}}
+
+
+class FakeDynamoDB:
+    """query with begins_with, Limit, ExclusiveStartKey and ProjectionExpression over items in table order. Like
+    DynamoDB, a page that reaches its Limit has a LastEvaluatedKey even when no item follows it."""
+
+    def __init__(self, items):
+        self.items = sorted(items, key=lambda entry: (entry["id"]["S"], entry["item_type"]["S"].encode()))
+        self.queries = []
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues,
+              Limit=None, ExclusiveStartKey=None, ProjectionExpression=None):
+        self.queries.append({"Limit": Limit, "ExclusiveStartKey": ExclusiveStartKey})
+        account = ExpressionAttributeValues[":id"]["S"]
+        prefix = ExpressionAttributeValues.get(":item_type_prefix", {"S": ""})["S"]
+        items = [entry for entry in self.items
+                 if entry["id"]["S"] == account and entry["item_type"]["S"].startswith(prefix)]
+        if ExclusiveStartKey:
+            start = ExclusiveStartKey["item_type"]["S"].encode()
+            items = [entry for entry in items if entry["item_type"]["S"].encode() > start]
+        page = items[:Limit] if Limit else items
+        if ProjectionExpression:
+            names = [ExpressionAttributeNames[name] for name in ProjectionExpression.split(",")]
+            page = [{name: entry[name] for name in names if name in entry} for entry in page]
+        response = {"Items": page}
+        if Limit and len(page) == Limit:
+            response["LastEvaluatedKey"] = {"id": page[-1]["id"], "item_type": page[-1]["item_type"]}
+        return response
+
+
+@pytest.fixture
+def client(monkeypatch):
+    items = [item("a", "account#details", name="a")]
+    items += [item(account, f"workflow#details#{workflow_id}", name=f"{account}-{workflow_id}", arn="arn:sm")
+              for account in ("a", "b") for workflow_id in WORKFLOW_IDS]
+    client = FakeDynamoDB(items)
+    monkeypatch.setattr(data_manager, "_dynamodb_client", client)
+    monkeypatch.setattr(data_manager, "config_cache", ConfigCache(ttl=60))
+    return client
+
+
+def account(account_id="a"):
+    return data_manager.AccountDataAccess({"custom:account_id": account_id})
+
+
+def list_all(account_data, limit, page_size=None):
+    """Follow the cursors of `limit` item pages until the listing is exhausted."""
+    pages, cursor = [], None
+    while True:
+        items, cursor = collect_pages(account_data.iter_workflow_pages(limit=limit, cursor=cursor, page_size=page_size))
+        pages.append([entry["name"] for entry in items])
+        if cursor is None:
+            return pages
+
+
+def test_cursor_round_trip():
+    key = {"id": "account#a", "item_type": "workflow#details#ü/+"}
+    cursor = encode_cursor(key)
+    assert decode_cursor(cursor) == key
+    assert "+" not in cursor and "/" not in cursor
+    assert encode_cursor(None) is None
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor",
+    base64.urlsafe_b64encode(b"[1, 2]").decode(),
+    base64.urlsafe_b64encode(b'{"id": "account#a"}').decode(),
+])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize("key", [
+    {"id": "account#b", "item_type": "workflow#details#1"},
+    {"id": "account#a", "item_type": "account#details"},
+])
+def test_cursor_of_another_account_or_listing_is_rejected(client, key):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        list(account().iter_workflow_pages(limit=2, cursor=encode_cursor(key)))
+
+
+@pytest.mark.parametrize("page_size", [None, 2])
+@pytest.mark.parametrize("limit", [1, 3, 7, 100])
+def test_cursors_walk_every_item_once(client, limit, page_size):
+    pages = list_all(account(), limit, page_size)
+    assert [name for page in pages for name in page] == [f"a-{workflow_id}" for workflow_id in WORKFLOW_IDS]
+    assert all(len(page) <= limit for page in pages)
+
+
+def test_snapshot_pages_match_query_pages(client):
+    queried = list_all(account(), limit=3)
+
+    snapshot_account = account()
+    snapshot_account.load_snapshot("workflow#details#")
+    client.queries.clear()
+    from_snapshot = list_all(snapshot_account, limit=3)
+
+    assert client.queries == []
+    assert [name for page in from_snapshot for name in page] == [name for page in queried for name in page]
+    assert [len(page) for page in from_snapshot] == [3, 3, 1]
+
+
+def test_limit_must_be_positive(client):
+    with pytest.raises(ValueError):
+        list(account().iter_workflow_pages(limit=0))
@@ -0,0 +1,75 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+from history_manager import CONDENSED_MARKER, MESSAGE_OVERHEAD_TOKENS, HistoryManager, TokenEstimator
+
+
+def conversation(*texts):
+    roles = ["user", "assistant"]
+    return [{"role": roles[i % 2], "content": [{"text": text}]} for i, text in enumerate(texts)]
+
+
+def manager(max_message_tokens=0):
+    # One token per character, so a message costs MESSAGE_OVERHEAD_TOKENS plus its length
+    return HistoryManager(TokenEstimator(chars_per_token=1), max_message_tokens=max_message_tokens)
+
+
+def cost(*texts):
+    return sum(MESSAGE_OVERHEAD_TOKENS + len(text) for text in texts)
+
+
+def test_history_within_the_budget_is_unchanged():
+    messages = conversation("a" * 10, "b" * 10, "c" * 10)
+    window = manager().window(messages, token_budget=cost("a" * 10, "b" * 10, "c" * 10))
+    assert window.messages is messages
+    assert window.dropped_messages == 0 and window.tokens_saved == 0
+
+
+def test_zero_budget_disables_windowing():
+    messages = conversation("a" * 1000, "b", "c")
+    assert manager().window(messages, token_budget=0).messages is messages
+
+
+def test_oldest_messages_are_dropped_first():
+    messages = conversation("q1" * 10, "a1" * 10, "q2" * 10, "a2" * 10, "q3")
+    budget = cost("q2" * 10, "a2" * 10, "q3")
+    window = manager().window(messages, token_budget=budget)
+    assert window.messages == messages[2:]
+    assert window.tokens == budget
+    assert window.dropped_messages == 2
+    assert window.tokens_saved == cost("q1" * 10, "a1" * 10)
+
+
+def test_window_starts_with_a_user_message():
+    messages = conversation("q1" * 10, "a1" * 10, "q2" * 10, "a2", "q3")
+    # The budget fits the last three messages, the assistant one at the start of the window is dropped
+    window = manager().window(messages, token_budget=cost("a1" * 10, "q2" * 10, "a2", "q3") - 1)
+    assert [message["role"] for message in window.messages] == ["user", "assistant", "user"]
+    assert window.messages == messages[2:]
+    assert window.tokens == cost("q2" * 10, "a2", "q3")
+
+
+def test_latest_message_is_kept_whole_over_the_budget():
+    messages = conversation("q1", "a1", "x" * 500)
+    window = manager(max_message_tokens=50).window(messages, token_budget=100)
+    assert window.messages == messages[2:]
+    assert window.messages[0]["content"][0]["text"] == "x" * 500
+
+
+def test_large_older_messages_are_condensed():
+    answer = "head " + "x" * 300 + " tail"
+    messages = conversation("q1", answer, "q2")
+    window = manager(max_message_tokens=50).window(messages, token_budget=100)
+    condensed = window.messages[1]["content"][0]["text"]
+    assert window.condensed_messages == 1 and window.dropped_messages == 0
+    assert condensed.startswith("head ") and condensed.endswith(" tail") and CONDENSED_MARKER in condensed
+    assert len(condensed) <= 50
+    # The request messages are not modified
+    assert messages[1]["content"][0]["text"] == answer
+
+
+def test_string_content_is_windowed():
+    messages = [{"role": "user", "content": "q1" * 20}, {"role": "assistant", "content": "a1"},
+                {"role": "user", "content": "q2"}]
+    window = manager().window(messages, token_budget=cost("a1", "q2"))
+    assert window.messages == messages[2:]
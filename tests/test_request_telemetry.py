@@ -0,0 +1,41 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import asyncio
+
+import pytest
+
+from apps import call_asgi, load_app, request_body
+from fakes import FakeAccountDataAccess, FakeBedrockRuntime
+from telemetry import InMemorySink, Telemetry
+
+
+class FailingStepFunctions:
+    def start_sync_execution(self, stateMachineArn, input, **kwargs):
+        raise RuntimeError("Rate exceeded")
+
+
+@pytest.fixture
+def web_main(monkeypatch):
+    main = load_app("web")
+    sink = InMemorySink()
+    monkeypatch.setattr(main, "telemetry", Telemetry([sink]))
+    monkeypatch.setattr(main, "AccountDataAccess", FakeAccountDataAccess)
+    monkeypatch.setattr(main, "bedrock_boto_client", FakeBedrockRuntime(output_tokens=3, first_token_latency=0,
+                                                                         inter_token_latency=0))
+    return main, sink
+
+
+@pytest.mark.parametrize("stream_format", ["text", "ndjson"])
+def test_workflow_failure_is_recorded(web_main, monkeypatch, stream_format):
+    web_main, sink = web_main
+    monkeypatch.setattr(web_main, "sf_boto_client", FailingStepFunctions())
+    path, headers, body = request_body("web", stream_format, bypass_workflow_cache=True)
+    response = asyncio.run(call_asgi(web_main.app, path, headers, body))
+
+    assert response["status"] == 200
+    assert b"Rate exceeded" in b"".join(chunk for _, chunk in response["chunks"])
+    record, = sink.records
+    assert record["properties"]["outcome"] == "error"
+    assert record["properties"]["error_type"] == "RuntimeError"
+    assert "workflow" in record["stages"]
@@ -0,0 +1,91 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import asyncio
+import sys
+
+import pytest
+
+from conftest import load_app_module
+from fakes import FakeStepFunctions, retrieval_output
+
+semantic_cache = load_app_module("rag", "semantic_cache")
+
+
+def messages(*texts):
+    roles = ["user", "assistant"]
+    return [{"role": roles[i % 2], "content": text} for i, text in enumerate(texts)]
+
+
+def test_single_turn_is_embedded_as_the_question():
+    assert semantic_cache.conversation_text(messages("What is Lambda?")) == "What is Lambda?"
+    blocks = [{"role": "user", "content": [{"type": "text", "text": "What"}, {"type": "text", "text": "is Lambda?"}]}]
+    assert semantic_cache.conversation_text(blocks) == "What is Lambda?"
+
+
+def test_follow_up_is_embedded_with_the_previous_turn():
+    conversation = messages("What is Lambda?", "A compute service.", "How much does it cost?")
+    assert semantic_cache.conversation_text(conversation) == (
+        "user: What is Lambda?\nassistant: A compute service.\nuser: How much does it cost?"
+    )
+    other = messages("What is S3?", "A storage service.", "How much does it cost?")
+    assert semantic_cache.conversation_text(other) != semantic_cache.conversation_text(conversation)
+
+
+def test_history_window_is_bounded():
+    conversation = messages("First?", "One.", "Second?", "Two.", "Third?")
+    assert semantic_cache.conversation_text(conversation, max_messages=3) == "user: Second?\nassistant: Two.\nuser: Third?"
+    assert semantic_cache.conversation_text(conversation, max_messages=1) == "Third?"
+
+
+def test_trailing_assistant_message_is_not_embedded():
+    conversation = messages("What is Lambda?", "A compute")
+    assert semantic_cache.conversation_text(conversation) == "What is Lambda?"
+
+
+class RecordingSemanticCache:
+    def __init__(self):
+        self.lookups = []
+        self.stored = []
+
+    def lookup(self, namespace, question):
+        self.lookups.append(question)
+        return [1.0], None
+
+    def store(self, namespace, embedding, documents):
+        self.stored.append(documents)
+
+
+@pytest.fixture
+def rag_main(monkeypatch):
+    # The RAG main module imports the inline workflow of its own app
+    monkeypatch.setitem(sys.modules, "inline_workflow", load_app_module("rag", "inline_workflow"))
+    main = load_app_module("rag", "main")
+    cache = RecordingSemanticCache()
+    client = FakeStepFunctions(retrieval_output(), latency=0)
+    monkeypatch.setattr(main, "semantic_cache", cache)
+    # Imported by main only when SEMANTIC_CACHE_ENABLED is set
+    monkeypatch.setattr(main, "conversation_text", semantic_cache.conversation_text, raising=False)
+    monkeypatch.setattr(main, "sf_boto_client", client)
+    return main, cache, client
+
+
+def build_context(main, use_cache):
+    return asyncio.run(main.sf_build_context(
+        messages("What is Lambda?", "A compute service.", "How much does it cost?"), "system", "document", {},
+        use_cache=use_cache,
+    ))
+
+
+def test_lookup_embeds_the_conversation(rag_main):
+    main, cache, client = rag_main
+    build_context(main, use_cache=True)
+    assert cache.lookups == ["user: What is Lambda?\nassistant: A compute service.\nuser: How much does it cost?"]
+    assert len(cache.stored) == 1
+
+
+def test_bypass_skips_the_semantic_cache(rag_main):
+    main, cache, client = rag_main
+    build_context(main, use_cache=False)
+    assert cache.lookups == [] and cache.stored == []
+    assert client.calls == 1
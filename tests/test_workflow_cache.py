@@ -0,0 +1,99 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import asyncio
+
+import pytest
+
+from apps import load_app
+from fakes import FakeStepFunctions, retrieval_output
+from workflow_cache import MemoryCacheBackend, WorkflowCache, normalize, workflow_cache_key
+
+ARN = "arn:aws:states:us-east-1:123456789012:stateMachine:test"
+
+# Output of GenerateResponseKBError in the web application state machine
+KB_ERROR_OUTPUT = {
+    "bedrock_details": {"task_details": [], "total_input_tokens": 0, "total_output_tokens": 0},
+    "system_chain_data": {"system_chain_prompt": "You are an error handler task.", "operation": "REPLACE_ALL"},
+    "error": True,
+}
+
+
+def workflow_input(question, **custom_params):
+    return {"PromptInput": [{"role": "user", "content": question}], "state_machine_custom_params": custom_params}
+
+
+def test_normalize_collapses_whitespace_and_case():
+    assert normalize("  What   is\nAWS? ") == "what is aws?"
+
+
+def test_key_ignores_case_and_whitespace_of_the_question():
+    assert workflow_cache_key(ARN, workflow_input("What  is AWS? ")) == workflow_cache_key(ARN, workflow_input("what is aws?"))
+
+
+def test_key_normalizes_text_blocks():
+    def blocks(text):
+        return {"PromptInput": [{"role": "user", "content": [{"type": "text", "text": text}]}]}
+
+    assert workflow_cache_key(ARN, blocks("Hi  There")) == workflow_cache_key(ARN, blocks("hi there"))
+
+
+def test_key_keeps_custom_params_exact():
+    assert (workflow_cache_key(ARN, workflow_input("q", kb_id="ABC"))
+            != workflow_cache_key(ARN, workflow_input("q", kb_id="abc")))
+    assert (workflow_cache_key(ARN, workflow_input("q", prefix="docs/a b"))
+            != workflow_cache_key(ARN, workflow_input("q", prefix="docs/a  b")))
+
+
+def test_key_keeps_roles_and_workflow():
+    assistant = {"PromptInput": [{"role": "assistant", "content": "q"}]}
+    user = {"PromptInput": [{"role": "user", "content": "q"}]}
+    assert workflow_cache_key(ARN, assistant) != workflow_cache_key(ARN, user)
+    assert workflow_cache_key(ARN, user) != workflow_cache_key(ARN + "2", user)
+
+
+@pytest.fixture
+def web_main(monkeypatch):
+    main = load_app("web")
+    monkeypatch.setattr(main, "workflow_cache", WorkflowCache(MemoryCacheBackend(), ttl=60))
+    monkeypatch.setattr(main, "WORKFLOW_COALESCING", True)
+    return main
+
+
+def run_workflows(main, client, count=1, use_cache=True):
+    async def run():
+        return await asyncio.gather(*(
+            main.execute_workflow(ARN, workflow_input("What is AWS?"), use_cache=use_cache, workflow_client=client)
+            for _ in range(count)
+        ))
+    return asyncio.run(run())
+
+
+def test_results_are_cached(web_main):
+    client = FakeStepFunctions(retrieval_output(), latency=0)
+    run_workflows(web_main, client)
+    run_workflows(web_main, client)
+    assert client.calls == 1
+
+
+def test_knowledge_base_error_output_is_not_cached(web_main):
+    client = FakeStepFunctions(KB_ERROR_OUTPUT, latency=0)
+    first, = run_workflows(web_main, client)
+    run_workflows(web_main, client)
+    assert first.error
+    assert client.calls == 2
+
+
+def test_caught_error_in_context_data_is_not_cached(web_main):
+    output = dict(retrieval_output(), context_data=[{"Error": "ResourceNotFoundException", "Cause": "no KB"}])
+    client = FakeStepFunctions(output, latency=0)
+    run_workflows(web_main, client)
+    run_workflows(web_main, client)
+    assert client.calls == 2
+
+
+def test_bypass_skips_the_cached_result_but_still_coalesces(web_main):
+    client = FakeStepFunctions(retrieval_output(), latency=0.1)
+    run_workflows(web_main, client)
+    run_workflows(web_main, client, count=3, use_cache=False)
+    assert client.calls == 2
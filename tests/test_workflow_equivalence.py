@@ -0,0 +1,88 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# The in-process workflow engine of each app must return what its state machines return, run by the local ASL
+# interpreter against the same fake Bedrock models and Knowledge Base.
+
+import argparse
+import asyncio
+import json
+
+import pytest
+
+from apps import APP_ENV
+from asl_interpreter import (INVOKE_MODEL, RETRIEVE, STATE_MACHINE_DIRS, STATE_MACHINE_VARIANTS, LocalStateMachine,
+                             load_definition)
+from bench_workflow import KNOWLEDGE_BASE_ID, conversation, create_fakes
+from conftest import load_app_module
+
+ARGS = argparse.Namespace(
+    keywords_latency="fixed:0", policy_latency="fixed:0", retrieve_latency="fixed:0", retrieve_rate=0.7,
+    retrieve_error_rate=0.2, min_top_score=0.3, documents=3, document_chars=200, seed=0,
+)
+
+
+def non_ascii_question(app_name):
+    question = conversation(app_name, 0)
+    text = "¿Cómo despliego el servicio con AWS SAM? 日本語"
+    question["PromptInput"][-1]["content"] = [{"text": text}] if app_name == "web" else text
+    return question
+
+
+def run_asl(app_name, variant, workflow_inputs, args=ARGS):
+    models, knowledge_base = create_fakes(args)
+    definition = load_definition(STATE_MACHINE_DIRS[app_name] / STATE_MACHINE_VARIANTS[variant],
+                                 {"AWSRegion": APP_ENV["AWS_DEFAULT_REGION"], "KnowledgeBaseId": KNOWLEDGE_BASE_ID})
+    machine = LocalStateMachine(definition, {INVOKE_MODEL: models, RETRIEVE: knowledge_base})
+
+    async def run():
+        return [await machine.execute(input_data) for input_data in workflow_inputs]
+
+    executions = asyncio.run(run())
+    assert all(execution.status == "SUCCEEDED" for execution in executions)
+    return [execution.output for execution in executions], knowledge_base.queries
+
+
+def run_inline(app_name, variant, workflow_inputs, args=ARGS):
+    inline_workflow = load_app_module(app_name, "inline_workflow")
+    models, knowledge_base = create_fakes(args)
+    engine = inline_workflow.InlineWorkflow(models, knowledge_base, KNOWLEDGE_BASE_ID,
+                                            speculative_retrieval=variant == "speculative")
+
+    async def run():
+        return [await engine.start_sync_execution(engine.name, json.dumps(input_data))
+                for input_data in workflow_inputs]
+
+    responses = asyncio.run(run())
+    assert all(response["status"] == "SUCCEEDED" for response in responses)
+    return [json.loads(response["output"]) for response in responses], knowledge_base.queries
+
+
+@pytest.mark.parametrize("variant", list(STATE_MACHINE_VARIANTS))
+@pytest.mark.parametrize("app_name", ["rag", "web"])
+def test_inline_workflow_matches_the_state_machine(app_name, variant):
+    workflow_inputs = [conversation(app_name, index) for index in range(20)]
+    asl_outputs, asl_queries = run_asl(app_name, variant, workflow_inputs)
+    inline_outputs, inline_queries = run_inline(app_name, variant, workflow_inputs)
+
+    assert inline_outputs == asl_outputs
+    assert inline_queries == asl_queries
+
+
+@pytest.mark.parametrize("app_name", ["rag", "web"])
+def test_non_ascii_retrieve_query_matches_the_state_machine(app_name):
+    # The question reaches the Retrieve query through States.Format, as JSON for the web app content blocks
+    args = argparse.Namespace(**dict(vars(ARGS), retrieve_rate=1.0, retrieve_error_rate=0.0))
+    workflow_inputs = [non_ascii_question(app_name)]
+    _, asl_queries = run_asl(app_name, "standard", workflow_inputs, args)
+    _, inline_queries = run_inline(app_name, "standard", workflow_inputs, args)
+
+    assert inline_queries == asl_queries
+    assert "日本語" in inline_queries[0]
+
+
+def test_format_argument_matches_json_to_string():
+    inline_workflow = load_app_module("web", "inline_workflow")
+    value = [{"text": "Déjà vu", "n": 1}]
+    assert inline_workflow.format_argument(value) == '[{"text":"Déjà vu","n":1}]'
+    assert inline_workflow.format_argument("Déjà vu") == "Déjà vu"